@@ -835,18 +835,13 @@ export class CandleChart {
     if (this.priceStream && this.priceStream.ws && this.priceStream.ws.readyState === WebSocket.OPEN) {
       // Calculate the actual time range that will be displayed
       const [domainStart, domainEnd] = buildXScale(800, this.config.margin, this.config.window, this.sessionOffset).domain();
-      const startTime = domainStart.getTime();
-      const endTime = domainEnd.getTime();
-      
-      // Convert to hours offset from now
-      const nowUtc = Date.now();
-      const startOffsetHours = Math.max(0, Math.ceil((nowUtc - startTime) / (60 * 60 * 1000)));
-      const endOffsetHours = Math.max(0, Math.ceil((nowUtc - endTime) / (60 * 60 * 1000)));
-      
+
+      // Absolute epoch seconds: the server widens them to whole sessions,
+      // so everyone scrolled to the same place shares a cached response
       this.priceStream.ws.send(JSON.stringify({
-        type: "fetch",
-        start_offset_hours: startOffsetHours,
-        end_offset_hours: endOffsetHours,
+        type: "history",
+        start: Math.floor(domainStart.getTime() / 1000),
+        end: Math.floor(domainEnd.getTime() / 1000),
         metal: this.config.metal
       }));
     }
@@ -15,9 +15,13 @@ const silverChart = new CandleChart("silver-chart", {
 goldChart.render([]);
 silverChart.render([]);
 
+// Live candles are built server-side; history fetches still arrive as
+// ticks and are aggregated here
 const priceStream = new PriceStream("ws://localhost:18801")
   .on("gold", (data) => goldChart.render(createOHLC(data)))
-  .on("silver", (data) => silverChart.render(createOHLC(data)));
+  .on("silver", (data) => silverChart.render(createOHLC(data)))
+  .onCandles("gold", 5, (candles) => goldChart.render(candles))
+  .onCandles("silver", 5, (candles) => silverChart.render(candles));
 
 goldChart.priceStream = priceStream;
 silverChart.priceStream = priceStream;
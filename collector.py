@@ -1,25 +1,40 @@
 #!/usr/bin/env python3
+import argparse
+import csv
+import hashlib
 import json
 import logging
 import os
-import random
 import re
+import socket
 import sqlite3
 import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date, datetime
 from datetime import time as dtime
 from datetime import timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+from urllib.parse import unquote
 
 import pytz  # type: ignore
 import requests
+from requests.adapters import HTTPAdapter
+
+from instruments import Instrument, due_instruments, load_instruments
+from storage import connect_writer
 
 LOG = logging.getLogger("collector")
 
 _DELAY_RE = re.compile(
     r"^\s*(\d{4})年(\d{1,2})月(\d{1,2})日\s+(\d{1,2}):(\d{2}):(\d{2})\s*$"
 )
-SGE_URL = "https://en.sge.com.cn/graph/quotations"
+SGE_URL = os.environ.get("SGE_URL", "https://en.sge.com.cn/graph/quotations")
+FX_URL = os.environ.get(
+    "ALPHA_VANTAGE_URL", "https://www.alphavantage.co/query"
+)
 SH_TZ = pytz.timezone("Asia/Shanghai")
 
 FX_DEFAULT = 7.0060
@@ -29,19 +44,49 @@ FX_REFRESH_SEC = 3600
 STALE_DATA_THRESHOLD_MIN = int(os.environ.get("STALE_DATA_THRESHOLD_MIN", "5"))
 # Add extra buffer to avoid storing provisional prices (0 = disabled)
 PRICE_BUFFER_MIN = int(os.environ.get("PRICE_BUFFER_MIN", "0"))
+# Seconds after a minute closes before polling SGE for it
+POLL_DELAY_SEC = int(os.environ.get("POLL_DELAY_SEC", "3"))
+# Exchange holidays (comma-separated ISO dates) on which no session runs
+SGE_HOLIDAYS = os.environ.get("SGE_HOLIDAYS", "")
+# Trailing minutes re-examined every poll in case SGE revises them
+REVISION_WINDOW_MIN = int(os.environ.get("REVISION_WINDOW_MIN", "5"))
+# Points hashed just before the revision window to detect a changed prefix
+FINGERPRINT_POINTS = 3
+# Rows per transaction when migrating a v1 database
+MIGRATE_BATCH_ROWS = 50_000
+# Rows per transaction when backfilling history
+BACKFILL_CHUNK_ROWS = 100_000
+# PRAGMA user_version of the current schema
+# (2 = integer epoch `ts`, 3 = FX in its own `fx_rates` series,
+#  4 = `price_changes` feed, 5 = `price_rollups` OHLC tables,
+#  6 = `sessions` index)
+SCHEMA_VERSION = 6
+# Change-feed entries kept for readers catching up; older ones are pruned
+CHANGE_LOG_ROWS = 100_000
+# OHLC rollup resolutions in seconds: 5m, 1h and one trading day. Each
+# nests in the next and is rebuilt from it, so rollups outlive raw rows.
+ROLLUP_RESOLUTIONS = (300, 3600, 86400)
+# Buckets are anchored at 20:00 Shanghai (12:00 UTC), where a trading day
+# starts, as in trading_day_start_date_sh
+ROLLUP_ANCHOR = 12 * 3600
+# Days of raw minute prices kept; rollups are kept forever (0 = keep all)
+RAW_RETENTION_DAYS = int(os.environ.get("RAW_RETENTION_DAYS", "0"))
+# Upper bound on concurrent SGE requests per cycle
+FETCH_MAX_WORKERS = int(os.environ.get("FETCH_MAX_WORKERS", "8"))
+# Unix datagram socket the WebSocket server listens on for new-data pings
+# (default: the database path plus ".notify")
+NOTIFY_SOCK = os.environ.get("SHANGHAI_NOTIFY_SOCK")
+
+
+INSTRUMENTS = load_instruments()
 
 
 @dataclass(frozen=True)
-class Instrument:
-    metal: str  # "gold" | "silver"
-    instid: str  # e.g. "Au(T%2BD)"
-    unit: str  # "CNY/g" or "CNY/kg"
-
-
-INSTRUMENTS = [
-    Instrument(metal="gold", instid="Au(T%2BD)", unit="CNY/g"),
-    Instrument(metal="silver", instid="Ag(T%2BD)", unit="CNY/kg"),
-]
+class IngestMark:
+    trading_day: str  # ISO date of the 20:00 trading-day start
+    watermark: int | None  # latest stored ts (epoch seconds)
+    resume_index: int  # payload index where the next poll starts
+    fingerprint: str  # hash of the points just before resume_index
 
 
 def http_headers():
@@ -56,6 +101,18 @@ def http_headers():
     }
 
 
+def make_http_session(
+    pool_size: int = FETCH_MAX_WORKERS,
+) -> requests.Session:
+    """Return a keep-alive session whose pool fits one request per worker."""
+    session = requests.Session()
+    session.headers.update(http_headers())
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def trading_day_start_date_sh(now_sh: datetime) -> date:
     """Get trading day start date (20:00 Shanghai time marks new day)."""
     # trading day starts at 20:00 Shanghai wall time
@@ -69,6 +126,19 @@ def last_closed_minute_sh(now_sh: datetime) -> datetime:
     return now_sh.replace(second=0, microsecond=0) - timedelta(minutes=1)
 
 
+def session_bounds_sh(
+    td0: date,
+) -> tuple[datetime, datetime, datetime, datetime]:
+    """Return night start/end and day start/end for a trading day."""
+    next_day = td0 + timedelta(days=1)
+    return (
+        SH_TZ.localize(datetime.combine(td0, dtime(20, 0))),
+        SH_TZ.localize(datetime.combine(next_day, dtime(2, 30))),
+        SH_TZ.localize(datetime.combine(next_day, dtime(9, 0))),
+        SH_TZ.localize(datetime.combine(next_day, dtime(15, 30))),
+    )
+
+
 def market_cutoff_sh(now_sh: datetime) -> datetime:
     """
     Latest minute we consider valid for writes.
@@ -76,12 +146,7 @@ def market_cutoff_sh(now_sh: datetime) -> datetime:
     If we're between sessions: the last session end (02:30 or 15:30).
     """
     td0 = trading_day_start_date_sh(now_sh)
-
-    night_start = SH_TZ.localize(datetime.combine(td0, dtime(20, 0)))
-    next_day = td0 + timedelta(days=1)
-    night_end = SH_TZ.localize(datetime.combine(next_day, dtime(2, 30)))
-    day_start = SH_TZ.localize(datetime.combine(next_day, dtime(9, 0)))
-    day_end = SH_TZ.localize(datetime.combine(next_day, dtime(15, 30)))
+    night_start, night_end, day_start, day_end = session_bounds_sh(td0)
 
     if night_start < now_sh < night_end:
         return last_closed_minute_sh(now_sh)
@@ -96,6 +161,74 @@ def market_cutoff_sh(now_sh: datetime) -> datetime:
     return day_end
 
 
+def parse_holidays(spec: str) -> frozenset[date]:
+    """Parse a comma-separated list of ISO dates."""
+    return frozenset(
+        date.fromisoformat(d.strip()) for d in spec.split(",") if d.strip()
+    )
+
+
+HOLIDAYS = parse_holidays(SGE_HOLIDAYS)
+
+
+def is_trading_date(d: date) -> bool:
+    """Default holiday calendar: weekdays not listed in SGE_HOLIDAYS."""
+    return d.weekday() < 5 and d not in HOLIDAYS
+
+
+def upcoming_sessions_sh(
+    now_sh: datetime,
+    is_open: Callable[[date], bool] = is_trading_date,
+    days: int = 30,
+) -> Iterator[tuple[datetime, datetime]]:
+    """Yield (start, end) of open sessions from the current trading day on.
+
+    The night session belongs to the next business day, so it only runs
+    when both its evening date and that business day are open.
+    """
+    td0 = trading_day_start_date_sh(now_sh)
+    for i in range(days):
+        td = td0 + timedelta(days=i)
+        night_start, night_end, day_start, day_end = session_bounds_sh(td)
+        business = td + timedelta(days=1)
+        while business.weekday() >= 5:
+            business += timedelta(days=1)
+        if is_open(td) and is_open(business):
+            yield night_start, night_end
+        if is_open(td + timedelta(days=1)):
+            yield day_start, day_end
+
+
+def next_poll_sh(
+    now_sh: datetime,
+    is_open: Callable[[date], bool] = is_trading_date,
+) -> datetime:
+    """
+    When the collector should next poll SGE.
+    In a session: POLL_DELAY_SEC after the next minute closes.
+    Between sessions or on closed days: just after the session's first
+    minute closes, so the first poll already anchors to the new trading
+    day rather than the one before the open.
+    Polling continues briefly past each session end so the final
+    (buffered) minutes still get stored.
+    """
+    delay = timedelta(seconds=POLL_DELAY_SEC)
+    grace = timedelta(minutes=PRICE_BUFFER_MIN + 1)
+
+    candidate = now_sh.replace(second=0, microsecond=0) + delay
+    if candidate <= now_sh:
+        candidate += timedelta(minutes=1)
+
+    for start, end in upcoming_sessions_sh(now_sh, is_open):
+        first = start + timedelta(minutes=1) + delay
+        if now_sh < start:
+            return first
+        if candidate <= end + grace + delay:
+            return max(candidate, first)
+
+    return now_sh + timedelta(seconds=FETCH_INTERVAL_SEC)
+
+
 def parse_delaystr_sh(delaystr: str | None) -> datetime | None:
     """Parse SGE delay string to Shanghai timezone datetime."""
     if not delaystr:
@@ -108,33 +241,92 @@ def parse_delaystr_sh(delaystr: str | None) -> datetime | None:
     return SH_TZ.localize(naive)
 
 
-def parse_point_timestamp_iso(
-    time_hhmm: str, cutoff_sh: datetime
-) -> str | None:
-    """Convert HH:MM to ISO8601 (+08:00) using SGE trading-day anchoring."""
+def epoch_to_iso_sh(ts: int) -> str:
+    """Format epoch seconds as ISO8601 in Shanghai time (+08:00)."""
+    return datetime.fromtimestamp(ts, SH_TZ).isoformat()
+
+
+# Sentinel in epoch arrays for unparseable or not-yet-valid points
+INVALID_TS = -1
+
+# "HH:MM" (and unpadded "H:MM") -> minute of day, built once
+_MINUTE_OF_DAY = {
+    fmt.format(h, m): h * 60 + m
+    for h in range(24)
+    for m in range(60)
+    for fmt in ("{:02d}:{:02d}", "{}:{:02d}")
+}
+
+
+def _minute_of_day(time_hhmm: str) -> int:
+    """Minute of day for an HH:MM string, or -1 if it does not parse."""
+    idx = _MINUTE_OF_DAY.get(time_hhmm)
+    if idx is not None:
+        return idx
     try:
         hh, mm = map(int, time_hhmm.split(":"))
     except Exception:
-        return None
+        return -1
+    return hh * 60 + mm if 0 <= hh < 24 and 0 <= mm < 60 else -1
 
-    td0 = trading_day_start_date_sh(cutoff_sh)
-    point_date = td0 if hh >= 20 else (td0 + timedelta(days=1))
 
-    naive = datetime.combine(point_date, dtime(hh, mm))
-    point_sh = SH_TZ.localize(naive)
+@lru_cache(maxsize=8)
+def trading_day_offsets(td0: date) -> array:
+    """
+    Epoch seconds for every minute of day, anchored to trading day td0:
+    20:00-23:59 fall on td0, 00:00-19:59 on the following calendar day.
+    """
+    base = int(SH_TZ.localize(datetime.combine(td0, dtime(0, 0))).timestamp())
+    night = 20 * 60
+    return array(
+        "q",
+        (base + (m if m >= night else m + 1440) * 60 for m in range(1440)),
+    )
 
-    # Points are minute-resolution; compare against minute-floored cutoff.
-    cutoff_floor = cutoff_sh.replace(second=0, microsecond=0)
-    if point_sh > cutoff_floor:
-        return None
 
-    return point_sh.isoformat()
+def parse_points_epoch(times: list[str], cutoff_sh: datetime) -> array:
+    """
+    Convert a payload's HH:MM list to epoch seconds in one pass, using the
+    trading day's precomputed offset table. Points that do not parse or
+    fall after the minute-floored cutoff are masked with INVALID_TS.
+    """
+    offsets = trading_day_offsets(trading_day_start_date_sh(cutoff_sh))
+    cutoff = int(cutoff_sh.replace(second=0, microsecond=0).timestamp())
+    lookup = _MINUTE_OF_DAY.get
+    out = array("q", bytes(8 * len(times)))
+    for i, t in enumerate(times):
+        m = lookup(t)
+        if m is None:
+            m = _minute_of_day(t)
+        if m >= 0:
+            ts = offsets[m]
+            out[i] = ts if ts <= cutoff else INVALID_TS
+        else:
+            out[i] = INVALID_TS
+    return out
+
+
+def parse_point_epoch(time_hhmm: str, cutoff_sh: datetime) -> int | None:
+    """Convert HH:MM to epoch seconds using SGE trading-day anchoring."""
+    ts = parse_points_epoch([time_hhmm], cutoff_sh)[0]
+    return None if ts == INVALID_TS else ts
+
 
+def parse_point_timestamp_iso(
+    time_hhmm: str, cutoff_sh: datetime
+) -> str | None:
+    """Convert HH:MM to ISO8601 (+08:00) using SGE trading-day anchoring."""
+    ts = parse_point_epoch(time_hhmm, cutoff_sh)
+    return epoch_to_iso_sh(ts) if ts is not None else None
 
-def fetch_sge(inst: Instrument) -> tuple[list[str], list[float], dict]:
+
+def fetch_sge(
+    inst: Instrument, session: requests.Session | None = None
+) -> tuple[list[str], list[float], dict]:
     """Fetch price data from SGE API for given instrument."""
+    post = session.post if session is not None else requests.post
     try:
-        resp = requests.post(
+        resp = post(
             SGE_URL,
             headers=http_headers(),
             data="instid=" + inst.instid,
@@ -171,6 +363,33 @@ def fetch_sge(inst: Instrument) -> tuple[list[str], list[float], dict]:
     return times, prices, meta
 
 
+def fetch_all(
+    instruments: list[Instrument],
+    session: requests.Session | None = None,
+    max_workers: int = FETCH_MAX_WORKERS,
+    return_exceptions: bool = False,
+) -> list:
+    """Fetch all instruments concurrently, preserving input order.
+
+    Wall time tracks the slowest instrument instead of the sum of all of
+    them. The first failed request is re-raised once every fetch settles,
+    unless `return_exceptions` is set, in which case failed entries hold
+    the exception instead of a (times, prices, meta) tuple.
+    """
+    if not instruments:
+        return []
+    workers = max(1, min(max_workers, len(instruments)))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="sge-fetch"
+    ) as pool:
+        futures = [
+            pool.submit(fetch_sge, inst, session) for inst in instruments
+        ]
+    if not return_exceptions:
+        return [f.result() for f in futures]
+    return [f.exception() or f.result() for f in futures]
+
+
 def can_make_fx_request(conn: sqlite3.Connection) -> bool:
     """Check if we can make another Alpha Vantage API request today."""
     try:
@@ -204,12 +423,47 @@ def inc_fx_request(conn: sqlite3.Connection) -> None:
 def get_cached_fx(conn: sqlite3.Connection) -> float:
     """Get the most recent USD/CNY exchange rate from database."""
     row = conn.execute(
-        "SELECT usd_cny_rate FROM prices WHERE usd_cny_rate IS NOT NULL "
-        "ORDER BY timestamp DESC LIMIT 1"
+        "SELECT rate FROM fx_rates ORDER BY ts DESC LIMIT 1"
     ).fetchone()
     return float(row[0]) if row else FX_DEFAULT
 
 
+def record_fx(
+    conn: sqlite3.Connection, rate: float, ts: int | None = None
+) -> bool:
+    """Append a rate to the FX series if it differs from the latest one."""
+    row = conn.execute(
+        "SELECT rate FROM fx_rates ORDER BY ts DESC LIMIT 1"
+    ).fetchone()
+    if row and row[0] == rate:
+        return False
+    conn.execute(
+        "INSERT OR REPLACE INTO fx_rates(ts, rate) VALUES(?, ?)",
+        (int(time.time()) if ts is None else ts, float(rate)),
+    )
+    conn.commit()
+    return True
+
+
+def notify_socket_path(db_path: str) -> str:
+    """Where readers of `db_path` listen for commit notifications."""
+    return NOTIFY_SOCK or db_path + ".notify"
+
+
+def notify_readers(path: str) -> bool:
+    """
+    Ping the server after a commit so it fans out without waiting for its
+    fallback poll. Best effort: a missing or busy listener is ignored.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"changed", path)
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
 def fetch_fx(
     conn: sqlite3.Connection, current_fx: float, backoff: float = 1.0
 ) -> tuple[float, float]:
@@ -222,7 +476,7 @@ def fetch_fx(
         return get_cached_fx(conn), backoff
 
     url = (
-        "https://www.alphavantage.co/query"
+        f"{FX_URL}"
         "?function=CURRENCY_EXCHANGE_RATE&from_currency=USD&to_currency=CNY"
         f"&apikey={api_key}"
     )
@@ -255,108 +509,659 @@ def fetch_fx(
         return get_cached_fx(conn), min(backoff * 2, 300.0)
 
 
-def init_db(path: str) -> sqlite3.Connection:
-    """Initialize SQLite database with required tables."""
-    conn = sqlite3.connect(path)
-    conn.execute(
-        """
-      CREATE TABLE IF NOT EXISTS prices (
+PRICES_DDL = """
+      CREATE TABLE IF NOT EXISTS {name} (
         metal TEXT NOT NULL,
-        timestamp TEXT NOT NULL,            -- ISO8601 with +08:00
+        ts INTEGER NOT NULL,                -- epoch seconds (UTC)
         price_cny REAL NOT NULL,
-        usd_cny_rate REAL,
-        PRIMARY KEY (metal, timestamp)
+        PRIMARY KEY (metal, ts)
+      ) WITHOUT ROWID
+    """
+
+FX_RATES_DDL = """
+      CREATE TABLE IF NOT EXISTS fx_rates (
+        ts INTEGER PRIMARY KEY,             -- epoch seconds of the change
+        rate REAL NOT NULL                  -- USD/CNY
       )
     """
+
+# Live polls and backfill share these last-write-wins semantics
+PRICE_UPSERT_SQL = (
+    "INSERT INTO prices(metal, ts, price_cny) VALUES(?, ?, ?) "
+    "ON CONFLICT(metal, ts) DO UPDATE SET price_cny = excluded.price_cny"
+)
+
+# Every insert or revision of a price gets the next `seq`, so readers can
+# ask for "what changed since seq N". AUTOINCREMENT keeps `seq` monotonic
+# across pruning.
+PRICE_CHANGES_DDL = (
+    """
+      CREATE TABLE IF NOT EXISTS price_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        metal TEXT NOT NULL,
+        ts INTEGER NOT NULL
+      )
+    """,
+    """
+      CREATE TRIGGER IF NOT EXISTS prices_log_insert
+      AFTER INSERT ON prices
+      BEGIN
+        INSERT INTO price_changes(metal, ts) VALUES (new.metal, new.ts);
+      END
+    """,
+    """
+      CREATE TRIGGER IF NOT EXISTS prices_log_update
+      AFTER UPDATE OF price_cny ON prices
+      WHEN old.price_cny IS NOT new.price_cny
+      BEGIN
+        INSERT INTO price_changes(metal, ts) VALUES (new.metal, new.ts);
+      END
+    """,
+)
+
+PRICE_ROLLUPS_DDL = """
+      CREATE TABLE IF NOT EXISTS price_rollups (
+        metal TEXT NOT NULL,
+        resolution INTEGER NOT NULL,        -- bucket width in seconds
+        bucket INTEGER NOT NULL,            -- epoch seconds of bucket start
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        points INTEGER NOT NULL,            -- raw minutes aggregated
+        PRIMARY KEY (metal, resolution, bucket)
+      ) WITHOUT ROWID
+    """
+
+_ROLLUP_UPSERT = (
+    "INSERT INTO price_rollups"
+    "(metal, resolution, bucket, open, high, low, close, points) "
+)
+_ROLLUP_ON_CONFLICT = (
+    " ON CONFLICT(metal, resolution, bucket) DO UPDATE SET "
+    "open = excluded.open, high = excluded.high, low = excluded.low, "
+    "close = excluded.close, points = excluded.points"
+)
+
+# Recompute one finest bucket from raw minutes
+ROLLUP_FROM_PRICES_SQL = _ROLLUP_UPSERT + """
+    SELECT :metal, :res, :bucket,
+      (SELECT price_cny FROM prices
+       WHERE metal = :metal AND ts >= :bucket AND ts < :end
+       ORDER BY ts LIMIT 1),
+      MAX(price_cny), MIN(price_cny),
+      (SELECT price_cny FROM prices
+       WHERE metal = :metal AND ts >= :bucket AND ts < :end
+       ORDER BY ts DESC LIMIT 1),
+      COUNT(*)
+    FROM prices
+    WHERE metal = :metal AND ts >= :bucket AND ts < :end
+    HAVING COUNT(*) > 0
+    """ + _ROLLUP_ON_CONFLICT
+
+# Recompute one coarser bucket from the finer rollup nested in it
+ROLLUP_FROM_ROLLUPS_SQL = _ROLLUP_UPSERT + """
+    SELECT :metal, :res, :bucket,
+      (SELECT open FROM price_rollups
+       WHERE metal = :metal AND resolution = :child
+         AND bucket >= :bucket AND bucket < :end
+       ORDER BY bucket LIMIT 1),
+      MAX(high), MIN(low),
+      (SELECT close FROM price_rollups
+       WHERE metal = :metal AND resolution = :child
+         AND bucket >= :bucket AND bucket < :end
+       ORDER BY bucket DESC LIMIT 1),
+      SUM(points)
+    FROM price_rollups
+    WHERE metal = :metal AND resolution = :child
+      AND bucket >= :bucket AND bucket < :end
+    HAVING COUNT(*) > 0
+    """ + _ROLLUP_ON_CONFLICT
+
+# One row per trading session with data, keyed for "last N sessions"
+SESSIONS_DDL = """
+      CREATE TABLE IF NOT EXISTS sessions (
+        metal TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,          -- scheduled session start
+        end_ts INTEGER NOT NULL,            -- scheduled session end
+        session_id TEXT NOT NULL,           -- "YYYY-MM-DD/night" | "/day"
+        kind TEXT NOT NULL,                 -- "night" | "day"
+        first_ts INTEGER NOT NULL,          -- first stored minute
+        last_ts INTEGER NOT NULL,           -- last stored minute
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        points INTEGER NOT NULL,
+        PRIMARY KEY (metal, start_ts)
+      ) WITHOUT ROWID
+    """
+
+# Lets the server find the newest session starts across metals without
+# scanning the table
+SESSIONS_START_DDL = """
+      CREATE INDEX IF NOT EXISTS sessions_start ON sessions(start_ts)
+    """
+
+# Recompute one session's summary from its 5m rollups; first/last minute
+# come from raw prices while they are retained
+SESSION_UPSERT_SQL = """
+    INSERT INTO sessions(metal, start_ts, end_ts, session_id, kind,
+                         first_ts, last_ts, open, high, low, close, points)
+    SELECT :metal, :start, :end, :id, :kind,
+      COALESCE(
+        (SELECT MIN(ts) FROM prices
+         WHERE metal = :metal AND ts BETWEEN :start AND :end),
+        (SELECT first_ts FROM sessions
+         WHERE metal = :metal AND start_ts = :start),
+        MIN(bucket)),
+      COALESCE(
+        (SELECT MAX(ts) FROM prices
+         WHERE metal = :metal AND ts BETWEEN :start AND :end),
+        (SELECT last_ts FROM sessions
+         WHERE metal = :metal AND start_ts = :start),
+        MAX(bucket)),
+      (SELECT open FROM price_rollups
+       WHERE metal = :metal AND resolution = 300
+         AND bucket BETWEEN :start AND :end
+       ORDER BY bucket LIMIT 1),
+      MAX(high), MIN(low),
+      (SELECT close FROM price_rollups
+       WHERE metal = :metal AND resolution = 300
+         AND bucket BETWEEN :start AND :end
+       ORDER BY bucket DESC LIMIT 1),
+      SUM(points)
+    FROM price_rollups
+    WHERE metal = :metal AND resolution = 300
+      AND bucket BETWEEN :start AND :end
+    HAVING COUNT(*) > 0
+    ON CONFLICT(metal, start_ts) DO UPDATE SET
+      first_ts = excluded.first_ts, last_ts = excluded.last_ts,
+      open = excluded.open, high = excluded.high, low = excluded.low,
+      close = excluded.close, points = excluded.points
+"""
+
+INGEST_STATE_DDL = """
+      CREATE TABLE IF NOT EXISTS ingest_state (
+        metal TEXT PRIMARY KEY,
+        trading_day TEXT NOT NULL,
+        watermark INTEGER,                  -- latest stored ts
+        resume_index INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL
+      )
+    """
+
+# Per legacy schema: (ts expression, key column, "recent rows" predicate)
+_LEGACY_PRICES = {
+    1: (
+        "CAST(strftime('%s', timestamp) AS INTEGER)",
+        "timestamp",
+        "datetime(timestamp) >= datetime(?, 'unixepoch')",
+    ),
+    2: ("ts", "ts", "ts >= ?"),
+}
+
+
+def _legacy_prices_version(conn: sqlite3.Connection) -> int | None:
+    """Schema version of an outdated `prices` table, or None if current."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(prices)")}
+    if "timestamp" in cols:
+        return 1  # ISO8601 TEXT timestamps
+    if "usd_cny_rate" in cols:
+        return 2  # epoch ts, FX repeated on every row
+    return None
+
+
+def migrate_db(
+    conn: sqlite3.Connection, batch_rows: int = MIGRATE_BATCH_ROWS
+) -> int:
+    """
+    Migrate an outdated `prices` table to the current schema: epoch-second
+    `ts` keys, with FX moved out into the `fx_rates` change series.
+    Rows are copied in short batched transactions so readers and the
+    collector keep running; the final catch-up and table swap happen in
+    one write-locked transaction, then the remaining tables are created
+    and built by `ensure_schema`. Returns the number of rows copied.
+    """
+    version = _legacy_prices_version(conn)
+    if version is None:
+        return 0
+    ts_expr, key, recent = _LEGACY_PRICES[version]
+
+    conn.execute(PRICES_DDL.format(name="prices_new"))
+    conn.execute(FX_RATES_DDL)
+    conn.commit()
+
+    copy_sql = (
+        "INSERT OR REPLACE INTO prices_new(metal, ts, price_cny) "
+        f"SELECT metal, {ts_expr}, price_cny FROM prices "
     )
-    conn.execute(
-        """
+    started = int(time.time())
+    last: tuple = ("", "" if version == 1 else 0)
+    copied = 0
+    while True:
+        upper = conn.execute(
+            f"SELECT metal, {key} FROM prices WHERE (metal, {key}) > (?, ?) "
+            f"ORDER BY metal, {key} LIMIT 1 OFFSET ?",
+            (*last, batch_rows - 1),
+        ).fetchone()
+        if upper is None:
+            break
+        cur = conn.execute(
+            copy_sql + f"WHERE (metal, {key}) > (?, ?) "
+            f"AND (metal, {key}) <= (?, ?)",
+            (*last, *upper),
+        )
+        conn.commit()
+        copied += cur.rowcount
+        last = tuple(upper)
+        LOG.info("migrate: copied %d rows (at %s %s)", copied, *last)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Catch up rows added or revised behind the cursor since we started
+        cur = conn.execute(
+            copy_sql + f"WHERE (metal, {key}) > (?, ?) OR {recent}",
+            (*last, started - 3600),
+        )
+        copied += cur.rowcount
+        # Keep only the points where the repeated FX column changed
+        conn.execute(
+            "INSERT OR REPLACE INTO fx_rates(ts, rate) "
+            "SELECT ts, rate FROM ("
+            "  SELECT ts, rate, LAG(rate) OVER (ORDER BY ts) AS prev FROM ("
+            f"    SELECT {ts_expr} AS ts, MAX(usd_cny_rate) AS rate "
+            "    FROM prices WHERE usd_cny_rate IS NOT NULL GROUP BY 1"
+            "  )"
+            ") WHERE prev IS NULL OR rate != prev"
+        )
+        conn.execute("DROP TABLE prices")
+        conn.execute("ALTER TABLE prices_new RENAME TO prices")
+        # Watermarks may predate the schema; a full rescan rebuilds them
+        conn.execute("DROP TABLE IF EXISTS ingest_state")
+        conn.execute(INGEST_STATE_DDL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    ensure_schema(conn)
+    LOG.info("migrate: done, %d rows at schema v%d", copied, SCHEMA_VERSION)
+    return copied
+
+
+def init_db(path: str) -> sqlite3.Connection:
+    """Initialize SQLite database with required tables."""
+    conn = connect_writer(path)
+    if _legacy_prices_version(conn) is not None:
+        LOG.warning("migrating %s to schema v%d", path, SCHEMA_VERSION)
+        migrate_db(conn)
+    ensure_schema(conn)
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """
+    Create any missing tables, build the rollups and session index if
+    they are empty, and stamp SCHEMA_VERSION. Expects `prices` in the
+    current layout (see `migrate_db`).
+    """
+    conn.execute(PRICES_DDL.format(name="prices"))
+    conn.execute(FX_RATES_DDL)
+    conn.execute("""
       CREATE TABLE IF NOT EXISTS api_requests (
         date TEXT PRIMARY KEY,
         alpha_vantage_count INTEGER DEFAULT 0
       )
+    """)
+    conn.execute(INGEST_STATE_DDL)
+    for ddl in PRICE_CHANGES_DDL:
+        conn.execute(ddl)
+    conn.execute(PRICE_ROLLUPS_DDL)
+    conn.execute(SESSIONS_DDL)
+    conn.execute(SESSIONS_START_DDL)
+    conn.commit()
+    missing = conn.execute(
+        "SELECT EXISTS(SELECT 1 FROM prices) "
+        "AND NOT EXISTS(SELECT 1 FROM price_rollups)"
+    ).fetchone()[0]
+    if missing:
+        LOG.warning("building OHLC rollups")
+        rebuild_rollups(conn)
+        conn.commit()
+    missing = conn.execute(
+        "SELECT EXISTS(SELECT 1 FROM price_rollups) "
+        "AND NOT EXISTS(SELECT 1 FROM sessions)"
+    ).fetchone()[0]
+    if missing:
+        LOG.warning("building session index")
+        rebuild_sessions(conn)
+        conn.commit()
+    # Stamped last, so an interrupted build is retried on the next start
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def rollup_bucket(ts: int, resolution: int) -> int:
+    """Start of the rollup bucket of `resolution` seconds holding `ts`."""
+    return (ts - ROLLUP_ANCHOR) // resolution * resolution + ROLLUP_ANCHOR
+
+
+def update_rollups(
+    conn: sqlite3.Connection, metal: str, stamps: Iterable[int]
+) -> int:
+    """Recompute just the rollup buckets covering `stamps` (caller commits).
+
+    The 5m buckets are re-aggregated from raw minutes and each coarser
+    resolution from the one below, so a revision costs a few short index
+    range scans. Returns the number of 5m buckets recomputed.
     """
+    buckets = set(stamps)
+    child = None
+    touched = 0
+    for res in ROLLUP_RESOLUTIONS:
+        buckets = {rollup_bucket(ts, res) for ts in buckets}
+        sql = ROLLUP_FROM_ROLLUPS_SQL if child else ROLLUP_FROM_PRICES_SQL
+        conn.executemany(
+            sql,
+            [
+                {
+                    "metal": metal,
+                    "res": res,
+                    "child": child,
+                    "bucket": b,
+                    "end": b + res,
+                }
+                for b in sorted(buckets)
+            ],
+        )
+        touched = touched or len(buckets)
+        child = res
+    return touched
+
+
+@lru_cache(maxsize=64)
+def _session_epochs(td0: date) -> tuple[tuple[str, int, int], ...]:
+    night_start, night_end, day_start, day_end = session_bounds_sh(td0)
+    return (
+        ("night", int(night_start.timestamp()), int(night_end.timestamp())),
+        ("day", int(day_start.timestamp()), int(day_end.timestamp())),
     )
-    conn.commit()
-    return conn
+
+
+def session_for(ts: int) -> tuple[str, str, int, int] | None:
+    """(session_id, kind, start, end) of the session holding `ts`, if any.
+
+    The ID's date is the evening the trading day opens, as in
+    trading_day_start_date_sh.
+    """
+    td0 = trading_day_start_date_sh(datetime.fromtimestamp(ts, SH_TZ))
+    for kind, start, end in _session_epochs(td0):
+        if start <= ts <= end:
+            return f"{td0.isoformat()}/{kind}", kind, start, end
+    return None
+
+
+def update_sessions(
+    conn: sqlite3.Connection, metal: str, stamps: Iterable[int]
+) -> int:
+    """Refresh the session index rows covering `stamps` (caller commits).
+
+    Run after update_rollups: summaries are read from the 5m rollups.
+    Returns the number of sessions refreshed.
+    """
+    sessions = {session_for(ts) for ts in stamps} - {None}
+    conn.executemany(
+        SESSION_UPSERT_SQL,
+        [
+            {"metal": metal, "id": sid, "kind": kind, "start": lo, "end": hi}
+            for sid, kind, lo, hi in sorted(sessions, key=lambda x: x[2])
+        ],
+    )
+    return len(sessions)
+
+
+def rebuild_sessions(conn: sqlite3.Connection) -> int:
+    """Build the session index from the 5m rollups (caller commits)."""
+    total = 0
+    metals = [
+        r[0] for r in conn.execute("SELECT DISTINCT metal FROM price_rollups")
+    ]
+    for metal in metals:
+        buckets = conn.execute(
+            "SELECT bucket FROM price_rollups "
+            "WHERE metal = ? AND resolution = 300",
+            (metal,),
+        )
+        total += update_sessions(conn, metal, [r[0] for r in buckets])
+    return total
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> int:
+    """Build rollups for every stored price (caller commits)."""
+    total = 0
+    metals = [r[0] for r in conn.execute("SELECT DISTINCT metal FROM prices")]
+    for metal in metals:
+        starts = conn.execute(
+            "SELECT DISTINCT (ts - ?) / ? * ? + ? FROM prices WHERE metal = ?",
+            (ROLLUP_ANCHOR, 300, 300, ROLLUP_ANCHOR, metal),
+        )
+        total += update_rollups(conn, metal, [r[0] for r in starts])
+    return total
+
+
+def prune_prices(
+    conn: sqlite3.Connection, keep_days: int, now: float | None = None
+) -> int:
+    """Delete raw minutes older than `keep_days` whole trading days
+    (caller commits). Rollups are kept, and the server reads them for
+    ranges before the oldest raw minute."""
+    now = time.time() if now is None else now
+    cutoff = rollup_bucket(int(now) - keep_days * 86400, 86400)
+    deleted = 0
+    metals = [r[0] for r in conn.execute("SELECT DISTINCT metal FROM prices")]
+    for metal in metals:
+        cur = conn.execute(
+            "DELETE FROM prices WHERE metal = ? AND ts < ?", (metal, cutoff)
+        )
+        deleted += cur.rowcount
+    if deleted:
+        LOG.info("pruned %d raw prices before %s", deleted, cutoff)
+    return deleted
+
+
+def prune_changes(
+    conn: sqlite3.Connection, keep: int = CHANGE_LOG_ROWS
+) -> int:
+    """Trim the change feed to its newest `keep` entries (caller commits).
+
+    Readers whose last seen `seq` falls before the oldest remaining entry
+    must reload their window instead of applying changes.
+    """
+    cur = conn.execute(
+        "DELETE FROM price_changes "
+        "WHERE seq <= (SELECT MAX(seq) FROM price_changes) - ?",
+        (keep,),
+    )
+    return cur.rowcount
+
+
+def restart_changes(conn: sqlite3.Connection, metal: str, ts: int) -> None:
+    """Replace the change feed with one entry for (metal, ts), two past its
+    head (caller commits). Every reader then sees a gap and reloads its
+    window once instead of replaying the rows written in between."""
+    conn.execute(
+        "INSERT INTO price_changes(seq, metal, ts) "
+        "SELECT COALESCE(MAX(seq), 0) + 2, ?, ? FROM price_changes",
+        (metal, ts),
+    )
+    conn.execute(
+        "DELETE FROM price_changes "
+        "WHERE seq < (SELECT MAX(seq) FROM price_changes)"
+    )
+
+
+def tail_fingerprint(times: list[str], prices: list[float], end: int) -> str:
+    """Hash the FINGERPRINT_POINTS payload points that precede `end`."""
+    start = max(0, end - FINGERPRINT_POINTS)
+    raw = "|".join(
+        f"{t}={p!r}" for t, p in zip(times[start:end], prices[start:end])
+    )
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def load_ingest_marks(conn: sqlite3.Connection) -> dict[str, IngestMark]:
+    """Load persisted per-metal ingest watermarks."""
+    rows = conn.execute(
+        "SELECT metal, trading_day, watermark, resume_index, fingerprint "
+        "FROM ingest_state"
+    ).fetchall()
+    return {r[0]: IngestMark(*r[1:]) for r in rows}
+
+
+def save_ingest_mark(
+    conn: sqlite3.Connection, metal: str, mark: IngestMark
+) -> None:
+    """Persist a metal's ingest watermark (caller owns the transaction)."""
+    conn.execute(
+        "INSERT INTO ingest_state("
+        "metal, trading_day, watermark, resume_index, fingerprint) "
+        "VALUES(?, ?, ?, ?, ?) "
+        "ON CONFLICT(metal) DO UPDATE SET "
+        "trading_day = excluded.trading_day, "
+        "watermark = excluded.watermark, "
+        "resume_index = excluded.resume_index, "
+        "fingerprint = excluded.fingerprint",
+        (
+            metal,
+            mark.trading_day,
+            mark.watermark,
+            mark.resume_index,
+            mark.fingerprint,
+        ),
+    )
+
+
+def resume_index_for(
+    mark: IngestMark | None,
+    trading_day: str,
+    times: list[str],
+    prices: list[float],
+) -> int:
+    """Return where to resume scanning a payload, or 0 for a full scan.
+
+    Points before the revision window are treated as final, so a matching
+    fingerprint on the points just before it means the prefix is unchanged.
+    """
+    if mark is None or mark.trading_day != trading_day:
+        return 0
+    idx = mark.resume_index
+    if idx <= 0 or idx > min(len(times), len(prices)):
+        return 0
+    if tail_fingerprint(times, prices, idx) != mark.fingerprint:
+        return 0
+    return idx
 
 
 def store_points(
     conn: sqlite3.Connection,
     metal: str,
     cutoff_sh: datetime,
-    fx: float,
     times: list[str],
     prices: list[float],
     meta: dict,
+    marks: dict[str, IngestMark] | None = None,
 ) -> int:
-    """Store price points in database, returning count of inserted records."""
+    """Store price points in database, returning count of written records.
+
+    Existing prices for the payload window are loaded with one range query
+    and diffed in memory; only new or changed rows are upserted. When
+    `marks` is given, the unchanged prefix of the session payload is skipped
+    and the metal's watermark is updated in memory and in the DB.
+    """
     cur = conn.cursor()
-    n = 0
     nan_count = 0
     min_max_filtered = 0
     skipped_future = 0
-    latest_ts = None
+    revised = 0
 
     min_price = meta.get("min")
     max_price = meta.get("max")
+    lo = float(min_price) if min_price is not None else None
+    hi = float(max_price) if max_price is not None else None
+
+    near_cutoff = int(cutoff_sh.timestamp()) - 5 * 60
+
+    trading_day = trading_day_start_date_sh(cutoff_sh).isoformat()
+    mark = marks.get(metal) if marks is not None else None
+    start = resume_index_for(mark, trading_day, times, prices)
+    end = start
 
     try:
-        for t_hhmm, price in zip(times, prices):
+        n = min(len(times), len(prices))
+        stamps = parse_points_epoch(times[start:n], cutoff_sh)
+        points: dict[int, float] = {}
+        for i, ts in enumerate(stamps, start):
+            price = prices[i]
             if price != price:  # NaN
                 nan_count += 1
                 continue
 
             # Filter out prices outside meta min/max range
-            if min_price is not None and price < float(min_price):
-                min_max_filtered += 1
-                continue
-            if max_price is not None and price > float(max_price):
+            if (lo is not None and price < lo) or (
+                hi is not None and price > hi
+            ):
                 min_max_filtered += 1
                 continue
 
-            ts = parse_point_timestamp_iso(t_hhmm, cutoff_sh)
-            if not ts:
+            if ts == INVALID_TS:
                 skipped_future += 1
                 continue
 
-            # Check for retroactive price revisions
-            cur.execute(
-                "SELECT price_cny FROM prices WHERE metal=? AND timestamp=?",
-                (metal, ts),
-            )
-            existing = cur.fetchone()
-            if existing and abs(float(price) - existing[0]) > 0.01:
-                LOG.info(
-                    "%s: revising previous price for %s from %.4f → %.4f",
+            # Log potential placeholder values near cutoff
+            if ts >= near_cutoff and price in (lo, hi):
+                LOG.debug(
+                    "%s: price %.4f equals min/max bound near cutoff at %s",
                     metal,
-                    ts,
-                    existing[0],
                     price,
+                    epoch_to_iso_sh(ts),
                 )
 
-            # Log potential placeholder values near cutoff
-            point_sh = datetime.fromisoformat(ts)
-            if point_sh >= cutoff_sh - timedelta(minutes=5):
-                if (min_price is not None and price == float(min_price)) or (
-                    max_price is not None and price == float(max_price)
-                ):
-                    LOG.debug(
-                        "%s: price %.4f equals min/max bound near cutoff "
-                        "at %s",
-                        metal,
-                        price,
-                        ts,
-                    )
+            points[ts] = float(price)
+            end = i + 1
 
+        rows = []
+        if points:
             cur.execute(
-                "INSERT OR REPLACE INTO prices("
-                "metal, timestamp, price_cny, usd_cny_rate) "
-                "VALUES(?, ?, ?, ?)",
-                (metal, ts, float(price), float(fx)),
+                "SELECT ts, price_cny FROM prices "
+                "WHERE metal = ? AND ts BETWEEN ? AND ?",
+                (metal, min(points), max(points)),
             )
-            n += 1
-            latest_ts = ts
+            existing = dict(cur.fetchall())
+
+            for ts, price in points.items():
+                old = existing.get(ts)
+                if old == price:
+                    continue
+                # Check for retroactive price revisions
+                if old is not None:
+                    revised += 1
+                    if abs(price - old) > 0.01:
+                        LOG.info(
+                            "%s: revising previous price for %s "
+                            "from %.4f → %.4f",
+                            metal,
+                            epoch_to_iso_sh(ts),
+                            old,
+                            price,
+                        )
+                rows.append((metal, ts, price))
+
+        if rows:
+            cur.executemany(PRICE_UPSERT_SQL, rows)
+            stamps = [ts for _, ts, _ in rows]
+            update_rollups(conn, metal, stamps)
+            update_sessions(conn, metal, stamps)
 
         if nan_count > 0:
             LOG.warning(
@@ -374,23 +1179,305 @@ def store_points(
                 metal,
                 skipped_future,
             )
+        if revised > 0:
+            LOG.debug("%s: revised %d existing points", metal, revised)
+
+        if marks is not None:
+            resume = max(0, end - REVISION_WINDOW_MIN)
+            watermark = max(points) if points else None
+            if mark is not None and mark.watermark is not None:
+                watermark = max(watermark or 0, mark.watermark)
+            marks[metal] = IngestMark(
+                trading_day=trading_day,
+                watermark=watermark,
+                resume_index=resume,
+                fingerprint=tail_fingerprint(times, prices, resume),
+            )
+            save_ingest_mark(conn, metal, marks[metal])
+            if start:
+                LOG.debug("%s: skipped %d unchanged points", metal, start)
 
         # Debug log for latest stored timestamp
-        if latest_ts:
+        if points:
             LOG.debug(
-                "%s: stored latest timestamp %s (cutoff: %s)",
+                "%s: stored latest timestamp %s (cutoff: %s, written: %d)",
                 metal,
-                latest_ts,
+                epoch_to_iso_sh(max(points)),
                 cutoff_sh.isoformat(),
+                len(rows),
             )
 
-        return n
+        return len(rows)
 
     finally:
         cur.close()
 
 
-def main():
+def parse_backfill_ts(value) -> int:
+    """Epoch seconds from an epoch number or ISO string (naive = Shanghai)."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    s = str(value).strip()
+    if s.lstrip("-").isdigit():
+        return int(s)
+    dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = SH_TZ.localize(dt)
+    return int(dt.timestamp())
+
+
+def _metal_for_heyue(heyue: str | None) -> str | None:
+    """Map an SGE contract name from an archived response to a metal key."""
+    for inst in INSTRUMENTS:
+        if heyue in (inst.label, unquote(inst.instid)):
+            return inst.metal
+    return None
+
+
+def _archived_response_rows(
+    payload: dict, metal: str | None
+) -> Iterator[tuple[str, int, float]]:
+    """Rows from an archived graph/quotations response."""
+    metal = _metal_for_heyue(payload.get("heyue")) or metal
+    api_sh = parse_delaystr_sh(payload.get("delaystr"))
+    if metal is None or api_sh is None:
+        LOG.warning(
+            "backfill: skipping response for %r (no metal or delaystr)",
+            payload.get("heyue"),
+        )
+        return
+    cutoff_sh = min(market_cutoff_sh(api_sh), last_closed_minute_sh(api_sh))
+    times = payload.get("times") or []
+    stamps = parse_points_epoch(times, cutoff_sh)
+    for ts, raw in zip(stamps, payload.get("data") or []):
+        try:
+            price = float(raw)
+        except (TypeError, ValueError):
+            continue
+        if ts != INVALID_TS and price == price:
+            yield metal, ts, price
+
+
+def _record_rows(
+    records, metal: str | None
+) -> Iterator[tuple[str, int, float]]:
+    """Rows from dict records with metal, ts/timestamp and price_cny."""
+    for rec in records:
+        if "times" in rec and "data" in rec:
+            yield from _archived_response_rows(rec, metal)
+            continue
+        try:
+            yield (
+                rec.get("metal") or metal,
+                parse_backfill_ts(rec.get("ts", rec.get("timestamp"))),
+                float(rec.get("price_cny", rec.get("price"))),
+            )
+        except (TypeError, ValueError) as e:
+            LOG.warning("backfill: skipping bad record %r: %s", rec, e)
+
+
+def iter_backfill_rows(
+    path: str, metal: str | None = None
+) -> Iterator[tuple[str, int, float]]:
+    """
+    Stream (metal, ts, price_cny) rows from a backfill input: CSV, JSON
+    lines, a JSON array/object, or a directory of archived SGE responses.
+    CSV and JSON lines are read incrementally; plain JSON is loaded whole.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            yield from iter_backfill_rows(os.path.join(path, name), metal)
+        return
+
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            yield from _record_rows(csv.DictReader(f), metal)
+        elif path.endswith((".jsonl", ".ndjson")):
+            yield from _record_rows(
+                (json.loads(line) for line in f if line.strip()), metal
+            )
+        else:
+            doc = json.load(f)
+            yield from _record_rows(
+                doc if isinstance(doc, list) else [doc], metal
+            )
+
+
+def backfill(
+    conn: sqlite3.Connection,
+    paths: list[str],
+    metal: str | None = None,
+    chunk_rows: int = BACKFILL_CHUNK_ROWS,
+) -> int:
+    """
+    Bulk-load historical prices, one transaction per `chunk_rows` rows.
+    Rows go through the live collector's upsert, so re-running a backfill
+    or overlapping it with live data is safe. Durability is relaxed for
+    the load, and secondary indexes and the change-feed triggers on
+    `prices` are dropped and recreated once at the end. The feed is then
+    restarted past its head, so servers reload their window once rather
+    than replaying every loaded row. Returns the number of rows loaded.
+    """
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'prices' AND sql IS NOT NULL"
+    ).fetchall()
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'trigger' AND tbl_name = 'prices'"
+    ).fetchall()
+    sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MiB
+
+    total = skipped = 0
+    last: tuple[str, int] | None = None
+    started = time.monotonic()
+
+    def flush(chunk: list[tuple[str, int, float]]) -> None:
+        nonlocal last
+        # Key order keeps inserts local to the clustered (metal, ts) tree
+        chunk.sort(key=lambda r: (r[0], r[1]))
+        conn.execute("BEGIN")
+        conn.executemany(PRICE_UPSERT_SQL, chunk)
+        stamps: dict[str, list[int]] = {}
+        for m, ts, _ in chunk:
+            stamps.setdefault(m, []).append(ts)
+        for m, ts_list in stamps.items():
+            update_rollups(conn, m, ts_list)
+            update_sessions(conn, m, ts_list)
+        conn.commit()
+        last = chunk[-1][:2]
+        elapsed = max(time.monotonic() - started, 1e-9)
+        LOG.info(
+            "backfill: %d rows (%.0f rows/sec)",
+            total + len(chunk),
+            (total + len(chunk)) / elapsed,
+        )
+
+    try:
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        conn.commit()
+
+        chunk: list[tuple[str, int, float]] = []
+        for path in paths:
+            for row in iter_backfill_rows(path, metal):
+                if row[0] is None:
+                    skipped += 1
+                    continue
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    flush(chunk)
+                    total += len(chunk)
+                    chunk = []
+        if chunk:
+            flush(chunk)
+            total += len(chunk)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        for _, sql in indexes + triggers:
+            conn.execute(sql)
+        if last is not None:
+            restart_changes(conn, *last)
+        conn.commit()
+        conn.execute(f"PRAGMA synchronous = {sync}")
+
+    if skipped:
+        LOG.warning("backfill: skipped %d rows with no metal", skipped)
+    LOG.info(
+        "backfill: loaded %d rows in %.1fs",
+        total,
+        time.monotonic() - started,
+    )
+    return total
+
+
+def run_cycle(
+    conn: sqlite3.Connection,
+    session: requests.Session | None,
+    instruments: list[Instrument],
+    now_sh: datetime,
+    marks: dict[str, IngestMark],
+    last_fetch: dict[str, float],
+    now: float | None = None,
+) -> int:
+    """Fetch due instruments and store them in one transaction.
+
+    Returns the number of rows written. Raises if every due instrument
+    failed to fetch; the caller owns rollback and backoff.
+    """
+    now = time.time() if now is None else now
+    # Network first, outside the write transaction
+    due = due_instruments(instruments, last_fetch, now)
+    results = fetch_all(due, session, return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if due and len(failed) == len(due):
+        raise failed[0]
+
+    conn.execute("BEGIN")
+    total = 0
+
+    for inst, result in zip(due, results):
+        if isinstance(result, BaseException):
+            LOG.warning("%s: skipped cycle: %s", inst.metal, result)
+            continue
+        last_fetch[inst.metal] = now
+        times, prices, meta = result
+        api_sh = parse_delaystr_sh(meta.get("delaystr"))
+
+        # Check for stale API data
+        if api_sh and now_sh:
+            time_diff = abs((now_sh - api_sh).total_seconds() / 60)
+            if time_diff > STALE_DATA_THRESHOLD_MIN:
+                LOG.warning(
+                    "%s: API timestamp %s differs from current %s "
+                    "by %.1f minutes",
+                    inst.metal,
+                    api_sh.isoformat(),
+                    now_sh.isoformat(),
+                    time_diff,
+                )
+
+        cutoff_sh = market_cutoff_sh(now_sh)
+        if api_sh:
+            cutoff_sh = min(cutoff_sh, last_closed_minute_sh(api_sh))
+
+        # Add extra buffer to avoid storing provisional prices
+        if PRICE_BUFFER_MIN > 0:
+            cutoff_sh = cutoff_sh - timedelta(minutes=PRICE_BUFFER_MIN)
+            LOG.debug(
+                "%s: applied %d min buffer, cutoff now: %s",
+                inst.metal,
+                PRICE_BUFFER_MIN,
+                cutoff_sh.isoformat(),
+            )
+
+        wrote = store_points(
+            conn, inst.metal, cutoff_sh, times, prices, meta, marks
+        )
+        total += wrote
+
+        LOG.info(
+            "%s %s: wrote=%d meta=%s",
+            inst.metal,
+            inst.unit,
+            wrote,
+            json.dumps(meta, ensure_ascii=False),
+        )
+
+    prune_changes(conn)
+    if RAW_RETENTION_DAYS > 0:
+        prune_prices(conn, RAW_RETENTION_DAYS, now)
+    conn.commit()
+    return total
+
+
+def main(db_path: str | None = None):
     """Main collector loop - fetches SGE prices and stores in database."""
     # Allow debug logging via environment variable
     log_level = logging.DEBUG if os.environ.get("DEBUG") else logging.INFO
@@ -398,8 +1485,19 @@ def main():
         level=log_level, format="%(asctime)s %(levelname)s: %(message)s"
     )
 
-    db_path = os.environ.get("SHANGHAI_DB", "shanghai_metals.db")
+    db_path = db_path or os.environ.get("SHANGHAI_DB", "shanghai_metals.db")
     conn = init_db(db_path)
+    notify_path = notify_socket_path(db_path)
+
+    session = make_http_session()
+
+    marks = load_ingest_marks(conn)
+    last_fetch: dict[str, float] = {}
+    LOG.info(
+        "tracking %d instruments: %s",
+        len(INSTRUMENTS),
+        ", ".join(i.metal for i in INSTRUMENTS),
+    )
 
     fx = get_cached_fx(conn)
     last_fx = 0.0
@@ -416,73 +1514,108 @@ def main():
             fx, fx_backoff = fetch_fx(conn, fx, fx_backoff)
             last_fx = now
             LOG.info("FX USD/CNY = %.6f", fx)
+            # Only rate changes are stored; readers join them as-of
+            if record_fx(conn, fx):
+                notify_readers(notify_path)
 
         try:
-            conn.execute("BEGIN")
-            total = 0
-
-            for inst in INSTRUMENTS:
-                times, prices, meta = fetch_sge(inst)
-
-                api_sh = parse_delaystr_sh(meta.get("delaystr"))
-
-                # Check for stale API data
-                if api_sh and now_sh:
-                    time_diff = abs((now_sh - api_sh).total_seconds() / 60)
-                    if time_diff > STALE_DATA_THRESHOLD_MIN:
-                        LOG.warning(
-                            "%s: API timestamp %s differs from current %s "
-                            "by %.1f minutes",
-                            inst.metal,
-                            api_sh.isoformat(),
-                            now_sh.isoformat(),
-                            time_diff,
-                        )
-
-                cutoff_sh = market_cutoff_sh(now_sh)
-                if api_sh:
-                    cutoff_sh = min(cutoff_sh, last_closed_minute_sh(api_sh))
-
-                # Add extra buffer to avoid storing provisional prices
-                if PRICE_BUFFER_MIN > 0:
-                    cutoff_sh = cutoff_sh - timedelta(minutes=PRICE_BUFFER_MIN)
-                    LOG.debug(
-                        "%s: applied %d min buffer, cutoff now: %s",
-                        inst.metal,
-                        PRICE_BUFFER_MIN,
-                        cutoff_sh.isoformat(),
-                    )
-
-                wrote = store_points(
-                    conn, inst.metal, cutoff_sh, fx, times, prices, meta
-                )
-                total += wrote
-
-                LOG.info(
-                    "%s %s: wrote=%d meta=%s",
-                    inst.metal,
-                    inst.unit,
-                    wrote,
-                    json.dumps(meta, ensure_ascii=False),
-                )
-
-            conn.commit()
+            wrote = run_cycle(
+                conn, session, INSTRUMENTS, now_sh, marks, last_fetch, now
+            )
             backoff = 1.0
+            if wrote:
+                notify_readers(notify_path)
 
         except Exception as e:
             try:
                 conn.rollback()
             except Exception:
                 pass
+            # In-memory watermarks may be ahead of what was rolled back;
+            # a full scan next cycle is always safe
+            marks.clear()
+            last_fetch.clear()
 
             LOG.error("fetch/store failed: %s", e)
             time.sleep(backoff)
             backoff = min(backoff * 2, 300.0)
 
-        # sleep to next minute-ish with small random jitter
-        jitter = random.uniform(0, 10)  # 0-10 second jitter
-        time.sleep(FETCH_INTERVAL_SEC + jitter)
+        # sleep until just after the next minute closes, or next session
+        now_sh = datetime.now(SH_TZ)
+        wake_sh = next_poll_sh(now_sh)
+        if wake_sh - now_sh > timedelta(minutes=5):
+            LOG.info("market closed, next poll at %s", wake_sh.isoformat())
+        time.sleep(max(0.0, (wake_sh - now_sh).total_seconds()))
+
+
+def cli(argv: list[str] | None = None) -> None:
+    """Command-line entry point: run the collector or a maintenance task."""
+    parser = argparse.ArgumentParser(description="SGE price collector")
+    parser.add_argument(
+        "--db",
+        default=os.environ.get("SHANGHAI_DB", "shanghai_metals.db"),
+        help="Database path (default: $SHANGHAI_DB)",
+    )
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("run", help="Run the live collector (default)")
+    mig = sub.add_parser(
+        "migrate", help="Upgrade an older database to the current schema"
+    )
+    mig.add_argument(
+        "--batch-rows",
+        type=int,
+        default=MIGRATE_BATCH_ROWS,
+        help="Rows copied per transaction",
+    )
+    bf = sub.add_parser(
+        "backfill", help="Bulk-load historical prices from files"
+    )
+    bf.add_argument(
+        "paths",
+        nargs="+",
+        help="CSV, JSON/JSON lines, or archived SGE response files/dirs",
+    )
+    bf.add_argument(
+        "--metal",
+        help="Metal key for inputs that do not name one",
+    )
+    bf.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=BACKFILL_CHUNK_ROWS,
+        help="Rows written per transaction",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s"
+        )
+        conn = init_db(args.db)
+        try:
+            if backfill(conn, args.paths, args.metal, args.chunk_rows):
+                notify_readers(notify_socket_path(args.db))
+        finally:
+            conn.close()
+        return
+
+    if args.command == "migrate":
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s"
+        )
+        conn = connect_writer(args.db)
+        try:
+            if _legacy_prices_version(conn) is None:
+                ensure_schema(conn)
+                LOG.info("%s at schema v%d", args.db, SCHEMA_VERSION)
+                return
+            migrate_db(conn, args.batch_rows)
+        finally:
+            conn.close()
+        return
+
+    main(args.db)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -45,8 +45,9 @@ def monitor_latest_entries(db_path="shanghai_metals.db", interval=30):
             # Get latest entry for each metal
             for metal in ["gold", "silver"]:
                 row = conn.execute(
-                    "SELECT timestamp, price_cny FROM prices "
-                    "WHERE metal = ? ORDER BY timestamp DESC LIMIT 1",
+                    "SELECT strftime('%Y-%m-%dT%H:%M:%S+08:00', ts, "
+                    "'unixepoch', '+8 hours'), price_cny FROM prices "
+                    "WHERE metal = ? ORDER BY ts DESC LIMIT 1",
                     (metal,),
                 ).fetchone()
 
@@ -38,8 +38,8 @@
     in
     {
       packages.${system}.default = pkgs.writeShellScriptBin "shanghai-metals" ''
-        ${pythonEnv}/bin/python ${./collector.py} &
-        ${pythonEnv}/bin/python ${./websocket_metals.py}
+        ${pythonEnv}/bin/python ${./.}/collector.py &
+        ${pythonEnv}/bin/python ${./.}/websocket_metals.py
       '';
 
       apps.${system}.default = {
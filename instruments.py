@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import json
+import os
+from dataclasses import dataclass
+from urllib.parse import quote
+
+# Registry file shared by collector.py and websocket_metals.py
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "instruments.json")
+
+
+@dataclass(frozen=True)
+class Instrument:
+    metal: str  # DB/wire key, e.g. "gold" | "silver"
+    instid: str  # form-encoded SGE id, e.g. "Au(T%2BD)"
+    unit: str  # "CNY/g" or "CNY/kg"
+    label: str = ""  # display name, e.g. "Au(T+D)"
+    priority: int = 0  # lower fetches first when workers are saturated
+    min_interval_sec: float = 0.0  # per-instrument rate limit (0 = every poll)
+
+
+# Used when no registry file is present
+DEFAULT_INSTRUMENTS = [
+    Instrument(
+        metal="gold", instid="Au(T%2BD)", unit="CNY/g", label="Au(T+D)"
+    ),
+    Instrument(
+        metal="silver", instid="Ag(T%2BD)", unit="CNY/kg", label="Ag(T+D)"
+    ),
+]
+
+
+def parse_instrument(entry: dict) -> Instrument:
+    """Build an Instrument from a registry entry with a plain SGE id."""
+    try:
+        metal = str(entry["metal"])
+        raw_id = str(entry["instid"])
+        unit = str(entry["unit"])
+    except KeyError as e:
+        raise ValueError(f"instrument entry missing {e.args[0]!r}: {entry}")
+    return Instrument(
+        metal=metal,
+        instid=quote(raw_id, safe="()"),
+        unit=unit,
+        label=str(entry.get("label") or raw_id),
+        priority=int(entry.get("priority", 0)),
+        min_interval_sec=float(entry.get("min_interval_sec", 0)),
+    )
+
+
+def load_instruments(path: str | None = None) -> list[Instrument]:
+    """
+    Load the instrument registry, sorted by priority.
+    Lookup order: explicit path, $SHANGHAI_INSTRUMENTS, instruments.json
+    next to this module, then the built-in gold/silver defaults.
+    """
+    path = path or os.environ.get("SHANGHAI_INSTRUMENTS") or DEFAULT_PATH
+    if not os.path.exists(path):
+        return list(DEFAULT_INSTRUMENTS)
+
+    with open(path, encoding="utf-8") as f:
+        cfg = json.load(f)
+
+    entries = cfg.get("instruments") if isinstance(cfg, dict) else cfg
+    instruments = [parse_instrument(e) for e in entries or []]
+
+    seen: set[str] = set()
+    for inst in instruments:
+        if inst.metal in seen:
+            raise ValueError(f"duplicate instrument key {inst.metal!r}")
+        seen.add(inst.metal)
+
+    return sorted(instruments, key=lambda i: i.priority)
+
+
+def due_instruments(
+    instruments: list[Instrument], last_fetch: dict[str, float], now: float
+) -> list[Instrument]:
+    """Instruments whose rate limit allows a fetch at `now`."""
+    return [
+        inst
+        for inst in instruments
+        if now - last_fetch.get(inst.metal, float("-inf"))
+        >= inst.min_interval_sec
+    ]
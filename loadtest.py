@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Ingest load test: drive collector cycles against mock_sge.py.
+
+Each cycle steps the simulated Shanghai clock forward, then runs the
+same fetch/store path as collector.main against a scratch database.
+Reports per-cycle latency percentiles, rows/sec and DB growth.
+
+Usage:
+  python3 loadtest.py --cycles 600 --instruments 20 --revision-rate 0.1
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import collector
+from instruments import Instrument
+from mock_sge import MockClock, MockConfig, MockSGEServer
+
+
+@dataclass
+class LoadReport:
+    cycles: int
+    failed_cycles: int
+    rows: int
+    elapsed_sec: float
+    latencies_ms: list[float]
+    db_bytes_start: int
+    db_bytes_end: int
+
+    def percentile(self, q: int) -> float:
+        """q-th percentile of cycle latency in milliseconds."""
+        if len(self.latencies_ms) < 2:
+            return self.latencies_ms[0] if self.latencies_ms else 0.0
+        return statistics.quantiles(self.latencies_ms, n=100)[q - 1]
+
+    def summary(self) -> str:
+        rows_per_sec = self.rows / self.elapsed_sec if self.elapsed_sec else 0
+        growth = self.db_bytes_end - self.db_bytes_start
+        return "\n".join(
+            [
+                f"cycles:      {self.cycles} ({self.failed_cycles} failed)",
+                f"latency ms:  p50={self.percentile(50):.1f} "
+                f"p95={self.percentile(95):.1f} "
+                f"p99={self.percentile(99):.1f}",
+                f"rows:        {self.rows} ({rows_per_sec:.0f} rows/sec)",
+                f"db growth:   {growth / 1024:.1f} KiB "
+                f"({self.db_bytes_start} -> {self.db_bytes_end} bytes)",
+            ]
+        )
+
+
+def synthetic_instruments(n: int) -> list[Instrument]:
+    """The default gold/silver pair plus synthetic contracts up to `n`."""
+    out = [
+        Instrument("gold", "Au(T%2BD)", "CNY/g", "Au(T+D)"),
+        Instrument("silver", "Ag(T%2BD)", "CNY/kg", "Ag(T+D)"),
+    ]
+    for i in range(len(out), n):
+        out.append(Instrument(f"syn{i}", f"Au{i}", "CNY/g", f"Au{i}"))
+    return out[:n]
+
+
+def db_bytes(path: str) -> int:
+    """Size of the database including any WAL sidecar."""
+    return sum(
+        os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)
+    )
+
+
+def run_load(
+    server: MockSGEServer,
+    db_path: str,
+    instruments: list[Instrument],
+    cycles: int,
+    step_sec: float = 60.0,
+) -> LoadReport:
+    """Run `cycles` collector cycles, stepping the mock clock each time."""
+    collector.SGE_URL = f"{server.base_url}/graph/quotations"
+    collector.FX_URL = f"{server.base_url}/query"
+
+    conn = collector.init_db(db_path)
+    session = collector.make_http_session(len(instruments))
+    marks = collector.load_ingest_marks(conn)
+    last_fetch: dict[str, float] = {}
+    fx, fx_backoff = collector.get_cached_fx(conn), 1.0
+
+    start_bytes = db_bytes(db_path)
+    latencies: list[float] = []
+    rows = failed = 0
+    began = time.perf_counter()
+    try:
+        for i in range(cycles):
+            now_sh = server.clock.advance(step_sec)
+            t0 = time.perf_counter()
+            if i % 60 == 0:
+                fx, fx_backoff = collector.fetch_fx(conn, fx, fx_backoff)
+                collector.record_fx(conn, fx)
+            try:
+                rows += collector.run_cycle(
+                    conn,
+                    session,
+                    instruments,
+                    now_sh,
+                    marks,
+                    last_fetch,
+                    now=now_sh.timestamp(),
+                )
+            except Exception:
+                conn.rollback()
+                marks.clear()
+                last_fetch.clear()
+                failed += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+    finally:
+        elapsed = time.perf_counter() - began
+        conn.close()
+
+    return LoadReport(
+        cycles=cycles,
+        failed_cycles=failed,
+        rows=rows,
+        elapsed_sec=elapsed,
+        latencies_ms=latencies,
+        db_bytes_start=start_bytes,
+        db_bytes_end=db_bytes(db_path),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collector ingest load test")
+    parser.add_argument("--cycles", type=int, default=300)
+    parser.add_argument("--instruments", type=int, default=6)
+    parser.add_argument(
+        "--start",
+        default="2025-01-15T09:00",
+        help="Simulated Shanghai start time",
+    )
+    parser.add_argument(
+        "--step-sec", type=float, default=60.0, help="Clock step per cycle"
+    )
+    parser.add_argument("--revision-rate", type=float, default=0.05)
+    parser.add_argument("--nan-rate", type=float, default=0.001)
+    parser.add_argument("--delay-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.01)
+    parser.add_argument("--db", help="Database path (default: temp file)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    # Per-fetch warnings (429s, NaNs) drown the report unless asked for
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR,
+        format="%(asctime)s %(levelname)s: %(message)s",
+    )
+
+    os.environ.setdefault("ALPHA_VANTAGE_API_KEY", "mock")
+    start = collector.SH_TZ.localize(datetime.fromisoformat(args.start))
+    cfg = MockConfig(
+        revision_rate=args.revision_rate,
+        nan_rate=args.nan_rate,
+        delay_ms=args.delay_ms,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    # Start one step early so the first cycle lands on --start
+    clock = MockClock(start - timedelta(seconds=args.step_sec))
+    server = MockSGEServer(clock, cfg).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, "loadtest.db")
+        try:
+            report = run_load(
+                server,
+                db_path,
+                synthetic_instruments(args.instruments),
+                args.cycles,
+                args.step_sec,
+            )
+        finally:
+            server.stop()
+
+    print(report.summary())
+    print(
+        f"mock:        {server.requests} requests, "
+        f"{server.rate_limited} rate limited"
+    )
+
+
+if __name__ == "__main__":
+    main()
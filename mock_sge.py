@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the SGE graph/quotations and Alpha Vantage FX endpoints.
+
+Replays full-session payloads up to a simulated Shanghai clock, with
+configurable revisions, NaNs, response delays and 429s, so the collector
+can be exercised end to end without touching the real services.
+
+Usage:
+  python3 mock_sge.py --port 18900 --speed 60
+  SGE_URL=http://localhost:18900/graph/quotations \\
+  ALPHA_VANTAGE_URL=http://localhost:18900/query \\
+  ALPHA_VANTAGE_API_KEY=mock python3 collector.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from collector import SH_TZ, session_bounds_sh, trading_day_start_date_sh
+
+
+@dataclass(frozen=True)
+class MockConfig:
+    revision_rate: float = 0.0  # chance a poll revises the trailing points
+    revision_points: int = 3  # how many trailing points a revision touches
+    nan_rate: float = 0.0  # chance any single point is served as NaN
+    delay_ms: float = 0.0  # mean response delay (exponential)
+    rate_limit_rate: float = 0.0  # chance a request gets HTTP 429
+    fx_rate: float = 7.1  # USD/CNY served by the FX endpoint
+    seed: int = 0
+
+
+class MockClock:
+    """Simulated Shanghai clock: free-running at `speed`, or stepped."""
+
+    def __init__(self, start_sh: datetime, speed: float = 0.0):
+        self._start = start_sh
+        self._speed = speed
+        self._t0 = time.monotonic()
+        self._offset = timedelta()
+        self._lock = threading.Lock()
+
+    def now(self) -> datetime:
+        """Current simulated time in Shanghai."""
+        with self._lock:
+            real = time.monotonic() - self._t0
+            return (
+                self._start
+                + self._offset
+                + timedelta(seconds=real * self._speed)
+            )
+
+    def advance(self, seconds: float) -> datetime:
+        """Step the simulated clock forward."""
+        with self._lock:
+            self._offset += timedelta(seconds=seconds)
+        return self.now()
+
+
+# Rough price levels so payloads look like the real contracts
+_BASE_PRICES = {"Ag": 8000.0, "mAg": 8000.0}
+
+
+def session_minutes_sh(now_sh: datetime) -> list[datetime]:
+    """Every minute of the current trading day's sessions up to now."""
+    td0 = trading_day_start_date_sh(now_sh)
+    night_start, night_end, day_start, day_end = session_bounds_sh(td0)
+    out = []
+    for start, end in ((night_start, night_end), (day_start, day_end)):
+        t = start
+        while t <= end and t <= now_sh:
+            out.append(t)
+            t += timedelta(minutes=1)
+    return out
+
+
+def series_for(instid: str, now_sh: datetime, cfg: MockConfig) -> dict:
+    """Build a graph/quotations payload for an instrument at `now_sh`."""
+    minutes = session_minutes_sh(now_sh)
+    td0 = trading_day_start_date_sh(now_sh)
+
+    # Deterministic per (instrument, trading day) so polls agree on history
+    key = f"{cfg.seed}:{instid}:{td0.isoformat()}".encode()
+    walk = random.Random(zlib.crc32(key))
+    level = _BASE_PRICES.get(instid.split("(")[0].rstrip("0123456789."), 600.0)
+    prices = []
+    for _ in minutes:
+        level *= 1 + walk.gauss(0, 0.0005)
+        prices.append(round(level, 2))
+
+    noise = random.Random()
+    if prices and noise.random() < cfg.revision_rate:
+        for i in range(max(0, len(prices) - cfg.revision_points), len(prices)):
+            prices[i] = round(prices[i] * (1 + noise.gauss(0, 0.001)), 2)
+
+    data = [
+        "NaN" if noise.random() < cfg.nan_rate else f"{p:.2f}" for p in prices
+    ]
+    return {
+        "heyue": instid,
+        "times": [m.strftime("%H:%M") for m in minutes],
+        "data": data,
+        "min": min(prices) if prices else None,
+        "max": max(prices) if prices else None,
+        "delaystr": now_sh.strftime("%Y年%m月%d日 %H:%M:%S"),
+    }
+
+
+class MockSGEServer:
+    """Threaded HTTP server serving mock SGE and Alpha Vantage responses."""
+
+    def __init__(
+        self,
+        clock: MockClock,
+        cfg: MockConfig = MockConfig(),
+        host: str = "localhost",
+        port: int = 0,
+    ):
+        self.clock = clock
+        self.cfg = cfg
+        self.requests = 0
+        self.rate_limited = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockSGEServer":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def stop(self) -> None:
+        """Shut the server down."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict) -> None:
+                raw = json.dumps(body, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _throttle(self) -> bool:
+                cfg = server.cfg
+                server.requests += 1
+                if cfg.delay_ms > 0:
+                    time.sleep(random.expovariate(1000.0 / cfg.delay_ms))
+                if random.random() < cfg.rate_limit_rate:
+                    server.rate_limited += 1
+                    self._send_json(429, {"error": "rate limited"})
+                    return True
+                return False
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode())
+                if urlparse(self.path).path != "/graph/quotations":
+                    self._send_json(404, {})
+                    return
+                if self._throttle():
+                    return
+                instid = (form.get("instid") or [""])[0]
+                now_sh = server.clock.now()
+                self._send_json(200, series_for(instid, now_sh, server.cfg))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/query":
+                    self._send_json(404, {})
+                    return
+                if self._throttle():
+                    return
+                rate = server.cfg.fx_rate
+                self._send_json(
+                    200,
+                    {
+                        "Realtime Currency Exchange Rate": {
+                            "1. From_Currency Code": "USD",
+                            "3. To_Currency Code": "CNY",
+                            "5. Exchange Rate": f"{rate:.4f}",
+                        }
+                    },
+                )
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock SGE/Alpha Vantage")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=18900)
+    parser.add_argument(
+        "--start",
+        help="Simulated Shanghai start time, e.g. 2025-01-15T09:00 "
+        "(default: now)",
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Clock speed multiplier"
+    )
+    parser.add_argument("--revision-rate", type=float, default=0.05)
+    parser.add_argument("--nan-rate", type=float, default=0.001)
+    parser.add_argument("--delay-ms", type=float, default=50.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    start = (
+        SH_TZ.localize(datetime.fromisoformat(args.start))
+        if args.start
+        else datetime.now(SH_TZ)
+    )
+    cfg = MockConfig(
+        revision_rate=args.revision_rate,
+        nan_rate=args.nan_rate,
+        delay_ms=args.delay_ms,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    srv = MockSGEServer(
+        MockClock(start, args.speed), cfg, args.host, args.port
+    )
+    print(f"Mock SGE on {srv.base_url}/graph/quotations")
+    print(f"Mock Alpha Vantage on {srv.base_url}/query")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
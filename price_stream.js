@@ -1,10 +1,39 @@
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+
+// Insert or replace a point in rows sorted by `key`. Wire timestamps
+// share the +08:00 offset, so they order correctly as strings.
+function upsertPoint(rows, point, key = "timestamp") {
+  const ts = point[key];
+  if (!rows.length || rows[rows.length - 1][key] < ts) {
+    rows.push(point);
+    return;
+  }
+  let lo = 0;
+  let hi = rows.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (rows[mid][key] < ts) lo = mid + 1;
+    else hi = mid;
+  }
+  if (rows[lo] && rows[lo][key] === ts) rows[lo] = point;
+  else rows.splice(lo, 0, point);
+}
+
 export class PriceStream {
   constructor(url) {
     this.url = url;
     this.ws = null;
     this.handlers = new Map(); // key -> callback
+    this.candles = new Map(); // "metal:interval" -> { rows, handler }
     this.cache = new Map(); // offset_hours -> data
+    this.parts = new Map(); // streamed history range -> rows so far
     this.currentData = null;
+    this.seq = null; // change sequence the live data reflects
+    this.fx = null; // latest FX change the live data reflects
+    this.resyncing = false;
+    this.closed = false;
+    this.reconnectMs = RECONNECT_MIN_MS;
   }
 
   on(key, handler) {
@@ -19,19 +48,53 @@ export class PriceStream {
     return this;
   }
 
+  onCandles(metal, intervalMin, handler) {
+    // Subscribe to server-built candles; live raw points for `metal` then
+    // stop reaching its `on` handler
+    const key = `${metal}:${intervalMin}`;
+    this.candles.set(key, { metal, intervalMin, rows: [], handler });
+    this._subscribeCandles(metal, intervalMin);
+    return this;
+  }
+
+  _subscribeCandles(metal, intervalMin) {
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(JSON.stringify({
+        type: "ohlc",
+        metal,
+        interval: intervalMin
+      }));
+    }
+  }
+
   connect() {
     // Connect to WebSocket server and set up event handlers
     if (this.ws) return;
+    this.closed = false;
 
-    this.ws = new WebSocket(this.url);
+    const ws = new WebSocket(this._resumeUrl());
+    this.ws = ws;
 
     this.ws.onopen = () => {
       console.log("ws connected");
+      this.reconnectMs = RECONNECT_MIN_MS;
+      for (const { metal, intervalMin } of this.candles.values()) {
+        this._subscribeCandles(metal, intervalMin);
+      }
     };
 
     this.ws.onclose = () => {
       console.log("ws disconnected");
+      if (this.ws !== ws) return;
       this.ws = null;
+      this.resyncing = false;
+      if (!this.closed) {
+        // Jittered backoff so a server restart is not met by every client
+        // at once
+        const delay = this.reconnectMs * (0.5 + Math.random());
+        this.reconnectMs = Math.min(this.reconnectMs * 2, RECONNECT_MAX_MS);
+        setTimeout(() => this.closed || this.connect(), delay);
+      }
     };
 
     this.ws.onerror = (err) => {
@@ -47,12 +110,23 @@ export class PriceStream {
         return;
       }
 
-      // Check if this is a fetch response or live data
-      if (payload._offset !== undefined) {
+      // Candles, history part, fetch response, live delta, or live snapshot
+      if (payload._ohlc !== undefined) {
+        this._applyCandles(payload);
+      } else if (payload._part !== undefined) {
+        this._applyPart(payload);
+      } else if (payload._offset !== undefined) {
         this.cache.set(payload._offset, payload);
         this._triggerHandlers(payload);
-      } else {
+      } else if (payload._prev !== undefined) {
+        this._applyDelta(payload);
+      } else if (payload._seq !== undefined) {
         this.currentData = payload;
+        this.seq = payload._seq;
+        this.fx = payload._fx ?? null;
+        this.resyncing = false;
+        this._triggerHandlers(payload, true);
+      } else {
         this._triggerHandlers(payload);
       }
     };
@@ -60,8 +134,92 @@ export class PriceStream {
     return this;
   }
 
-  _triggerHandlers(payload) {
+  _resumeUrl() {
+    // Present what we hold so the server only sends what we missed
+    if (this.seq === null) return this.url;
+    const url = new URL(this.url);
+    url.searchParams.set("resume", this.seq);
+    if (this.fx !== null) url.searchParams.set("fx", this.fx);
+    return url.toString();
+  }
+
+  _applyDelta(delta) {
+    // Deltas carry current values, so overlap is harmless; a gap is not
+    if (this.seq === null || delta._prev > this.seq) {
+      if (!this.resyncing && this.ws && this.ws.readyState === WebSocket.OPEN) {
+        this.resyncing = true;
+        this.ws.send(JSON.stringify({ type: "resync" }));
+      }
+      return;
+    }
+
+    const changed = {};
+    for (const [key, points] of Object.entries(delta)) {
+      if (key.startsWith("_")) continue;
+      const rows = this.currentData[key] || (this.currentData[key] = []);
+      for (const point of points) upsertPoint(rows, point);
+      changed[key] = rows;
+    }
+
+    // Drop points that slid out of the live window
+    for (const [key, rows] of Object.entries(this.currentData)) {
+      if (key.startsWith("_") || !Array.isArray(rows)) continue;
+      let n = 0;
+      while (n < rows.length && rows[n].timestamp < delta._since) n++;
+      if (n) {
+        rows.splice(0, n);
+        changed[key] = rows;
+      }
+    }
+
+    this.seq = Math.max(this.seq, delta._seq);
+    this.currentData._seq = this.seq;
+    this._triggerHandlers(changed, true);
+  }
+
+  _applyCandles(payload) {
+    // Full candle set, or just the candles that changed (`_update`)
+    for (const entry of this.candles.values()) {
+      const candles = payload[entry.metal];
+      if (entry.intervalMin !== payload._ohlc || !candles) continue;
+      if (!payload._update) entry.rows = [];
+      for (const c of candles) upsertPoint(entry.rows, c, "date");
+      let n = 0;
+      while (n < entry.rows.length && entry.rows[n].date < payload._first) n++;
+      if (n) entry.rows.splice(0, n);
+      this._emitCandles(entry);
+    }
+  }
+
+  _emitCandles(entry) {
+    entry.handler(entry.rows.map((c) => ({ ...c, date: new Date(c.date) })));
+  }
+
+  _applyPart(payload) {
+    // Long history replies arrive in parts; redraw with the rows so far so
+    // the chart fills in as they land
+    const key = JSON.stringify(payload._range);
+    if (payload._part === 0) this.parts.set(key, {});
+    const acc = this.parts.get(key);
+    if (!acc) return;
+    for (const [metal, rows] of Object.entries(payload)) {
+      if (metal.startsWith("_")) continue;
+      acc[metal] = (acc[metal] || []).concat(rows);
+    }
+    if (payload._done) this.parts.delete(key);
+    this._triggerHandlers(acc);
+  }
+
+  _hasCandles(metal) {
+    for (const entry of this.candles.values()) {
+      if (entry.metal === metal) return true;
+    }
+    return false;
+  }
+
+  _triggerHandlers(payload, live = false) {
     for (const [key, handler] of this.handlers) {
+      if (live && this._hasCandles(key)) continue;
       const data = payload[key];
       if (data && data.length) {
         handler(data);
@@ -78,7 +236,10 @@ export class PriceStream {
 
     // Merge current data with historical fetch
     if (offsetHours === 0 && this.currentData) {
-      this._triggerHandlers(this.currentData);
+      this._triggerHandlers(this.currentData, true);
+      for (const entry of this.candles.values()) {
+        if (entry.rows.length) this._emitCandles(entry);
+      }
       return;
     }
 
@@ -102,6 +263,7 @@ export class PriceStream {
 
   close() {
     // Close WebSocket connection
+    this.closed = true;
     if (this.ws) {
       this.ws.close();
       this.ws = null;
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+SQLite connection setup shared by collector.py and websocket_metals.py.
+
+The database runs in WAL mode so the collector's commits never block
+readers and readers never block the collector. Readers get long-lived
+read-only connections from `ReaderPool`, one per pool thread, so each
+poll reuses an open connection and its prepared statements instead of
+reconnecting and re-parsing the schema.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, TypeVar
+
+# Page cache per connection, in KiB (negative cache_size)
+CACHE_SIZE_KIB = int(os.environ.get("SQLITE_CACHE_KIB", "65536"))
+# Bytes of the database file mapped into memory for reads
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+# How long a connection waits on a lock before SQLITE_BUSY
+BUSY_TIMEOUT_MS = 5000
+# Prepared statements kept per connection
+STATEMENT_CACHE = 256
+
+T = TypeVar("T")
+
+
+def _tune(conn: sqlite3.Connection) -> None:
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+
+
+def connect_writer(path: str) -> sqlite3.Connection:
+    """Open the writer connection: WAL journal, synchronous=NORMAL."""
+    conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE)
+    # Persistent: readers opened later see the WAL without setting it
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode NORMAL only risks the last commits on power loss,
+    # never corruption, and skips an fsync per transaction
+    conn.execute("PRAGMA synchronous = NORMAL")
+    _tune(conn)
+    return conn
+
+
+def connect_reader(path: str) -> sqlite3.Connection:
+    """Open a read-only connection returning sqlite3.Row rows."""
+    conn = sqlite3.connect(
+        Path(path).resolve().as_uri() + "?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    _tune(conn)
+    return conn
+
+
+class ReaderPool:
+    """
+    A small thread pool for blocking reads. Each pool thread keeps one
+    long-lived read-only connection, so reads run in parallel with each
+    other and with the writer.
+    """
+
+    def __init__(self, db_path: str, threads: int = 4):
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(threads, "db-reader")
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's read-only connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_reader(self.db_path)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Call `fn(*args)` on a reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    def close(self) -> None:
+        """Stop the pool and close every connection it opened."""
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
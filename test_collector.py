@@ -1,14 +1,35 @@
 import os
 import sqlite3
 import tempfile
+import threading
 from datetime import datetime
 from unittest.mock import MagicMock, patch
 
-from collector import (FX_DEFAULT, SH_TZ, Instrument, can_make_fx_request,
-                       fetch_sge, get_cached_fx, inc_fx_request,
-                       last_closed_minute_sh, market_cutoff_sh,
-                       parse_delaystr_sh, parse_point_timestamp_iso,
-                       trading_day_start_date_sh)
+import pytest
+
+from collector import (
+    FX_DEFAULT,
+    INVALID_TS,
+    PRICE_ROLLUPS_DDL,
+    SESSIONS_DDL,
+    SH_TZ,
+    Instrument,
+    can_make_fx_request,
+    epoch_to_iso_sh,
+    fetch_all,
+    fetch_sge,
+    get_cached_fx,
+    inc_fx_request,
+    last_closed_minute_sh,
+    make_http_session,
+    market_cutoff_sh,
+    next_poll_sh,
+    parse_delaystr_sh,
+    parse_holidays,
+    parse_point_timestamp_iso,
+    parse_points_epoch,
+    trading_day_start_date_sh,
+)
 
 
 class TestTradingDayLogic:
@@ -77,6 +98,79 @@ class TestTradingDayLogic:
         assert result == expected
 
 
+class TestPollScheduler:
+    """Test session-aware poll scheduling."""
+
+    def test_next_poll_in_day_session(self):
+        """Test polling just after the next minute closes."""
+        # Wednesday 14:30:30 -> 14:31:03
+        now = SH_TZ.localize(datetime(2025, 1, 15, 14, 30, 30))
+        expected = SH_TZ.localize(datetime(2025, 1, 15, 14, 31, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_before_delay_elapsed(self):
+        """Test a wake inside the delay targets the current minute."""
+        now = SH_TZ.localize(datetime(2025, 1, 15, 14, 31, 1))
+        expected = SH_TZ.localize(datetime(2025, 1, 15, 14, 31, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_during_morning_break(self):
+        """Test sleeping through the 02:30-09:00 break."""
+        now = SH_TZ.localize(datetime(2025, 1, 15, 5, 0))
+        expected = SH_TZ.localize(datetime(2025, 1, 15, 9, 1, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_during_evening_break(self):
+        """Test sleeping through the 15:30-20:00 break."""
+        now = SH_TZ.localize(datetime(2025, 1, 15, 16, 0))
+        expected = SH_TZ.localize(datetime(2025, 1, 15, 20, 1, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_over_weekend(self):
+        """Test Saturday sleeps until Monday's day session."""
+        # Friday night session runs until Saturday 02:30
+        now = SH_TZ.localize(datetime(2025, 1, 18, 12, 0))
+        expected = SH_TZ.localize(datetime(2025, 1, 20, 9, 1, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_friday_night_session(self):
+        """Test Friday evening opens the night session."""
+        now = SH_TZ.localize(datetime(2025, 1, 17, 19, 0))
+        expected = SH_TZ.localize(datetime(2025, 1, 17, 20, 1, 3))
+        assert next_poll_sh(now) == expected
+
+    def test_next_poll_holiday_hook(self):
+        """Test a closed day from the calendar hook is skipped."""
+        holidays = parse_holidays("2025-01-16")
+
+        def is_open(d):
+            return d.weekday() < 5 and d not in holidays
+
+        # Night sessions either side and the holiday itself are closed
+        now = SH_TZ.localize(datetime(2025, 1, 15, 16, 0))
+        expected = SH_TZ.localize(datetime(2025, 1, 17, 9, 1, 3))
+        assert next_poll_sh(now, is_open) == expected
+
+    def test_first_poll_after_open_writes_new_trading_day(self):
+        """Test the night-open poll never anchors to the previous day."""
+        now = SH_TZ.localize(datetime(2025, 1, 15, 19, 0))
+        first = next_poll_sh(now)
+        assert first == SH_TZ.localize(datetime(2025, 1, 15, 20, 1, 3))
+        # A wake inside the first minute also waits for it to close
+        inside = SH_TZ.localize(datetime(2025, 1, 15, 20, 0, 1))
+        assert next_poll_sh(inside) == first
+
+        ts = parse_points_epoch(["20:00", "20:01"], market_cutoff_sh(first))
+        assert epoch_to_iso_sh(ts[0]) == "2025-01-15T20:00:00+08:00"
+        assert ts[1] == INVALID_TS
+
+    def test_next_poll_after_session_grace(self):
+        """Test one more poll right after the session closes."""
+        now = SH_TZ.localize(datetime(2025, 1, 15, 15, 30, 10))
+        expected = SH_TZ.localize(datetime(2025, 1, 15, 15, 31, 3))
+        assert next_poll_sh(now) == expected
+
+
 class TestDelayStringParsing:
     """Test SGE delay string parsing."""
 
@@ -140,6 +234,171 @@ class TestTimestampParsing:
         assert result is None
 
 
+class TestSchemaMigration:
+    """Test v1 (ISO TEXT) to v2 (epoch INTEGER) migration."""
+
+    def setup_method(self):
+        """Set up a v1 database."""
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE prices (
+                metal TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                price_cny REAL NOT NULL,
+                usd_cny_rate REAL,
+                PRIMARY KEY (metal, timestamp)
+            )
+            """)
+        conn.executemany(
+            "INSERT INTO prices VALUES(?, ?, ?, ?)",
+            [
+                (metal, f"2025-01-15T14:{m:02d}:00+08:00", 500.0 + m, 7.1)
+                for metal in ("gold", "silver")
+                for m in range(10)
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+    def teardown_method(self):
+        """Clean up test database."""
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def test_migrate_db_batches(self):
+        """Test all rows are copied as epoch seconds across batches."""
+        from collector import migrate_db
+
+        conn = sqlite3.connect(self.db_path)
+        copied = migrate_db(conn, batch_rows=3)
+        assert copied >= 20
+
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(prices)")]
+        assert cols == ["metal", "ts", "price_cny"]
+        fx = conn.execute("SELECT rate FROM fx_rates").fetchall()
+        assert fx == [(7.1,)]
+        rows = conn.execute(
+            "SELECT ts, price_cny FROM prices WHERE metal = 'gold' "
+            "ORDER BY ts"
+        ).fetchall()
+        assert len(rows) == 10
+        assert epoch_to_iso_sh(rows[0][0]) == "2025-01-15T14:00:00+08:00"
+        assert rows[9][1] == 509.0
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 6
+
+        # Second run is a no-op
+        assert migrate_db(conn) == 0
+        conn.close()
+
+    def test_migrate_creates_change_feed(self):
+        """Test a migrated file has the change feed and its triggers."""
+        from collector import migrate_db
+
+        conn = sqlite3.connect(self.db_path)
+        migrate_db(conn)
+        names = {
+            r[0]
+            for r in conn.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type IN ('table', 'trigger', 'index')"
+            )
+        }
+        assert {
+            "price_changes",
+            "prices_log_insert",
+            "prices_log_update",
+            "price_rollups",
+            "sessions",
+            "sessions_start",
+        } <= names
+        conn.execute("INSERT INTO prices VALUES ('gold', 0, 1.0)")
+        changes = conn.execute("SELECT metal, ts FROM price_changes")
+        assert changes.fetchall() == [("gold", 0)]
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT DISTINCT start_ts FROM sessions "
+            "ORDER BY start_ts DESC LIMIT 2"
+        ).fetchall()
+        assert "sessions_start" in plan[0][3]
+        conn.close()
+
+    def test_migrate_v2_extracts_fx_changes(self):
+        """Test a v2 table keeps only FX change points."""
+        from collector import migrate_db
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DROP TABLE prices")
+        conn.execute(
+            "CREATE TABLE prices (metal TEXT NOT NULL, ts INTEGER NOT NULL, "
+            "price_cny REAL NOT NULL, usd_cny_rate REAL, "
+            "PRIMARY KEY (metal, ts)) WITHOUT ROWID"
+        )
+        rates = [7.1, 7.1, 7.2, 7.2, 7.1]
+        conn.executemany(
+            "INSERT INTO prices VALUES(?, ?, ?, ?)",
+            [("gold", 60 * i, 500.0, r) for i, r in enumerate(rates)],
+        )
+        conn.commit()
+
+        assert migrate_db(conn) == 5
+        fx = conn.execute("SELECT ts, rate FROM fx_rates ORDER BY ts")
+        assert fx.fetchall() == [(0, 7.1), (120, 7.2), (240, 7.1)]
+        conn.close()
+
+    def test_init_db_migrates_legacy(self):
+        """Test init_db upgrades a v1 database in place."""
+        from collector import init_db
+
+        conn = init_db(self.db_path)
+        count = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+        assert count == 20
+        conn.close()
+
+
+class TestBatchTimestampParsing:
+    """Test vectorized HH:MM anchoring."""
+
+    def test_parse_points_epoch_spans_night_and_day(self):
+        """Test night points land on td0 and later points on td0 + 1."""
+        from collector import INVALID_TS
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 16, 14, 30))
+        times = ["20:00", "23:59", "00:00", "02:30", "9:00", "14:30"]
+        result = parse_points_epoch(times, cutoff)
+
+        assert INVALID_TS not in result
+        assert [epoch_to_iso_sh(ts) for ts in result] == [
+            "2025-01-15T20:00:00+08:00",
+            "2025-01-15T23:59:00+08:00",
+            "2025-01-16T00:00:00+08:00",
+            "2025-01-16T02:30:00+08:00",
+            "2025-01-16T09:00:00+08:00",
+            "2025-01-16T14:30:00+08:00",
+        ]
+
+    def test_parse_points_epoch_masks_future_and_invalid(self):
+        """Test points past the cutoff or unparseable are masked."""
+        from collector import INVALID_TS
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 15, 14, 30, 45))
+        result = parse_points_epoch(["14:30", "14:31", "bad", "25:00"], cutoff)
+
+        assert result[0] != INVALID_TS
+        assert list(result[1:]) == [INVALID_TS] * 3
+
+    def test_parse_points_epoch_matches_scalar(self):
+        """Test batch results agree with the per-point parser."""
+        cutoff = SH_TZ.localize(datetime(2025, 1, 16, 1, 30))
+        times = [f"{h:02d}:{m:02d}" for h in (20, 21, 0, 1) for m in (0, 59)]
+        batch = parse_points_epoch(times, cutoff)
+        for t, ts in zip(times, batch):
+            iso = parse_point_timestamp_iso(t, cutoff)
+            if iso is None:
+                assert ts == -1
+            else:
+                assert ts == int(datetime.fromisoformat(iso).timestamp())
+
+
 class TestFXRateLimiting:
     """Test FX API rate limiting logic."""
 
@@ -147,25 +406,18 @@ class TestFXRateLimiting:
         """Set up test database."""
         self.db_fd, self.db_path = tempfile.mkstemp()
         self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute(
-            """
+        self.conn.execute("""
             CREATE TABLE api_requests (
                 date TEXT PRIMARY KEY,
                 alpha_vantage_count INTEGER DEFAULT 0
             )
-            """
-        )
-        self.conn.execute(
-            """
-            CREATE TABLE prices (
-                metal TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                price_cny REAL NOT NULL,
-                usd_cny_rate REAL,
-                PRIMARY KEY (metal, timestamp)
+            """)
+        self.conn.execute("""
+            CREATE TABLE fx_rates (
+                ts INTEGER PRIMARY KEY,
+                rate REAL NOT NULL
             )
-            """
-        )
+            """)
         self.conn.commit()
 
     def teardown_method(self):
@@ -234,14 +486,27 @@ class TestFXRateLimiting:
     def test_get_cached_fx_with_data(self):
         """Test getting cached FX rate with existing data."""
         self.conn.execute(
-            "INSERT INTO prices(metal, timestamp, price_cny, usd_cny_rate) "
-            "VALUES(?, ?, ?, ?)",
-            ("gold", "2025-01-15T14:30:00+08:00", 500.0, 7.2345),
+            "INSERT INTO fx_rates(ts, rate) VALUES(?, ?)",
+            (1736922600, 7.2345),
         )
         self.conn.commit()
         result = get_cached_fx(self.conn)
         assert result == 7.2345
 
+    def test_record_fx_only_on_change(self):
+        """Test the FX series only grows when the rate changes."""
+        from collector import record_fx
+
+        assert record_fx(self.conn, 7.1, ts=100) is True
+        assert record_fx(self.conn, 7.1, ts=200) is False
+        assert record_fx(self.conn, 7.2, ts=300) is True
+
+        rows = self.conn.execute(
+            "SELECT ts, rate FROM fx_rates ORDER BY ts"
+        ).fetchall()
+        assert rows == [(100, 7.1), (300, 7.2)]
+        assert get_cached_fx(self.conn) == 7.2
+
 
 class TestSGEFetching:
     """Test SGE API data fetching."""
@@ -288,6 +553,80 @@ class TestSGEFetching:
         assert prices[0] == 500.50
         assert prices[1] != prices[1]  # NaN check
 
+    def test_fetch_sge_uses_session(self):
+        """Test SGE fetch goes through the supplied pooled session."""
+        session = MagicMock()
+        session.post.return_value.json.return_value = {
+            "times": ["14:30"],
+            "data": ["500.50"],
+        }
+
+        inst = Instrument(metal="gold", instid="Au(T%2BD)", unit="CNY/g")
+        times, prices, _ = fetch_sge(inst, session)
+
+        session.post.assert_called_once()
+        assert times == ["14:30"]
+        assert prices == [500.50]
+
+    def test_make_http_session_pool(self):
+        """Test pooled session carries SGE headers and sized adapter."""
+        session = make_http_session(pool_size=4)
+        adapter = session.get_adapter("https://en.sge.com.cn/")
+        assert adapter._pool_maxsize == 4
+        assert session.headers["Origin"] == "https://en.sge.com.cn"
+        session.close()
+
+
+class TestFetchAll:
+    """Test concurrent fetch stage."""
+
+    def test_fetch_all_runs_concurrently(self):
+        """Test all instruments are in flight at the same time."""
+        insts = [
+            Instrument(metal=f"m{i}", instid=f"X{i}", unit="CNY/g")
+            for i in range(4)
+        ]
+        barrier = threading.Barrier(len(insts), timeout=5)
+
+        def fake_fetch(inst, session=None):
+            # Deadlocks (BrokenBarrierError) unless all run in parallel
+            barrier.wait()
+            return [inst.instid], [1.0], {}
+
+        with patch("collector.fetch_sge", side_effect=fake_fetch):
+            results = fetch_all(insts, max_workers=4)
+
+        assert [r[0] for r in results] == [["X0"], ["X1"], ["X2"], ["X3"]]
+
+    def test_fetch_all_propagates_errors(self):
+        """Test a failed instrument fetch is re-raised."""
+        insts = [Instrument(metal="gold", instid="Au", unit="CNY/g")]
+        with patch("collector.fetch_sge", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError):
+                fetch_all(insts)
+
+    def test_fetch_all_return_exceptions(self):
+        """Test failures can be returned in place of results."""
+        insts = [
+            Instrument(metal="gold", instid="Au", unit="CNY/g"),
+            Instrument(metal="silver", instid="Ag", unit="CNY/kg"),
+        ]
+
+        def fake_fetch(inst, session=None):
+            if inst.metal == "gold":
+                raise RuntimeError("boom")
+            return ["14:30"], [1.0], {}
+
+        with patch("collector.fetch_sge", side_effect=fake_fetch):
+            results = fetch_all(insts, return_exceptions=True)
+
+        assert isinstance(results[0], RuntimeError)
+        assert results[1] == (["14:30"], [1.0], {})
+
+    def test_fetch_all_empty(self):
+        """Test fetching no instruments returns no results."""
+        assert fetch_all([]) == []
+
 
 class TestFetchFX:
     """Test FX rate fetching logic."""
@@ -296,25 +635,18 @@ class TestFetchFX:
         """Set up test database."""
         self.db_fd, self.db_path = tempfile.mkstemp()
         self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute(
-            """
+        self.conn.execute("""
             CREATE TABLE api_requests (
                 date TEXT PRIMARY KEY,
                 alpha_vantage_count INTEGER DEFAULT 0
             )
-            """
-        )
-        self.conn.execute(
-            """
-            CREATE TABLE prices (
-                metal TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                price_cny REAL NOT NULL,
-                usd_cny_rate REAL,
-                PRIMARY KEY (metal, timestamp)
+            """)
+        self.conn.execute("""
+            CREATE TABLE fx_rates (
+                ts INTEGER PRIMARY KEY,
+                rate REAL NOT NULL
             )
-            """
-        )
+            """)
         self.conn.commit()
 
     def teardown_method(self):
@@ -390,17 +722,16 @@ class TestStorePoints:
         """Set up test database."""
         self.db_fd, self.db_path = tempfile.mkstemp()
         self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute(
-            """
+        self.conn.execute("""
             CREATE TABLE prices (
                 metal TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
+                ts INTEGER NOT NULL,
                 price_cny REAL NOT NULL,
-                usd_cny_rate REAL,
-                PRIMARY KEY (metal, timestamp)
-            )
-            """
-        )
+                PRIMARY KEY (metal, ts)
+            ) WITHOUT ROWID
+            """)
+        self.conn.execute(PRICE_ROLLUPS_DDL)
+        self.conn.execute(SESSIONS_DDL)
         self.conn.commit()
 
     def teardown_method(self):
@@ -417,15 +748,11 @@ class TestStorePoints:
         times = ["14:25", "14:26"]
         prices = [500.0, 501.0]
 
-        result = store_points(
-            self.conn, "gold", cutoff, 7.0, times, prices, {}
-        )
+        result = store_points(self.conn, "gold", cutoff, times, prices, {})
         assert result == 2
 
         # Verify data was stored
-        rows = self.conn.execute(
-            "SELECT * FROM prices ORDER BY timestamp"
-        ).fetchall()
+        rows = self.conn.execute("SELECT * FROM prices ORDER BY ts").fetchall()
         assert len(rows) == 2
         assert rows[0][2] == 500.0  # price_cny
         assert rows[1][2] == 501.0
@@ -438,7 +765,493 @@ class TestStorePoints:
         times = ["14:25", "14:26"]
         prices = [500.0, float("nan")]
 
-        result = store_points(
-            self.conn, "gold", cutoff, 7.0, times, prices, {}
-        )
+        result = store_points(self.conn, "gold", cutoff, times, prices, {})
         assert result == 1  # Only one valid price stored
+
+    def test_store_points_skips_unchanged(self):
+        """Test re-sending the same payload writes nothing."""
+        from collector import store_points
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 15, 14, 30))
+        times = ["14:25", "14:26"]
+        prices = [500.0, 501.0]
+
+        store_points(self.conn, "gold", cutoff, times, prices, {})
+        result = store_points(self.conn, "gold", cutoff, times, prices, {})
+        assert result == 0
+
+    def test_store_points_writes_revisions_and_new(self):
+        """Test only revised and new points are written."""
+        from collector import store_points
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 15, 14, 30))
+        store_points(
+            self.conn, "gold", cutoff, ["14:25", "14:26"], [500, 501], {}
+        )
+        times = ["14:25", "14:26", "14:27"]
+        prices = [500.0, 502.0, 503.0]
+        result = store_points(self.conn, "gold", cutoff, times, prices, {})
+        assert result == 2
+
+        rows = self.conn.execute(
+            "SELECT price_cny FROM prices ORDER BY ts"
+        ).fetchall()
+        assert rows == [(500.0,), (502.0,), (503.0,)]
+
+    def test_store_points_min_max_filter(self):
+        """Test points outside meta min/max are dropped."""
+        from collector import store_points
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 15, 14, 30))
+        times = ["14:25", "14:26", "14:27"]
+        prices = [499.0, 500.5, 502.0]
+        meta = {"min": 500.0, "max": 501.0}
+        result = store_points(self.conn, "gold", cutoff, times, prices, meta)
+        assert result == 1
+
+
+class TestIngestWatermark:
+    """Test incremental ingest using persisted watermarks."""
+
+    def setup_method(self):
+        """Set up test database with full schema."""
+        from collector import init_db
+
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.conn = init_db(self.db_path)
+        self.cutoff = SH_TZ.localize(datetime(2025, 1, 15, 14, 30))
+        self.times = [f"14:{m:02d}" for m in range(0, 20)]
+        self.prices = [500.0 + m for m in range(0, 20)]
+
+    def teardown_method(self):
+        """Clean up test database."""
+        self.conn.close()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _store(self, times, prices, marks):
+        from collector import store_points
+
+        return store_points(
+            self.conn, "gold", self.cutoff, times, prices, {}, marks
+        )
+
+    def test_watermark_persisted(self):
+        """Test watermark is stored in memory and in the DB."""
+        from collector import REVISION_WINDOW_MIN, load_ingest_marks
+
+        marks = {}
+        self._store(self.times, self.prices, marks)
+        mark = marks["gold"]
+        assert epoch_to_iso_sh(mark.watermark) == "2025-01-15T14:19:00+08:00"
+        assert mark.resume_index == 20 - REVISION_WINDOW_MIN
+        assert load_ingest_marks(self.conn) == marks
+
+    def test_unchanged_prefix_skipped(self):
+        """Test only the revision window and new points are examined."""
+        from collector import REVISION_WINDOW_MIN
+
+        marks = {}
+        self._store(self.times, self.prices, marks)
+        times = self.times + ["14:20"]
+        prices = self.prices + [520.0]
+
+        with patch(
+            "collector.parse_points_epoch", wraps=parse_points_epoch
+        ) as parse:
+            wrote = self._store(times, prices, marks)
+
+        assert wrote == 1
+        assert len(parse.call_args[0][0]) == REVISION_WINDOW_MIN + 1
+
+    def test_revision_inside_window_detected(self):
+        """Test a revised point inside the window is rewritten."""
+        marks = {}
+        self._store(self.times, self.prices, marks)
+        prices = list(self.prices)
+        prices[-1] = 600.0
+        wrote = self._store(self.times, prices, marks)
+        assert wrote == 1
+        row = self.conn.execute(
+            "SELECT price_cny FROM prices WHERE ts = ?",
+            (int(SH_TZ.localize(datetime(2025, 1, 15, 14, 19)).timestamp()),),
+        ).fetchone()
+        assert row[0] == 600.0
+
+    def test_changed_prefix_triggers_full_scan(self):
+        """Test a fingerprint mismatch falls back to a full scan."""
+        marks = {}
+        self._store(self.times, self.prices, marks)
+        prices = [p + 1 for p in self.prices]
+        wrote = self._store(self.times, prices, marks)
+        assert wrote == 20
+
+
+class TestBackfill:
+    """Test bulk historical import."""
+
+    def setup_method(self):
+        """Set up a fresh database and input directory."""
+        from collector import init_db
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = init_db(os.path.join(self.tmp.name, "test.db"))
+
+    def teardown_method(self):
+        """Clean up."""
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_and_jsonl_chunked(self):
+        """Test rows load across chunks with ISO and epoch timestamps."""
+        from collector import backfill
+
+        csv_path = self._write(
+            "gold.csv",
+            "metal,timestamp,price_cny\n"
+            + "".join(
+                f"gold,2025-01-15T14:{m:02d}:00+08:00,{600 + m}\n"
+                for m in range(5)
+            ),
+        )
+        jsonl_path = self._write(
+            "silver.jsonl",
+            '{"ts": 1736920800, "price_cny": 8000}\n'
+            '{"ts": 1736920860, "price": "8001.5"}\n',
+        )
+
+        loaded = backfill(
+            self.conn, [csv_path, jsonl_path], metal="silver", chunk_rows=2
+        )
+
+        assert loaded == 7
+        rows = self.conn.execute(
+            "SELECT metal, COUNT(*) FROM prices GROUP BY metal"
+        ).fetchall()
+        assert rows == [("gold", 5), ("silver", 2)]
+        ts = int(SH_TZ.localize(datetime(2025, 1, 15, 14, 0)).timestamp())
+        price = self.conn.execute(
+            "SELECT price_cny FROM prices WHERE metal = 'gold' AND ts = ?",
+            (ts,),
+        ).fetchone()[0]
+        assert price == 600.0
+
+    def test_idempotent_last_write_wins(self):
+        """Test re-running a backfill replaces rather than duplicates."""
+        from collector import backfill
+
+        path = self._write("a.csv", "metal,ts,price_cny\ngold,60,1.0\n")
+        backfill(self.conn, [path])
+        path = self._write("a.csv", "metal,ts,price_cny\ngold,60,2.0\n")
+        backfill(self.conn, [path])
+
+        rows = self.conn.execute("SELECT ts, price_cny FROM prices")
+        assert rows.fetchall() == [(60, 2.0)]
+
+    def test_archived_sge_responses(self):
+        """Test archived responses are anchored by their delaystr."""
+        import json
+
+        from collector import backfill
+
+        os.mkdir(os.path.join(self.tmp.name, "archive"))
+        self._write(
+            "archive/0001.json",
+            json.dumps(
+                {
+                    "heyue": "Au(T+D)",
+                    "times": ["20:00", "20:01", "20:02"],
+                    "data": ["600.0", "-", "601.0"],
+                    "delaystr": "2025年01月14日 20:05:00",
+                }
+            ),
+        )
+
+        loaded = backfill(self.conn, [os.path.join(self.tmp.name, "archive")])
+
+        assert loaded == 2
+        rows = self.conn.execute(
+            "SELECT metal, ts FROM prices ORDER BY ts"
+        ).fetchall()
+        assert rows[0][0] == "gold"
+        assert epoch_to_iso_sh(rows[0][1]) == "2025-01-14T20:00:00+08:00"
+
+    def test_secondary_indexes_rebuilt(self):
+        """Test indexes dropped for the load are recreated."""
+        from collector import backfill
+
+        self.conn.execute("CREATE INDEX prices_price ON prices(price_cny)")
+        path = self._write("a.csv", "metal,ts,price_cny\ngold,60,1.0\n")
+        backfill(self.conn, [path])
+
+        names = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND name = 'prices_price'"
+        ).fetchall()
+        assert names == [("prices_price",)]
+
+    def test_change_feed_bounded(self):
+        """Test a backfill leaves one change past the old feed head."""
+        from collector import backfill
+
+        self.conn.execute(
+            "INSERT INTO prices (metal, ts, price_cny) VALUES ('gold', 0, 1)"
+        )
+        self.conn.commit()
+        (head,) = self.conn.execute(
+            "SELECT MAX(seq) FROM price_changes"
+        ).fetchone()
+        path = self._write(
+            "a.csv",
+            "metal,ts,price_cny\n"
+            + "".join(f"gold,{60 * (i + 1)},{600 + i}\n" for i in range(50)),
+        )
+        assert backfill(self.conn, [path], chunk_rows=7) == 50
+
+        rows = self.conn.execute(
+            "SELECT seq, metal, ts FROM price_changes"
+        ).fetchall()
+        assert rows == [(head + 2, "gold", 3000)]
+
+        # Triggers are back in place for the live collector
+        self.conn.execute(
+            "INSERT INTO prices (metal, ts, price_cny) "
+            "VALUES ('gold', 3060, 1)"
+        )
+        self.conn.commit()
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM price_changes"
+        ).fetchone()
+        assert count == 2
+
+
+class TestChangeFeed:
+    """Test the price_changes sequence feed."""
+
+    def setup_method(self):
+        """Set up a fresh database."""
+        from collector import init_db
+
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.conn = init_db(self.db_path)
+
+    def teardown_method(self):
+        """Clean up test database."""
+        self.conn.close()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _feed(self):
+        return self.conn.execute(
+            "SELECT seq, metal, ts FROM price_changes ORDER BY seq"
+        ).fetchall()
+
+    def test_inserts_and_revisions_logged(self):
+        """Test new and revised prices get increasing seqs, no-ops none."""
+        from collector import PRICE_UPSERT_SQL
+
+        self.conn.executemany(
+            PRICE_UPSERT_SQL, [("gold", 60, 1.0), ("gold", 120, 2.0)]
+        )
+        self.conn.executemany(
+            PRICE_UPSERT_SQL, [("gold", 60, 1.0), ("gold", 120, 2.5)]
+        )
+        self.conn.commit()
+
+        assert self._feed() == [
+            (1, "gold", 60),
+            (2, "gold", 120),
+            (3, "gold", 120),
+        ]
+
+    def test_prune_keeps_sequence_monotonic(self):
+        """Test pruning drops old entries without reusing seqs."""
+        from collector import PRICE_UPSERT_SQL, prune_changes
+
+        self.conn.executemany(
+            PRICE_UPSERT_SQL, [("gold", 60 * i, 1.0) for i in range(5)]
+        )
+        assert prune_changes(self.conn, keep=2) == 3
+        self.conn.execute(PRICE_UPSERT_SQL, ("gold", 600, 1.0))
+        self.conn.commit()
+
+        assert [r[0] for r in self._feed()] == [4, 5, 6]
+
+    def test_notify_without_listener(self):
+        """Test pinging a server that is not running is harmless."""
+        from collector import notify_readers, notify_socket_path
+
+        assert notify_readers(notify_socket_path(self.db_path)) is False
+
+
+class TestRollups:
+    """Test incrementally maintained OHLC rollups and raw retention."""
+
+    def setup_method(self):
+        """Set up a fresh database."""
+        from collector import init_db
+
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.conn = init_db(self.db_path)
+        self.cutoff = SH_TZ.localize(datetime(2025, 1, 15, 15, 30))
+
+    def teardown_method(self):
+        """Clean up test database."""
+        self.conn.close()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _store(self, times, prices):
+        from collector import store_points
+
+        store_points(self.conn, "gold", self.cutoff, times, prices, {})
+        self.conn.commit()
+
+    def _rollups(self, resolution):
+        return self.conn.execute(
+            "SELECT bucket, open, high, low, close, points "
+            "FROM price_rollups WHERE metal = 'gold' AND resolution = ? "
+            "ORDER BY bucket",
+            (resolution,),
+        ).fetchall()
+
+    def test_rollups_follow_stores_and_revisions(self):
+        """Test 5m/1h/1d buckets track new points and revisions."""
+        times = [f"14:{m:02d}" for m in range(0, 12)] + ["15:00"]
+        prices = [500.0 + m for m in range(12)] + [520.0]
+        self._store(times, prices)
+
+        five = self._rollups(300)
+        assert [epoch_to_iso_sh(r[0])[11:16] for r in five] == [
+            "14:00",
+            "14:05",
+            "14:10",
+            "15:00",
+        ]
+        assert five[0][1:] == (500.0, 504.0, 500.0, 504.0, 5)
+        hour = self._rollups(3600)
+        assert hour[0][1:] == (500.0, 511.0, 500.0, 511.0, 12)
+        (day,) = self._rollups(86400)
+        assert epoch_to_iso_sh(day[0]) == "2025-01-14T20:00:00+08:00"
+        assert day[1:] == (500.0, 520.0, 500.0, 520.0, 13)
+
+        # A revision recomputes its buckets; others are left alone
+        prices[7] = 490.0
+        self._store(times, prices)
+        five = self._rollups(300)
+        assert five[1][1:] == (505.0, 509.0, 490.0, 509.0, 5)
+        assert five[0][1:] == (500.0, 504.0, 500.0, 504.0, 5)
+        assert self._rollups(86400)[0][3] == 490.0
+
+    def test_prune_keeps_rollups(self):
+        """Test raw retention drops old minutes but not their rollups."""
+        from collector import prune_prices, update_rollups
+
+        self._store(["14:00", "14:01"], [500.0, 501.0])
+        now = int(self.cutoff.timestamp()) + 3 * 86400
+        assert prune_prices(self.conn, 2, now) == 2
+        self.conn.commit()
+        count = self.conn.execute("SELECT COUNT(*) FROM prices").fetchone()
+        assert count == (0,)
+        assert self._rollups(86400)[0][1:] == (500.0, 501.0, 500.0, 501.0, 2)
+
+        # Recomputing a bucket whose raw rows are gone leaves it intact
+        update_rollups(self.conn, "gold", [int(self.cutoff.timestamp())])
+        assert len(self._rollups(300)) == 1
+
+    def test_init_db_builds_missing_rollups(self):
+        """Test a database with prices but no rollups gets them built."""
+        from collector import PRICE_UPSERT_SQL, init_db
+
+        start = 1736920800  # 2025-01-15T14:00:00+08:00
+        self.conn.executemany(
+            PRICE_UPSERT_SQL, [("gold", start + 60 * i, 1.0) for i in range(7)]
+        )
+        self.conn.commit()
+        self.conn.close()
+
+        self.conn = init_db(self.db_path)
+        assert [r[-1] for r in self._rollups(300)] == [5, 2]
+        assert [r[-1] for r in self._rollups(86400)] == [7]
+
+
+class TestSessionIndex:
+    """Test the per-session index kept by the collector."""
+
+    def setup_method(self):
+        """Set up a fresh database."""
+        from collector import init_db
+
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.conn = init_db(self.db_path)
+
+    def teardown_method(self):
+        """Clean up test database."""
+        self.conn.close()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _sessions(self):
+        return self.conn.execute(
+            "SELECT session_id, kind, first_ts, last_ts, open, high, low, "
+            "close, points FROM sessions WHERE metal = 'gold' "
+            "ORDER BY start_ts"
+        ).fetchall()
+
+    def test_session_for(self):
+        """Test timestamps map to their night/day session or none."""
+        from collector import session_for
+
+        def at(*args):
+            return int(SH_TZ.localize(datetime(*args)).timestamp())
+
+        sid, kind, start, end = session_for(at(2025, 1, 15, 1, 0))
+        assert (sid, kind) == ("2025-01-14/night", "night")
+        assert start == at(2025, 1, 14, 20, 0)
+        assert end == at(2025, 1, 15, 2, 30)
+        assert session_for(at(2025, 1, 15, 15, 30))[0] == "2025-01-14/day"
+        assert session_for(at(2025, 1, 15, 16, 0)) is None
+
+    def test_store_points_maintains_sessions(self):
+        """Test night and day sessions are summarized and revised."""
+        from collector import store_points
+
+        night = SH_TZ.localize(datetime(2025, 1, 15, 2, 30))
+        day = SH_TZ.localize(datetime(2025, 1, 15, 9, 2))
+        store_points(
+            self.conn, "gold", night, ["02:28", "02:29"], [500.0, 502.0], {}
+        )
+        store_points(
+            self.conn, "gold", day, ["09:00", "09:01"], [503.0, 501.0], {}
+        )
+        self.conn.commit()
+
+        rows = self._sessions()
+        assert [r[0] for r in rows] == ["2025-01-14/night", "2025-01-14/day"]
+        assert epoch_to_iso_sh(rows[0][2])[11:16] == "02:28"
+        assert rows[1][4:] == (503.0, 503.0, 501.0, 501.0, 2)
+
+        store_points(
+            self.conn, "gold", day, ["09:00", "09:01"], [503.0, 509.0], {}
+        )
+        self.conn.commit()
+        assert self._sessions()[1][4:] == (503.0, 509.0, 503.0, 509.0, 2)
+
+    def test_init_db_builds_missing_sessions(self):
+        """Test a database with rollups but no session index gets one."""
+        from collector import init_db, store_points
+
+        cutoff = SH_TZ.localize(datetime(2025, 1, 15, 10, 0))
+        store_points(self.conn, "gold", cutoff, ["09:30"], [500.0], {})
+        self.conn.execute("DELETE FROM sessions")
+        self.conn.commit()
+        self.conn.close()
+
+        self.conn = init_db(self.db_path)
+        assert [r[0] for r in self._sessions()] == ["2025-01-14/day"]
@@ -25,4 +25,4 @@ echo "Expected improvements:"
 echo "- 'revising previous price' messages will show retroactive API updates"
 echo "- Price buffer should eliminate 95%+ of chart redraws"
 echo "- Debug logs show exactly what timestamps are stored vs skipped"
-echo "- Random jitter prevents API thundering herd issues"
+echo "- Polls land POLL_DELAY_SEC after each minute closes, none during breaks"
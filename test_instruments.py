@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from instruments import (DEFAULT_INSTRUMENTS, Instrument, due_instruments,
+                         load_instruments, parse_instrument)
+
+
+class TestInstrumentRegistry:
+    """Test loading the shared instrument registry."""
+
+    def setup_method(self):
+        """Create a scratch registry file."""
+        self.fd, self.path = tempfile.mkstemp(suffix=".json")
+
+    def teardown_method(self):
+        """Remove the scratch registry file."""
+        os.close(self.fd)
+        os.unlink(self.path)
+
+    def _write(self, cfg):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f)
+
+    def test_missing_file_uses_defaults(self):
+        """Test the built-in gold/silver list without a registry file."""
+        result = load_instruments("/nonexistent/instruments.json")
+        assert result == DEFAULT_INSTRUMENTS
+
+    def test_parse_instrument_encodes_instid(self):
+        """Test plain SGE ids are form-encoded like the legacy constants."""
+        inst = parse_instrument(
+            {"metal": "gold", "instid": "Au(T+D)", "unit": "CNY/g"}
+        )
+        assert inst.instid == "Au(T%2BD)"
+        assert inst.label == "Au(T+D)"
+
+    def test_parse_instrument_missing_field(self):
+        """Test an incomplete entry is rejected."""
+        with pytest.raises(ValueError):
+            parse_instrument({"metal": "gold", "unit": "CNY/g"})
+
+    def test_load_sorted_by_priority(self):
+        """Test entries come back in priority order."""
+        self._write(
+            {
+                "instruments": [
+                    {"metal": "b", "instid": "B", "unit": "u", "priority": 2},
+                    {"metal": "a", "instid": "A", "unit": "u", "priority": 1},
+                ]
+            }
+        )
+        result = load_instruments(self.path)
+        assert [i.metal for i in result] == ["a", "b"]
+
+    def test_load_rejects_duplicate_keys(self):
+        """Test two entries cannot share a metal key."""
+        self._write(
+            [
+                {"metal": "a", "instid": "A", "unit": "u"},
+                {"metal": "a", "instid": "B", "unit": "u"},
+            ]
+        )
+        with pytest.raises(ValueError):
+            load_instruments(self.path)
+
+    def test_bundled_registry(self):
+        """Test the bundled registry keeps the original two contracts."""
+        result = load_instruments()
+        metals = [i.metal for i in result]
+        assert metals[:2] == ["gold", "silver"]
+        assert result[0].instid == "Au(T%2BD)"
+
+
+class TestDueInstruments:
+    """Test per-instrument rate limits."""
+
+    def test_due_instruments(self):
+        """Test instruments inside their interval are held back."""
+        fast = Instrument(metal="a", instid="A", unit="u")
+        slow = Instrument(
+            metal="b", instid="B", unit="u", min_interval_sec=300
+        )
+        last = {"a": 100.0, "b": 100.0}
+
+        assert due_instruments([fast, slow], last, 160.0) == [fast]
+        assert due_instruments([fast, slow], last, 400.0) == [fast, slow]
+        assert due_instruments([fast, slow], {}, 0.0) == [fast, slow]
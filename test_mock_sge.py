@@ -0,0 +1,70 @@
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+import requests
+
+import collector
+from loadtest import run_load, synthetic_instruments
+from mock_sge import MockClock, MockConfig, MockSGEServer, series_for
+
+
+def _sh(*args):
+    return collector.SH_TZ.localize(datetime(*args))
+
+
+class TestMockSGE:
+    """Test the mock quotations server and load harness."""
+
+    def test_series_is_stable_across_polls(self):
+        """Test history replays identically until revised."""
+        cfg = MockConfig(seed=1)
+        early = series_for("Au(T+D)", _sh(2025, 1, 15, 9, 30), cfg)
+        late = series_for("Au(T+D)", _sh(2025, 1, 15, 9, 40), cfg)
+
+        n = len(early["times"])
+        assert early["times"][0] == "20:00"
+        assert late["times"][:n] == early["times"]
+        assert late["data"][:n] == early["data"]
+        assert early["delaystr"] == "2025年01月15日 09:30:00"
+
+    def test_nan_and_rate_limit(self):
+        """Test NaNs reach the collector and 429s raise."""
+        clock = MockClock(_sh(2025, 1, 15, 10, 0))
+        nan_srv = MockSGEServer(clock, MockConfig(nan_rate=1.0)).start()
+        limited = MockSGEServer(clock, MockConfig(rate_limit_rate=1.0)).start()
+        old_url = collector.SGE_URL
+        inst = synthetic_instruments(1)[0]
+        try:
+            collector.SGE_URL = f"{nan_srv.base_url}/graph/quotations"
+            times, prices, meta = collector.fetch_sge(inst)
+            assert times and all(p != p for p in prices)
+
+            collector.SGE_URL = f"{limited.base_url}/graph/quotations"
+            with pytest.raises(requests.exceptions.HTTPError):
+                collector.fetch_sge(inst)
+        finally:
+            collector.SGE_URL = old_url
+            nan_srv.stop()
+            limited.stop()
+
+    def test_run_load_reports(self):
+        """Test the harness ingests rows and reports growth."""
+        clock = MockClock(_sh(2025, 1, 15, 9, 59))
+        server = MockSGEServer(clock).start()
+        old = collector.SGE_URL, collector.FX_URL
+        fd, db_path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            report = run_load(server, db_path, synthetic_instruments(3), 5)
+        finally:
+            collector.SGE_URL, collector.FX_URL = old
+            server.stop()
+            os.unlink(db_path)
+
+        assert report.failed_cycles == 0
+        assert report.rows > 0
+        assert len(report.latencies_ms) == 5
+        assert report.db_bytes_end >= report.db_bytes_start
+        assert "p95=" in report.summary()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from collector import init_db
+from storage import ReaderPool, connect_reader, connect_writer
+
+
+class TestStorage:
+    """Test shared SQLite connection setup."""
+
+    def setup_method(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+
+    def teardown_method(self):
+        self.tmp.cleanup()
+
+    def test_writer_pragmas(self):
+        """Test the writer runs in WAL with synchronous=NORMAL."""
+        conn = connect_writer(self.db_path)
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        finally:
+            conn.close()
+
+        conn = init_db(self.db_path)
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        finally:
+            conn.close()
+
+    def test_reader_not_blocked_by_writer(self):
+        """Test readers see the last commit while a write is open."""
+        writer = connect_writer(self.db_path)
+        writer.execute("CREATE TABLE t (x INTEGER)")
+        writer.execute("INSERT INTO t VALUES (1)")
+        writer.commit()
+
+        reader = connect_reader(self.db_path)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute("INSERT INTO t VALUES (2)")
+            assert reader.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+            writer.commit()
+            assert reader.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+
+            with pytest.raises(sqlite3.OperationalError):
+                reader.execute("INSERT INTO t VALUES (3)")
+        finally:
+            reader.close()
+            writer.close()
+
+    def test_pool_reuses_connection_per_thread(self):
+        """Test each pool thread keeps its own connection."""
+        connect_writer(self.db_path).close()
+        pool = ReaderPool(self.db_path, threads=1)
+
+        async def conn_ids():
+            get = lambda: id(pool.connection())  # noqa: E731
+            return await pool.run(get), await pool.run(get)
+
+        try:
+            first, again = asyncio.run(conn_ids())
+            assert first == again
+        finally:
+            pool.close()
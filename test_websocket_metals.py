@@ -3,11 +3,13 @@ import json
 import os
 import sqlite3
 import tempfile
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
 
-from websocket_metals import DataServer, WSConfig
+from collector import (PRICE_CHANGES_DDL, PRICE_ROLLUPS_DDL, SESSIONS_DDL,
+                       notify_readers, prune_changes, rebuild_rollups)
+from websocket_metals import DataServer, LiveSeries, WSConfig
 
 
 class TestDataServer:
@@ -21,13 +23,24 @@ class TestDataServer:
             """
             CREATE TABLE prices (
                 metal TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
+                ts INTEGER NOT NULL,
                 price_cny REAL NOT NULL,
-                usd_cny_rate REAL,
-                PRIMARY KEY (metal, timestamp)
+                PRIMARY KEY (metal, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE fx_rates (
+                ts INTEGER PRIMARY KEY,
+                rate REAL NOT NULL
             )
             """
         )
+        for ddl in PRICE_CHANGES_DDL:
+            self.conn.execute(ddl)
+        self.conn.execute(PRICE_ROLLUPS_DDL)
+        self.conn.execute(SESSIONS_DDL)
         self.conn.commit()
         self.conn.close()
 
@@ -36,6 +49,7 @@ class TestDataServer:
 
     def teardown_method(self):
         """Clean up test database."""
+        self.server.reader.close()
         os.close(self.db_fd)
         os.unlink(self.db_path)
 
@@ -54,19 +68,20 @@ class TestDataServer:
         from datetime import datetime, timezone
 
         # Use current time to ensure data is within lookback window
-        now = datetime.now(timezone.utc)
-        timestamp = now.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        ts = int(now.timestamp())
 
         conn = sqlite3.connect(self.db_path)
         conn.execute(
-            "INSERT INTO prices(metal, timestamp, price_cny, usd_cny_rate) "
-            "VALUES(?, ?, ?, ?)",
-            ("gold", timestamp, 612.50, 7.2456),
+            "INSERT INTO prices(metal, ts, price_cny) VALUES(?, ?, ?)",
+            ("gold", ts, 612.50),
         )
         conn.execute(
-            "INSERT INTO prices(metal, timestamp, price_cny, usd_cny_rate) "
-            "VALUES(?, ?, ?, ?)",
-            ("silver", timestamp, 8500.0, 7.2456),
+            "INSERT INTO prices(metal, ts, price_cny) VALUES(?, ?, ?)",
+            ("silver", ts, 8500.0),
+        )
+        conn.execute(
+            "INSERT INTO fx_rates(ts, rate) VALUES(?, ?)", (ts - 60, 7.2456)
         )
         conn.commit()
         conn.close()
@@ -78,6 +93,659 @@ class TestDataServer:
         assert len(data["silver"]) == 1
         assert data["gold"][0]["price_cny"] == 612.50
         assert data["silver"][0]["price_cny"] == 8500.0
+        # Wire format keeps ISO8601 in Shanghai time
+        sent = datetime.fromisoformat(data["gold"][0]["timestamp"])
+        assert sent == now
+        assert data["gold"][0]["timestamp"].endswith("+08:00")
+        assert data["gold"][0]["usd_cny_rate"] == 7.2456
+
+    def test_fetch_payload_fx_as_of_join(self):
+        """Test each point gets the FX rate in effect at its timestamp."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(
+            "INSERT INTO prices(metal, ts, price_cny) VALUES(?, ?, ?)",
+            [("gold", now - 600 + 60 * i, 600.0 + i) for i in range(5)],
+        )
+        # First rate arrives after the first point; second mid-series
+        conn.executemany(
+            "INSERT INTO fx_rates(ts, rate) VALUES(?, ?)",
+            [(now - 540, 7.1), (now - 420, 7.2)],
+        )
+        conn.commit()
+        conn.close()
+
+        data = json.loads(self.server._fetch_payload())
+        rates = [p["usd_cny_rate"] for p in data["gold"]]
+        assert rates == [7.1, 7.1, 7.1, 7.2, 7.2]
+
+    def test_fetch_payload_registered_instruments(self):
+        """Test the payload covers whatever the registry lists."""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                [{"metal": "au9999", "instid": "Au99.99", "unit": "CNY/g"}], f
+            )
+        try:
+            cfg = WSConfig(db_path=self.db_path, instruments_path=path)
+            data = json.loads(DataServer(cfg)._fetch_payload())
+        finally:
+            os.unlink(path)
+
+        assert data == {"au9999": []}
+
+    def _live(self):
+        """The live snapshot without its resume token."""
+        data = json.loads(self.server._live_payload())
+        assert data.pop("_seq") == self.server.last_seq
+        assert data.pop("_fx") == self.server.fx_head
+        return data
+
+    def _client(self):
+        """A mock connection whose sent messages land in a queue."""
+        sent = asyncio.Queue()
+        ws = MagicMock()
+
+        async def send(msg, **kw):
+            await sent.put(json.loads(msg))
+
+        ws.send = send
+        return ws, sent
+
+    def _upsert(self, rows):
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(
+            "INSERT INTO prices(metal, ts, price_cny) VALUES(?, ?, ?) "
+            "ON CONFLICT(metal, ts) DO UPDATE SET "
+            "price_cny = excluded.price_cny",
+            rows,
+        )
+        conn.commit()
+        conn.close()
+
+    @pytest.mark.asyncio
+    async def test_refresh_live_applies_changes(self):
+        """Test the live window follows the change feed."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert([("gold", now - 120, 600.0), ("gold", now - 60, 601.0)])
+
+        assert await self.server._refresh_live_async() is True
+        assert await self.server._refresh_live_async() is False  # quiet tick
+
+        # Revision, new point, and a late point inserted mid-window
+        self._upsert(
+            [
+                ("gold", now - 60, 605.0),
+                ("gold", now, 606.0),
+                ("gold", now - 90, 603.0),
+            ]
+        )
+        assert await self.server._refresh_live_async() is True
+        assert self._live() == json.loads(self.server._fetch_payload(0))
+        gold = self._live()["gold"]
+        assert [p["price_cny"] for p in gold] == [600.0, 603.0, 605.0, 606.0]
+
+        # A no-op upsert is not a change
+        self._upsert([("gold", now, 606.0)])
+        assert await self.server._refresh_live_async() is False
+
+    @pytest.mark.asyncio
+    async def test_refresh_live_reloads_after_prune(self):
+        """Test a reader behind the pruned feed reloads its window."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert([("silver", now - 60, 8000.0)])
+        await self.server._refresh_live_async()
+
+        self._upsert([("silver", now - 60 * i, 8000.0 + i) for i in range(5)])
+        conn = sqlite3.connect(self.db_path)
+        prune_changes(conn, keep=1)
+        conn.commit()
+        conn.close()
+
+        assert await self.server._refresh_live_async() is True
+        assert self._live() == json.loads(self.server._fetch_payload(0))
+
+    @pytest.mark.asyncio
+    async def test_live_window_fx_matches_query(self):
+        """Test the buffered window joins FX like the SQL path."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert(
+            [("gold", now - 600 + 60 * i, 600.0 + i) for i in range(5)]
+        )
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(
+            "INSERT INTO fx_rates(ts, rate) VALUES(?, ?)",
+            [(now - 540, 7.1), (now - 420, 7.2)],
+        )
+        conn.commit()
+        conn.close()
+
+        await self.server._refresh_live_async()
+        assert self._live() == json.loads(self.server._fetch_payload(0))
+
+        # A new FX rate re-rates points after it without reseeding prices
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT INTO fx_rates(ts, rate) VALUES(?, ?)", (now - 360, 7.3)
+        )
+        conn.commit()
+        conn.close()
+        live = self.server.live
+        assert await self.server._refresh_live_async() is True
+        assert self.server.live is live
+        assert self._live() == json.loads(self.server._fetch_payload(0))
+
+    @pytest.mark.asyncio
+    async def test_register_serves_snapshot_without_db(self):
+        """Test connects are answered from the in-memory window."""
+        await self.server._refresh_live_async()
+        mock_ws = MagicMock()
+        mock_ws.send = MagicMock(return_value=asyncio.Future())
+        mock_ws.send.return_value.set_result(None)
+
+        with patch("websocket_metals.sqlite3.connect") as connect:
+            await self.server.register(mock_ws)
+        connect.assert_not_called()
+        mock_ws.send.assert_called_once_with(self.server._live_payload())
+
+    @pytest.mark.asyncio
+    async def test_publish_sends_deltas(self):
+        """Test only changed points are broadcast after the snapshot."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert([("gold", now - 120, 600.0), ("silver", now, 8000.0)])
+        ws, sent = self._client()
+        await self.server.register(ws)
+
+        snapshot = await asyncio.wait_for(sent.get(), 1.0)
+        assert "_prev" not in snapshot
+        assert len(snapshot["gold"]) == 1
+
+        self._upsert([("gold", now - 120, 601.0), ("gold", now, 602.0)])
+        await self.server._publish()
+        delta = await asyncio.wait_for(sent.get(), 1.0)
+        assert delta["_prev"] == snapshot["_seq"]
+        assert delta["_seq"] > delta["_prev"]
+        assert "silver" not in delta
+        assert [p["price_cny"] for p in delta["gold"]] == [601.0, 602.0]
+
+        # Quiet tick sends nothing; an FX change resends the snapshot
+        await self.server._publish()
+        await asyncio.sleep(0.01)
+        assert sent.empty()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO fx_rates(ts, rate) VALUES(?, ?)", (0, 7.2))
+        conn.commit()
+        conn.close()
+        await self.server._publish()
+        snapshot = await asyncio.wait_for(sent.get(), 1.0)
+        assert "_prev" not in snapshot
+        assert snapshot["gold"][0]["usd_cny_rate"] == 7.2
+        await self.server.unregister(ws)
+
+    def _rollups(self):
+        conn = sqlite3.connect(self.db_path)
+        rebuild_rollups(conn)
+        conn.commit()
+        conn.close()
+
+    def test_query_reads_rollups_past_retention(self):
+        """Test pruned minutes are served from the 5m rollups."""
+        t = 1736902800  # 2025-01-15T09:00+08:00
+        self._upsert([("gold", t + 60 * i, 600.0 + i) for i in range(60)])
+        self._rollups()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM prices WHERE ts < ?", (t + 1800,))
+        conn.commit()
+        conn.close()
+
+        rows = self.server._query_metal(
+            self.server.reader.connection(), "gold", t - 3600, t + 3600
+        )
+        # Six 5m buckets as low/high pairs, then the raw minutes
+        assert [r["price_cny"] for r in rows[:12]] == [
+            600.0 + 5 * b + k for b in range(6) for k in (0, 4)
+        ]
+        assert rows[1]["timestamp"] == "2025-01-15T09:02:30+08:00"
+        assert [r["price_cny"] for r in rows[12:]] == [
+            600.0 + i for i in range(30, 60)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_ohlc_candles_align_to_shanghai(self):
+        """Test candles bucket on Shanghai wall-clock boundaries."""
+        import time
+
+        hour = (int(time.time()) + 8 * 3600) // 3600 * 3600 - 8 * 3600
+        h = hour - 3 * 3600
+        self._upsert(
+            [
+                ("gold", h - 60, 599.0),
+                ("gold", h, 600.0),
+                ("gold", h + 1200, 604.0),
+                ("gold", h + 2400, 598.0),
+                ("gold", h + 3540, 601.0),
+                ("gold", h + 3600, 602.0),
+            ]
+        )
+        await self.server._refresh_live_async()
+
+        data = json.loads(self.server._ohlc_payload("gold", 60))
+        assert data["_ohlc"] == 60
+        candles = data["gold"]
+        assert [c["date"][11:] for c in candles] == [
+            time.strftime("%H:00:00+08:00", time.gmtime(t + 8 * 3600))
+            for t in (h - 3600, h, h + 3600)
+        ]
+        assert candles[1] == {
+            "date": candles[1]["date"],
+            "open": 600.0,
+            "high": 604.0,
+            "low": 598.0,
+            "close": 601.0,
+            "fx_close": None,
+        }
+
+    def test_bucket_start_daily(self):
+        """Test daily buckets start at Shanghai midnight."""
+        from websocket_metals import bucket_start
+
+        ts = 1736910000  # 2025-01-15T03:00:00Z = 11:00 Shanghai
+        assert bucket_start(ts, 86400) == 1736870400  # 2025-01-15T00:00+08
+
+    @pytest.mark.asyncio
+    async def test_ohlc_subscription_pushes_forming_candle(self):
+        """Test subscribers get only the candles that changed."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert([("gold", now - 3600 * 6, 590.0), ("gold", now, 600.0)])
+        ws, sent = self._client()
+        await self.server.register(ws)
+        await asyncio.wait_for(sent.get(), 1.0)  # live snapshot
+
+        self.server._ohlc_request(
+            ws, {"type": "ohlc", "metal": "gold", "interval": 5}
+        )
+        full = await asyncio.wait_for(sent.get(), 1.0)
+        assert "_update" not in full
+        assert len(full["gold"]) == 2
+
+        self._upsert([("gold", now, 603.0), ("silver", now, 8000.0)])
+        await self.server._publish()
+        await asyncio.wait_for(sent.get(), 1.0)  # raw delta
+        update = await asyncio.wait_for(sent.get(), 1.0)
+        assert update["_update"] is True
+        forming = update["gold"][-1]
+        assert forming["date"] == full["gold"][-1]["date"]
+        assert forming["close"] == forming["high"] == 603.0
+        assert len(update["gold"]) <= 2  # plus the oldest, maybe trimmed
+
+        # Bad requests are ignored; unsubscribing stops updates
+        self.server._ohlc_request(ws, {"metal": "gold", "interval": 0})
+        self.server._ohlc_request(
+            ws, {"metal": "gold", "interval": 5, "subscribe": False}
+        )
+        await asyncio.wait_for(sent.get(), 1.0)
+        assert not self.server.clients[ws].ohlc
+        await self.server.unregister(ws)
+
+    @pytest.mark.asyncio
+    async def test_history_cached_until_write(self):
+        """Test equal session-snapped requests hit the cache until a write."""
+        from websocket_metals import parse_time
+
+        t = parse_time("2025-01-15T10:00")
+        self._upsert([("gold", t, 600.0)])
+        await self.server._refresh_live_async()
+        ws, sent = self._client()
+
+        calls = []
+        frame = self.server._history_frame
+
+        def counting(*args):
+            calls.append(args)
+            return frame(*args)
+
+        self.server._history_frame = counting
+        for start in ("2025-01-15T09:30", "2025-01-15T11:00"):
+            await self.server._history_request(
+                ws,
+                {"metal": "gold", "start": start, "end": "2025-01-15T12:00"},
+            )
+        first, second = sent.get_nowait(), sent.get_nowait()
+        assert first == second
+        assert first["_range"] == [
+            "2025-01-15T09:00:00+08:00",
+            "2025-01-15T15:30:00+08:00",
+        ]
+        assert [p["price_cny"] for p in first["gold"]] == [600.0]
+        assert len(calls) == 1
+
+        # A session ID naming the same range shares the entry
+        await self.server._history_request(
+            ws, {"metal": "gold", "session": "2025-01-14/day"}
+        )
+        assert sent.get_nowait() == first
+        assert len(calls) == 1
+
+        # A revision inside the range invalidates it
+        self._upsert([("gold", t, 601.0)])
+        await self.server._refresh_live_async()
+        await self.server._history_request(
+            ws, {"metal": "gold", "session": "2025-01-14/day"}
+        )
+        assert sent.get_nowait()["gold"][0]["price_cny"] == 601.0
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_history_max_points(self):
+        """Test long history replies are decimated and cached separately."""
+        from websocket_metals import parse_time
+
+        t = parse_time("2025-01-15T09:00")
+        self._upsert([("gold", t + 60 * i, 600.0 + i % 7) for i in range(390)])
+        self._rollups()
+        ws, sent = self._client()
+        req = {"metal": "gold", "session": "2025-01-14/day"}
+
+        await self.server._history_request(ws, {**req, "max_points": 40})
+        await self.server._history_request(ws, req)
+        small, full = sent.get_nowait(), sent.get_nowait()
+        assert len(full["gold"]) == 390
+        assert len(small["gold"]) <= 40
+        prices = [p["price_cny"] for p in small["gold"]]
+        assert (min(prices), max(prices)) == (600.0, 606.0)
+        assert len(self.server.history) == 2
+        # A span this wide is read from the 5m rollups (low/high at each
+        # bucket's start and midpoint), not every minute
+        assert any(p["timestamp"][17:19] == "30" for p in small["gold"])
+
+        await self.server._history_request(ws, {**req, "max_points": "x"})
+        assert sent.empty()
+
+    @pytest.mark.asyncio
+    async def test_history_streamed_in_parts(self):
+        """Test long replies arrive as bounded parts ending with _done."""
+        from websocket_metals import parse_time
+
+        t = parse_time("2025-01-15T09:00")
+        self._upsert([("gold", t + 60 * i, 600.0 + i) for i in range(390)])
+        ws, sent = self._client()
+        req = {"metal": "gold", "session": "2025-01-14/day"}
+
+        with patch("websocket_metals.HISTORY_CHUNK_ROWS", 100):
+            await self.server._history_request(ws, req)
+            parts = [sent.get_nowait() for _ in range(4)]
+            assert sent.empty()
+            assert [p["_part"] for p in parts] == [0, 1, 2, 3]
+            assert [len(p["gold"]) for p in parts] == [100, 100, 100, 90]
+            rows = [r["price_cny"] for p in parts for r in p["gold"]]
+            assert rows == [600.0 + i for i in range(390)]
+            assert "_done" not in parts[2]
+            assert parts[3]["_done"] is True and parts[3]["_parts"] == 4
+            assert "_sessions" in parts[3]
+
+            # The cached reply replays the same frames
+            await self.server._history_request(ws, req)
+            assert [sent.get_nowait() for _ in range(4)] == parts
+
+    @pytest.mark.asyncio
+    async def test_history_parts_run_across_retention(self):
+        """Test streamed pages continue from rollups into raw minutes."""
+        from websocket_metals import parse_time
+
+        t = parse_time("2025-01-15T09:00")
+        self._upsert([("gold", t + 60 * i, 600.0 + i) for i in range(60)])
+        self._rollups()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM prices WHERE ts < ?", (t + 1800,))
+        conn.commit()
+        conn.close()
+        ws, sent = self._client()
+        req = {"metal": "gold", "session": "2025-01-14/day"}
+
+        await self.server._history_request(ws, req)
+        rows = sent.get_nowait()["gold"]
+        assert len(rows) == 42  # 6 buckets as low/high, then 30 minutes
+
+        self.server.history.invalidate()
+        with patch("websocket_metals.HISTORY_CHUNK_ROWS", 5):
+            await self.server._history_request(ws, req)
+        parts = [sent.get_nowait() for _ in range(9)]
+        assert parts[-1]["_done"] is True
+        assert [r for p in parts for r in p["gold"]] == rows
+
+    @pytest.mark.asyncio
+    async def test_concurrent_history_shares_one_read(self):
+        """Test identical requests in flight share each frame's read."""
+        from websocket_metals import parse_time
+
+        t = parse_time("2025-01-15T09:00")
+        self._upsert([("gold", t + 60 * i, 600.0 + i) for i in range(250)])
+        calls = []
+        frame = self.server._history_frame
+
+        def counting(*args):
+            calls.append(args)
+            return frame(*args)
+
+        self.server._history_frame = counting
+        clients = [self._client() for _ in range(3)]
+        req = {"metal": "gold", "session": "2025-01-14/day"}
+        with patch("websocket_metals.HISTORY_CHUNK_ROWS", 100):
+            await asyncio.gather(
+                *(self.server._history_request(ws, req) for ws, _ in clients)
+            )
+        assert len(calls) == 3  # one per part, not per client
+        replies = [
+            [sent.get_nowait() for _ in range(3)] for _, sent in clients
+        ]
+        assert replies[0] == replies[1] == replies[2]
+        assert replies[0][2]["_done"] is True
+        assert not self.server._inflight
+
+    def _session(self, metal, sid, start, end):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?, 'day', ?, ?, "
+            "1.0, 1.0, 1.0, 1.0, 1)",
+            (metal, start, end, sid, start, end),
+        )
+        conn.commit()
+        conn.close()
+
+    @pytest.mark.asyncio
+    async def test_live_window_and_last_sessions_follow_index(self):
+        """Test the window and "last N sessions" come from the index."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        for i, hours in enumerate((30, 10, 3)):
+            start = now - hours * 3600
+            self._session("gold", f"s{i}", start, start + 2 * 3600)
+        self._upsert(
+            [("gold", now - 20 * 3600, 1.0), ("gold", now - 3600, 2.0)]
+        )
+
+        await self.server._refresh_live_async()
+        assert self.server.live_since == now - 10 * 3600
+        assert [p["price_cny"] for p in self._live()["gold"]] == [2.0]
+
+        ws, sent = self._client()
+        await self.server._sessions_request(
+            ws, {"type": "sessions", "metal": "gold", "last": 2}
+        )
+        reply = sent.get_nowait()
+        assert [s["id"] for s in reply["_sessions"]] == ["s1", "s2"]
+        assert [p["price_cny"] for p in reply["gold"]] == [2.0]
+
+        await self.server._sessions_request(ws, {"metal": "gold", "last": 0})
+        assert sent.empty()
+
+        # Sessions either side of a long closure still form one reply
+        old = now - 40 * 86400
+        self._session("gold", "s-old", old, old + 2 * 3600)
+        await self.server._sessions_request(ws, {"metal": "gold", "last": 4})
+        reply = sent.get_nowait()
+        assert [s["id"] for s in reply["_sessions"]][0] == "s-old"
+
+    @pytest.mark.asyncio
+    async def test_slow_client_dropped_without_blocking_others(self):
+        """Test a stalled socket is disconnected and others still receive."""
+        import time
+
+        cfg = WSConfig(db_path=self.db_path, slow_client_sec=0.05)
+        server = DataServer(cfg)
+        fast, sent = self._client()
+        slow, _ = self._client()
+        stalled = asyncio.Event()
+
+        async def stall(msg, **kw):
+            if slow.send_calls:
+                await stalled.wait()  # never set
+            slow.send_calls += 1
+
+        slow.send_calls = 0
+        slow.send = stall
+        await server.register(fast)
+        await server.register(slow)
+        await sent.get()
+
+        self._upsert([("gold", int(time.time()) // 60 * 60, 612.5)])
+        await server._publish()
+        delta = await asyncio.wait_for(sent.get(), 1.0)
+        assert delta["gold"][0]["price_cny"] == 612.5
+
+        await asyncio.sleep(0.2)
+        assert slow not in server.clients
+        assert fast in server.clients
+        await server.unregister(fast)
+
+    @pytest.mark.asyncio
+    async def test_register_resume_sends_only_missed_points(self):
+        """Test a reconnect with a recent token gets a catch-up delta."""
+        import time
+
+        now = int(time.time()) // 60 * 60
+        self._upsert([("gold", now - 120, 600.0), ("silver", now, 8000.0)])
+        await self.server._refresh_live_async()
+        token = (self.server.last_seq, self.server.fx_head)
+        self._upsert([("gold", now - 120, 601.0), ("gold", now, 602.0)])
+        await self.server._refresh_live_async()
+
+        sent = []
+        ws = MagicMock()
+
+        async def send(msg):
+            sent.append(json.loads(msg))
+
+        ws.send = send
+        await self.server.register(ws, token)
+        delta = sent[-1]
+        assert delta["_prev"] == token[0]
+        assert delta["_seq"] == self.server.last_seq
+        assert "silver" not in delta
+        assert [p["price_cny"] for p in delta["gold"]] == [601.0, 602.0]
+
+        # Up to date: an empty delta; stale FX or pruned feed: snapshot
+        await self.server.register(ws, (self.server.last_seq, None))
+        assert sent[-1]["_prev"] == self.server.last_seq
+        await self.server.register(ws, (token[0], 12345))
+        assert "_prev" not in sent[-1]
+        conn = sqlite3.connect(self.db_path)
+        prune_changes(conn, keep=1)
+        conn.commit()
+        conn.close()
+        await self.server.register(ws, token)
+        assert "_prev" not in sent[-1]
+
+    def test_resume_token_from_path(self):
+        """Test the token is read from the connection's query string."""
+        ws = MagicMock(spec=["path"])
+        ws.path = "/?resume=42&fx=1700000000"
+        assert DataServer._resume_token(ws) == (42, 1700000000)
+        ws.path = "/"
+        assert DataServer._resume_token(ws) is None
+
+    @pytest.mark.asyncio
+    async def test_notify_wakes_broadcast(self):
+        """Test a collector ping fans out well before the fallback poll."""
+        import time
+
+        tmp = tempfile.mkdtemp()
+        cfg = WSConfig(
+            db_path=self.db_path,
+            notify_path=os.path.join(tmp, "n.sock"),
+            fallback_poll_sec=60.0,
+        )
+        server = DataServer(cfg)
+        ws, sent = self._client()
+        await server.register(ws)
+
+        task = asyncio.create_task(server.broadcast_updates())
+        try:
+            await asyncio.wait_for(sent.get(), 1.0)  # initial window
+            self._upsert([("gold", int(time.time()) // 60 * 60, 612.5)])
+            assert notify_readers(cfg.notify_path)
+
+            payload = await asyncio.wait_for(sent.get(), 1.0)
+            assert payload["gold"][0]["price_cny"] == 612.5
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            os.rmdir(tmp)
+
+    @pytest.mark.asyncio
+    async def test_fetch_runs_on_reader_thread(self):
+        """Test a slow history query leaves the event loop free."""
+        import threading
+        import time
+
+        threads = []
+        query = self.server._query_metal
+
+        def slow_query(*args):
+            threads.append(threading.current_thread().name)
+            time.sleep(0.2)
+            return query(*args)
+
+        self.server._query_metal = slow_query
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        try:
+            payload = await self.server.reader.run(
+                self.server._fetch_payload_for_metal, 1, "gold"
+            )
+        finally:
+            task.cancel()
+        assert json.loads(payload)["gold"] == []
+        assert threads == ["db-reader_0"]
+        assert ticks >= 5
+
+    def test_reader_connection_is_read_only(self):
+        """Test pooled connections cannot write."""
+        conn = self.server.reader.connection()
+        assert conn is self.server.reader.connection()
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM prices")
 
     @pytest.mark.asyncio
     async def test_register_unregister(self):
@@ -94,6 +762,151 @@ class TestDataServer:
         assert mock_ws not in self.server.clients
 
 
+class TestLiveSeries:
+    """Test the compact per-metal live window."""
+
+    def test_upsert_keeps_ts_order(self):
+        """Test appends, revisions and late inserts stay sorted."""
+        series = LiveSeries(base=1000)
+        for ts in (1060, 1180, 1120):
+            series.upsert(ts, float(ts))
+        series.upsert(1120, 5.0)
+
+        assert list(series.points()) == [
+            (1060, 1060.0),
+            (1120, 5.0),
+            (1180, 1180.0),
+        ]
+        assert series.ts.itemsize + series.price.itemsize <= 12
+
+    def test_expire_compacts(self):
+        """Test expired points are dropped and storage reclaimed."""
+        series = LiveSeries(base=0)
+        for ts in range(0, 600, 60):
+            series.upsert(ts, 1.0)
+
+        assert series.expire(120) is True
+        assert len(series) == 8
+        assert series.expire(120) is False
+        assert series.expire(420) is True
+        assert [ts for ts, _ in series.points()] == [420, 480, 540]
+        assert len(series.ts) == 3  # dead prefix compacted
+
+
+class TestClientQueue:
+    """Test per-client outbound coalescing."""
+
+    def test_overflow_coalesces_to_resync(self):
+        """Test a backlog of deltas collapses into one snapshot request."""
+        from websocket_metals import RESYNC, ClientQueue
+
+        client = ClientQueue(MagicMock())
+        for i in range(3):
+            client.push(b"delta%d" % i, False, limit=3)
+        assert list(client.queue) == [b"delta0", b"delta1", b"delta2"]
+
+        client.push(b"delta3", False, limit=3)
+        assert list(client.queue) == [RESYNC]
+        assert client.behind_since is not None
+
+    def test_snapshot_supersedes_queue(self):
+        """Test a snapshot drops everything queued before it."""
+        from websocket_metals import ClientQueue
+
+        client = ClientQueue(MagicMock())
+        client.push(b"delta", False, limit=3)
+        client.push(b"snapshot", True, limit=3)
+        assert list(client.queue) == [b"snapshot"]
+        assert client.wake.is_set()
+
+
+class TestHistoryRanges:
+    """Test session snapping and the history cache."""
+
+    def test_snap_to_sessions(self):
+        """Test ranges widen to whole sessions, skipping breaks."""
+        import time
+
+        from websocket_metals import parse_time, snap_to_sessions
+
+        def snap(start, end):
+            return tuple(
+                time.strftime("%m-%d %H:%M", time.gmtime(t + 8 * 3600))
+                for t in snap_to_sessions(parse_time(start), parse_time(end))
+            )
+
+        # Inside sessions: out to their bounds
+        assert snap("2025-01-14T22:00", "2025-01-15T10:00") == (
+            "01-14 20:00",
+            "01-15 15:30",
+        )
+        # Breaks: start moves forward, end moves back
+        assert snap("2025-01-15T05:00", "2025-01-15T17:00") == (
+            "01-15 09:00",
+            "01-15 15:30",
+        )
+        assert snap("2025-01-15T16:00", "2025-01-16T05:00") == (
+            "01-15 20:00",
+            "01-16 02:30",
+        )
+        assert snap("2025-01-15T19:00", "2025-01-15T19:30") == (
+            "01-15 20:00",
+            "01-15 15:30",
+        )
+
+    def test_session_range(self):
+        """Test trading-day and session IDs resolve to their bounds."""
+        from websocket_metals import parse_time, session_range
+
+        night = session_range("2025-01-14/night")
+        assert night == (
+            parse_time("2025-01-14T20:00"),
+            parse_time("2025-01-15T02:30"),
+        )
+        assert session_range("2025-01-14") == (
+            night[0],
+            parse_time("2025-01-15T15:30"),
+        )
+        with pytest.raises(KeyError):
+            session_range("2025-01-14/lunch")
+
+    def test_decimate_minmax_keeps_extremes(self):
+        """Test decimation bounds the size and keeps each bucket's range."""
+        import math
+        from array import array
+
+        from websocket_metals import decimate_minmax
+
+        ts = array("q", range(0, 60 * 10_000, 60))
+        values = array("d", (math.sin(i / 50) for i in range(10_000)))
+        values[1234] = 5.0  # a spike must survive
+        keep = decimate_minmax(ts, values, 200)
+
+        assert len(keep) <= 200
+        assert keep == sorted(set(keep))
+        assert 1234 in keep
+        assert min(values[i] for i in keep) == min(values)
+        assert decimate_minmax(ts[:10], values[:10], 200) == list(range(10))
+
+    def test_cache_lru_and_invalidation(self):
+        """Test byte-bounded LRU eviction and write invalidation."""
+        from websocket_metals import HistoryCache
+
+        cache = HistoryCache(max_bytes=10, max_entry_bytes=8)
+        cache.put(("gold", 0, 100, 0), (b"aa", b"aa"))
+        cache.put(("gold", 100, 200, 0), (b"bbbb",))
+        assert cache.get(("gold", 0, 100, 0)) == (b"aa", b"aa")
+        cache.put(("gold", 200, 300, 0), (b"cccc",))
+        assert cache.get(("gold", 100, 200, 0)) is None
+        assert cache.size == 8
+
+        cache.invalidate(150)
+        assert cache.get(("gold", 0, 100, 0)) == (b"aa", b"aa")
+        assert cache.get(("gold", 200, 300, 0)) is None
+        cache.put(("gold", 0, 1000, 0), (b"x" * 9,))  # over the entry cap
+        assert len(cache) == 1
+
+
 class TestWSConfig:
     """Test WebSocket configuration."""
 
@@ -1,15 +1,430 @@
 #!/usr/bin/env python3
 import asyncio
 import json
+import os
+import socket
 import sqlite3
+import stat
 import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
 from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
 from http.server import HTTPServer, SimpleHTTPRequestHandler
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterator
+from urllib.parse import parse_qs, urlparse
 
 import websockets
 import websockets.server
 
+from instruments import load_instruments
+from storage import ReaderPool
+
+LIVE_WINDOW_SEC = 36 * 3600  # fallback before the session index exists
+LIVE_SESSIONS = 2  # sessions the live window and the charts cover
+SH_OFFSET_SEC = 8 * 3600  # Asia/Shanghai has no DST
+# Reconnects further behind than this many changes get a snapshot instead
+RESUME_MAX_CHANGES = 5000
+# Largest candle interval clients may request, and candle series per client
+OHLC_MAX_INTERVAL_MIN = 1440
+OHLC_MAX_SUBSCRIPTIONS = 8
+# Trading day starts at 20:00 Shanghai (12:00 UTC); sessions as offsets
+# from it: night 20:00-02:30, day 09:00-15:30
+TRADING_DAY_ANCHOR = 12 * 3600
+SESSIONS = {
+    "night": (0, 6 * 3600 + 1800),
+    "day": (13 * 3600, 19 * 3600 + 1800),
+}
+# Longest span a time-range history request may cover
+HISTORY_MAX_SEC = 31 * 86400
+# Most sessions a {"type": "sessions"} request may ask for; bounded by
+# count rather than HISTORY_MAX_SEC, so holidays inside never reject it
+SESSIONS_MAX_LAST = 40
+# Rollup bucket widths the collector keeps, finest first
+ROLLUP_RESOLUTIONS = (300, 3600, 86400)
+# Rows per frame of a streamed history reply
+HISTORY_CHUNK_ROWS = 2000
+# Bounds on a history request's max_points (0 = every row)
+MAX_POINTS_MIN = 16
+MAX_POINTS_LIMIT = 20_000
+# websockets >= 14 sends pre-encoded UTF-8 as a text frame without copying
+SEND_BYTES_AS_TEXT = int(websockets.__version__.split(".")[0]) >= 14
+
+# Wire columns for a price row. The FX rate in effect at each point is an
+# as-of seek on the fx_rates primary key, falling back to the earliest known
+# rate for points that predate the series.
+_ROW_COLUMNS = """
+    strftime('%Y-%m-%dT%H:%M:%S+08:00', p.ts, 'unixepoch', '+8 hours')
+      AS timestamp,
+    p.price_cny,
+    COALESCE(
+      (SELECT f.rate FROM fx_rates f WHERE f.ts <= p.ts
+       ORDER BY f.ts DESC LIMIT 1),
+      (SELECT f.rate FROM fx_rates f ORDER BY f.ts LIMIT 1)
+    ) AS usd_cny_rate
+"""
+
+# Pure index range scan on the (metal, ts) primary key
+ROWS_SQL = f"""
+    SELECT p.ts, {_ROW_COLUMNS}
+    FROM prices p
+    WHERE p.metal = ? AND p.ts BETWEEN ? AND ?
+    ORDER BY p.ts
+"""
+
+# One page of a streamed history reply, resuming after the last sent ts
+ROWS_PAGE_SQL = ROWS_SQL + "    LIMIT ?\n"
+
+# Oldest raw minute kept; older ranges are read from the rollups
+RAW_START_SQL = "SELECT MIN(ts) FROM prices WHERE metal = ?"
+
+# Rollup candles as a line: each bucket becomes its low and high, at its
+# start and midpoint, in the order the candle's direction suggests
+ROLLUP_ROWS_SQL = f"""
+    SELECT p.ts, {_ROW_COLUMNS}
+    FROM (
+      SELECT bucket AS ts,
+             CASE WHEN open <= close THEN low ELSE high END AS price_cny
+      FROM price_rollups
+      WHERE metal = :metal AND resolution = :res
+        AND bucket BETWEEN :since - :res AND :until
+      UNION ALL
+      SELECT bucket + :res / 2,
+             CASE WHEN open <= close THEN high ELSE low END
+      FROM price_rollups
+      WHERE metal = :metal AND resolution = :res
+        AND bucket BETWEEN :since - :res AND :until AND high > low
+    ) p
+    WHERE p.ts BETWEEN :since AND :until
+    ORDER BY p.ts
+    LIMIT :limit
+"""
+
+# Raw columns for seeding the in-memory live window
+SERIES_SQL = """
+    SELECT ts, price_cny FROM prices
+    WHERE metal = ? AND ts BETWEEN ? AND ?
+    ORDER BY ts
+"""
+
+# FX changes from the one in effect at `since` onwards (all of them when
+# the series starts later, so the earliest rate can back-fill)
+FX_SQL = """
+    SELECT ts, rate FROM fx_rates
+    WHERE ts >= COALESCE((SELECT MAX(ts) FROM fx_rates WHERE ts <= ?), 0)
+    ORDER BY ts
+"""
+
+# Rows written since a change-feed position, as a range scan on `seq`
+CHANGES_SQL = """
+    SELECT p.metal, p.ts, p.price_cny
+    FROM price_changes c
+    JOIN prices p ON p.metal = c.metal AND p.ts = c.ts
+    WHERE c.seq > ? AND c.seq <= ?
+    ORDER BY c.seq
+"""
+
+# Keys changed in a feed range, for catching up a reconnecting client
+RESUME_SQL = """
+    SELECT metal, ts FROM price_changes
+    WHERE seq > ? AND seq <= ?
+    LIMIT ?
+"""
+
+# Start of the oldest of the newest N sessions with data, any metal; a
+# backward walk of the sessions_start index that stops after N starts
+LIVE_SINCE_SQL = """
+    SELECT MIN(start_ts) FROM (
+      SELECT DISTINCT start_ts FROM sessions
+      ORDER BY start_ts DESC LIMIT ?
+    )
+"""
+
+# Bounds of a metal's newest N sessions: one primary-key range read
+LAST_SESSIONS_SQL = """
+    SELECT MIN(start_ts), MAX(end_ts) FROM (
+      SELECT start_ts, end_ts FROM sessions
+      WHERE metal = ? ORDER BY start_ts DESC LIMIT ?
+    )
+"""
+
+SESSION_SUMMARY_SQL = """
+    SELECT session_id, kind, start_ts, end_ts, first_ts, last_ts,
+           open, high, low, close
+    FROM sessions
+    WHERE metal = ? AND start_ts BETWEEN ? AND ?
+    ORDER BY start_ts
+"""
+
+# Change-feed bounds plus the latest FX change, which re-rates stored rows
+FEED_HEAD_SQL = """
+    SELECT (SELECT MAX(seq) FROM price_changes),
+           (SELECT MIN(seq) FROM price_changes),
+           (SELECT MAX(ts) FROM fx_rates)
+"""
+
+
+def iso_sh(ts: int) -> str:
+    """Epoch seconds as the wire's ISO8601 Shanghai timestamp."""
+    return time.strftime(
+        "%Y-%m-%dT%H:%M:%S+08:00", time.gmtime(ts + SH_OFFSET_SEC)
+    )
+
+
+def bucket_start(ts: int, interval_sec: int) -> int:
+    """Start of the Shanghai wall-clock aligned bucket holding `ts`
+    (the same bucketing as candles.js floorToIntervalShanghai)."""
+    return (ts + SH_OFFSET_SEC) // interval_sec * interval_sec - SH_OFFSET_SEC
+
+
+def trading_day_start(ts: int) -> int:
+    """Epoch seconds of the 20:00 Shanghai start of the trading day at ts."""
+    return (ts - TRADING_DAY_ANCHOR) // 86400 * 86400 + TRADING_DAY_ANCHOR
+
+
+def snap_to_sessions(start: int, end: int) -> tuple[int, int]:
+    """
+    Widen [start, end] to whole sessions: start moves back to the start
+    of its session (or forward to the next one when it falls in a break),
+    end moves out to its session's end (or back to the previous one).
+    """
+    day = trading_day_start(start)
+    for lo, hi in SESSIONS.values():
+        if start < day + hi:
+            start = day + lo
+            break
+    else:
+        start = day + 86400
+
+    day = trading_day_start(end)
+    snapped = day - 86400 + SESSIONS["day"][1]
+    for lo, hi in SESSIONS.values():
+        if end >= day + lo:
+            snapped = day + hi
+    return start, snapped
+
+
+def session_range(session_id: str) -> tuple[int, int]:
+    """
+    Bounds of "YYYY-MM-DD" (a whole trading day) or "YYYY-MM-DD/night" /
+    "YYYY-MM-DD/day", where the date is the evening the trading day opens.
+    """
+    day_iso, _, kind = session_id.partition("/")
+    d = date.fromisoformat(day_iso)
+    day = int(
+        datetime(d.year, d.month, d.day, tzinfo=timezone.utc).timestamp()
+    ) + TRADING_DAY_ANCHOR
+    if not kind:
+        return day + SESSIONS["night"][0], day + SESSIONS["day"][1]
+    lo, hi = SESSIONS[kind]
+    return day + lo, day + hi
+
+
+def parse_time(value) -> int:
+    """Epoch seconds from an epoch number or ISO string (naive = Shanghai)."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    dt = datetime.fromisoformat(str(value))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone(timedelta(seconds=SH_OFFSET_SEC)))
+    return int(dt.timestamp())
+
+
+def decimate_minmax(ts: array, values: array, max_points: int) -> list[int]:
+    """
+    Indices of at most `max_points` points that keep the shape of a series:
+    the span is cut into max_points // 2 equal time buckets and each keeps
+    its lowest and highest point, in time order. Bucket edges are found by
+    bisection and extremes with min/max/index over array slices, so the
+    per-point work runs in C.
+    """
+    n = len(ts)
+    if max_points <= 0 or n <= max_points:
+        return list(range(n))
+    buckets = max_points // 2
+    t0, span = ts[0], ts[-1] - ts[0] + 1
+    keep: list[int] = []
+    lo = 0
+    for b in range(1, buckets + 1):
+        hi = bisect_left(ts, t0 + span * b // buckets, lo)
+        if hi > lo:
+            chunk = values[lo:hi]
+            i = lo + chunk.index(min(chunk))
+            j = lo + chunk.index(max(chunk))
+            keep.extend(sorted({i, j}))
+        lo = hi
+    return keep
+
+
+class HistoryCache:
+    """
+    LRU of encoded history replies (their frames) bounded by total bytes.
+    Entries are keyed by (metal, start, end, max_points) with start/end on
+    session boundaries, and only dropped when a write lands at or before
+    their end, or to make room.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        # Larger replies are streamed without being held for the cache
+        if max_entry_bytes is None:
+            max_entry_bytes = max_bytes // 16
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self.generation = 0  # bumped on every invalidation
+        self._entries: OrderedDict[
+            tuple[str, int, int, int], tuple[bytes, ...]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _nbytes(frames: tuple[bytes, ...]) -> int:
+        return sum(len(f) for f in frames)
+
+    def get(self, key: tuple[str, int, int, int]) -> tuple[bytes, ...] | None:
+        frames = self._entries.get(key)
+        if frames is not None:
+            self._entries.move_to_end(key)
+        return frames
+
+    def put(
+        self, key: tuple[str, int, int, int], frames: tuple[bytes, ...]
+    ) -> None:
+        nbytes = self._nbytes(frames)
+        if nbytes > self.max_entry_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= self._nbytes(old)
+        self._entries[key] = frames
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= self._nbytes(evicted)
+
+    def invalidate(self, since: int | None = None) -> None:
+        """Drop entries whose range ends at or after `since` (None = all)."""
+        self.generation += 1
+        stale = [k for k in self._entries if since is None or k[2] >= since]
+        for key in stale:
+            self.size -= self._nbytes(self._entries.pop(key))
+
+
+class LiveSeries:
+    """
+    Live window for one metal as parallel columns in ts order: int32
+    seconds relative to `base` and float64 prices, 12 bytes per point.
+    Expired points are dropped by advancing `head`; the dead prefix is
+    compacted away once it outgrows the live part.
+    """
+
+    __slots__ = ("base", "ts", "price", "head")
+
+    def __init__(self, base: int):
+        self.base = base
+        self.ts = array("i")
+        self.price = array("d")
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.ts) - self.head
+
+    def upsert(self, ts: int, price: float) -> None:
+        """Append a new point, or revise/insert one inside the window."""
+        rel = ts - self.base
+        if len(self.ts) == self.head or rel > self.ts[-1]:
+            self.ts.append(rel)
+            self.price.append(price)
+            return
+        i = bisect_left(self.ts, rel, self.head)
+        if i < len(self.ts) and self.ts[i] == rel:
+            self.price[i] = price
+        else:  # late insert, e.g. a backfill inside the window
+            self.ts.insert(i, rel)
+            self.price.insert(i, price)
+
+    def get(self, ts: int) -> float | None:
+        """Price at `ts`, or None if the window does not hold it."""
+        rel = ts - self.base
+        i = bisect_left(self.ts, rel, self.head)
+        if i < len(self.ts) and self.ts[i] == rel:
+            return self.price[i]
+        return None
+
+    def expire(self, since: int) -> bool:
+        """Drop points before `since`, returning whether any were dropped."""
+        i = bisect_left(self.ts, since - self.base, self.head)
+        if i == self.head:
+            return False
+        self.head = i
+        if self.head > len(self.ts) // 2:
+            del self.ts[: self.head]
+            del self.price[: self.head]
+            self.head = 0
+        return True
+
+    def points(
+        self, lo: int | None = None, hi: int | None = None
+    ) -> Iterator[tuple[int, float]]:
+        """Yield (epoch ts, price) in ts order, optionally lo <= ts < hi."""
+        base = self.base
+        start, end = self.head, len(self.ts)
+        if lo is not None:
+            start = bisect_left(self.ts, lo - base, start)
+        if hi is not None:
+            end = bisect_left(self.ts, hi - base, start)
+        for i in range(start, end):
+            yield self.ts[i] + base, self.price[i]
+
+
+@dataclass(frozen=True)
+class FeedRead:
+    """One consistent read of the change feed, applied on the event loop."""
+
+    head: int
+    fx_head: int | None
+    since: int
+    fx: tuple[array, array] | None  # reloaded FX series (ts, rate)
+    seed: dict[str, LiveSeries] | None  # full window reload
+    changes: list  # (metal, ts, price_cny) since the last applied seq
+
+
+# Queue entry standing for "the newest snapshot at send time"
+RESYNC: Any = object()
+
+
+class ClientQueue:
+    """
+    Bounded outbound queue for one client. A snapshot supersedes anything
+    queued before it; overflowing deltas collapse into a single RESYNC, so
+    a slow client skips straight to the newest state.
+    """
+
+    __slots__ = ("ws", "queue", "wake", "behind_since", "task", "ohlc")
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.ohlc: set[tuple[str, int]] = set()  # (metal, interval_min)
+        self.queue: deque[bytes] = deque()  # or RESYNC
+        self.wake = asyncio.Event()
+        self.behind_since: float | None = None  # first overflow not drained
+        self.task: asyncio.Task | None = None
+
+    def push(self, data: bytes, snapshot: bool, limit: int) -> None:
+        if snapshot:
+            self.queue.clear()
+        elif len(self.queue) >= limit:
+            self.queue.clear()
+            data = RESYNC
+            if self.behind_since is None:
+                self.behind_since = time.monotonic()
+        self.queue.append(data)
+        self.wake.set()
+
 
 @dataclass(frozen=True)
 class WSConfig:
@@ -18,54 +433,787 @@ class WSConfig:
     http_port: int = 18800
     db_path: str = "shanghai_metals.db"
     lookback_hours: int = 6
-    poll_sec: float = 1.0
+    poll_sec: float = 1.0  # used when the notify socket is unavailable
+    instruments_path: str | None = None  # None = $SHANGHAI_INSTRUMENTS
+    # Collector commit pings; None = $SHANGHAI_NOTIFY_SOCK or db + ".notify"
+    notify_path: str | None = None
+    fallback_poll_sec: float = 30.0  # safety poll while listening
+    client_queue_max: int = 16  # queued messages before coalescing
+    slow_client_sec: float = 10.0  # max send time / time spent behind
+    reader_threads: int = 4  # SQLite reader pool size
+    history_cache_bytes: int = 64 * 1024 * 1024  # encoded history LRU
 
 
 class DataServer:
     def __init__(self, cfg: WSConfig):
         self.cfg = cfg
-        self.clients: set[Any] = set()
-        self.last_payload: str | None = None
+        self.metals = tuple(
+            i.metal for i in load_instruments(cfg.instruments_path)
+        )
+        self.clients: dict[Any, ClientQueue] = {}
+        # Live window per metal, seeded once and patched from the change feed
+        self.live: dict[str, LiveSeries] | None = None
+        self.live_since = 0
+        self.last_seq = 0
+        # Broadcast state: seq of the last message sent, points changed since
+        # and whether clients need a full snapshot instead of a delta
+        self.sent_seq = 0
+        self.pending: dict[str, set[int]] = {}
+        self.needs_snapshot = True
+        # FX change series covering the live window
+        self.fx_head: int | None = None
+        self.fx_ts = array("q")
+        self.fx_rate = array("d")
+        self._snapshot: str | None = None
+        self._ohlc_cache: dict[tuple[str, int], str] = {}
+        self.history = HistoryCache(cfg.history_cache_bytes)
+        self.reader = ReaderPool(cfg.db_path, cfg.reader_threads)
+        self._refresh_lock = asyncio.Lock()
+        # Reads in flight by request key, shared by identical requests
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    async def register(self, ws, resume: tuple[int, int | None] | None = None):
+        """
+        Register new WebSocket client and bring it up to date: just the
+        points it missed when it resumes with a recent (seq, fx) token,
+        else the live snapshot.
+        """
+        # Broadcasts queue up while the initial reply is in flight; deltas
+        # overlapping it are harmless since they carry current values
+        client = ClientQueue(ws)
+        self.clients[ws] = client
+        if self.live is None:
+            await self._refresh_live_async()
+            # Nobody was served before the seed, so deltas can follow it
+            self.needs_snapshot = False
+            self.sent_seq = self.last_seq
+        payload = await self._resume_payload(*resume) if resume else None
+        await ws.send(payload or self._live_payload())
+        if self.clients.get(ws) is client:
+            client.task = asyncio.create_task(self._writer(client))
+
+    @staticmethod
+    def _resume_token(ws) -> tuple[int, int | None] | None:
+        """(seq, fx) a reconnecting client passed as ?resume=N&fx=M."""
+        request = getattr(ws, "request", None)  # websockets >= 14
+        path = getattr(request, "path", None) or getattr(ws, "path", "")
+        query = parse_qs(urlparse(path or "").query)
+        try:
+            seq = int(query["resume"][0])
+            fx = int(query["fx"][0]) if query.get("fx") else None
+        except (KeyError, ValueError):
+            return None
+        return seq, fx
+
+    async def _resume_payload(self, seq: int, fx: int | None) -> str | None:
+        """
+        Delta from `seq` to the buffered head, built from the change feed's
+        keys and the in-memory window. None when a snapshot is needed: the
+        client is ahead of us, FX changed, the feed was pruned past `seq`,
+        or more than RESUME_MAX_CHANGES changes were missed.
+        """
+        head = self.last_seq
+        if self.live is None or seq > head or fx != self.fx_head:
+            return None
+        keys: set[tuple[str, int]] = set()
+        if seq < head:
+            found = await self.reader.run(self._read_resume_keys, seq, head)
+            if found is None or len(found) > RESUME_MAX_CHANGES:
+                return None
+            keys = found
 
-    async def register(self, ws):
-        """Register new WebSocket client and send initial data."""
-        self.clients.add(ws)
-        await ws.send(self._fetch_payload(0))
+        # Changes after `head` reach the client as queued broadcasts
+        out: Dict[str, Any] = {
+            "_seq": head,
+            "_prev": seq,
+            "_since": iso_sh(self.live_since),
+        }
+        for metal, ts in sorted(keys):
+            series = self.live.get(metal)
+            price = series.get(ts) if series is not None else None
+            if price is not None:
+                out.setdefault(metal, []).append(self._wire_point(ts, price))
+        return json.dumps(out, separators=(",", ":"), ensure_ascii=False)
+
+    def _read_resume_keys(
+        self, seq: int, head: int
+    ) -> set[tuple[str, int]] | None:
+        """Keys changed in (seq, head], or None if the feed no longer has
+        them all. Runs on a reader thread."""
+        try:
+            conn = self.reader.connection()
+            conn.execute("BEGIN")
+            try:
+                _, tail, _ = conn.execute(FEED_HEAD_SQL).fetchone()
+                if tail is None or tail > seq + 1:
+                    return None
+                rows = conn.execute(
+                    RESUME_SQL, (seq, head, RESUME_MAX_CHANGES + 1)
+                )
+                return {(metal, ts) for metal, ts in rows}
+            finally:
+                conn.rollback()
+        except Exception as e:
+            print(f"DB read error: {e}")
+            return None
 
     async def unregister(self, ws):
-        """Remove WebSocket client from active clients set."""
-        self.clients.discard(ws)
+        """Remove WebSocket client from active clients."""
+        client = self.clients.pop(ws, None)
+        if client is not None and client.task is not None:
+            if client.task is not asyncio.current_task():
+                client.task.cancel()
 
-    def _fetch_payload_for_time_range(self, start_offset_hours: int, end_offset_hours: int, metal: str) -> str:
-        """Return JSON string for specific metal and time range: { metal: [...] }"""
-        out: Dict[str, list] = {metal: []}
+    async def _read_once(
+        self, key: tuple, fn: Callable[..., Any], *args
+    ) -> Any:
+        """
+        Run `fn(*args)` on a reader thread, or join the read already in
+        flight for `key`, so a burst of identical requests costs one query
+        and one encode.
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.reader.run(fn, *args))
+            self._inflight[key] = future
+
+            def done(f: asyncio.Future) -> None:
+                if self._inflight.get(key) is f:
+                    del self._inflight[key]
+                if not f.cancelled():
+                    f.exception()  # retrieved even if every waiter left
 
+            future.add_done_callback(done)
+        # A waiter that disconnects must not cancel the others' read
+        return await asyncio.shield(future)
+
+    async def _send_frame(self, ws, data: bytes) -> None:
+        if SEND_BYTES_AS_TEXT:
+            await ws.send(data, text=True)
+        else:
+            await ws.send(data.decode())
+
+    async def _writer(self, client: ClientQueue) -> None:
+        """Drain one client's queue; drop the client if a send stalls."""
         try:
-            conn = sqlite3.connect(self.cfg.db_path)
-            conn.row_factory = sqlite3.Row
-
-            sql = """
-        SELECT timestamp, price_cny, usd_cny_rate
-        FROM prices
-        WHERE metal = ?
-          AND datetime(timestamp) >= datetime('now', ?)
-          AND datetime(timestamp) <= datetime('now', ?)
-        ORDER BY datetime(timestamp)
-      """
-            start_offset = f"-{int(start_offset_hours)} hours"
-            end_offset = f"-{int(end_offset_hours)} hours"
-            
-            rows = conn.execute(sql, (metal, start_offset, end_offset)).fetchall()
-            out[metal] = [
+            while True:
+                await client.wake.wait()
+                client.wake.clear()
+                while client.queue:
+                    data = client.queue.popleft()
+                    frames = [data]
+                    if data is RESYNC:
+                        # Candle updates queued behind it were dropped too
+                        frames = [self._live_payload().encode()] + [
+                            self._ohlc_payload(*key).encode()
+                            for key in sorted(client.ohlc)
+                        ]
+                    for frame in frames:
+                        await asyncio.wait_for(
+                            self._send_frame(client.ws, frame),
+                            self.cfg.slow_client_sec,
+                        )
+                client.behind_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self._drop(client)
+
+    async def _drop(self, client: ClientQueue) -> None:
+        """Disconnect a client that cannot keep up."""
+        await self.unregister(client.ws)
+        try:
+            await asyncio.wait_for(client.ws.close(), 1.0)
+        except Exception:
+            pass
+
+    def _fan_out(self, payload: str, snapshot: bool) -> None:
+        """Encode once and queue for every client without awaiting any."""
+        data = payload.encode()
+        limit = self.cfg.client_queue_max
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            client.push(data, snapshot, limit)
+            behind = client.behind_since
+            if behind is not None and now - behind > self.cfg.slow_client_sec:
+                asyncio.create_task(self._drop(client))
+
+    @staticmethod
+    def _sources(
+        conn: sqlite3.Connection,
+        metal: str,
+        since: int,
+        until: int,
+        max_points: int = 0,
+    ) -> tuple[int, int]:
+        """
+        (resolution, raw_from): rows before raw_from are read from the
+        rollups at that resolution, the rest from raw minutes. A max_points
+        span that the coarsest fitting rollup still covers with as many
+        buckets is read from it whole; otherwise rollups fill in only
+        where RAW_RETENTION_DAYS has expired the raw minutes.
+        """
+        if max_points:
+            for res in reversed(ROLLUP_RESOLUTIONS):
+                if (until - since) // res >= max_points:
+                    return res, until + 1
+        (first,) = conn.execute(RAW_START_SQL, (metal,)).fetchone()
+        raw_from = until + 1 if first is None else max(since, first)
+        return ROLLUP_RESOLUTIONS[0], raw_from
+
+    @staticmethod
+    def _read_rows(
+        conn: sqlite3.Connection,
+        metal: str,
+        since: int,
+        until: int,
+        sources: tuple[int, int],
+        limit: int = -1,
+    ) -> list[sqlite3.Row]:
+        """Up to `limit` rows (-1 = all) with since <= ts <= until, from
+        the rollups before raw_from and raw minutes from there on."""
+        res, raw_from = sources
+        rows: list[sqlite3.Row] = []
+        if since < raw_from:
+            rows = conn.execute(
+                ROLLUP_ROWS_SQL,
                 {
-                    "timestamp": r["timestamp"],
-                    "price_cny": r["price_cny"],
-                    "usd_cny_rate": r["usd_cny_rate"],
-                }
-                for r in rows
+                    "metal": metal,
+                    "res": res,
+                    "since": since,
+                    "until": min(until, raw_from - 1),
+                    "limit": limit,
+                },
+            ).fetchall()
+        if raw_from <= until and (limit < 0 or len(rows) < limit):
+            rows += conn.execute(
+                ROWS_PAGE_SQL,
+                (metal, max(since, raw_from), until, limit - len(rows)),
+            ).fetchall()
+        return rows
+
+    def _query_metal(
+        self,
+        conn: sqlite3.Connection,
+        metal: str,
+        since: int,
+        until: int,
+        max_points: int = 0,
+    ) -> list:
+        """Rows for one metal with since <= ts <= until (epoch seconds),
+        decimated to at most `max_points` when that is set."""
+        sources = self._sources(conn, metal, since, until, max_points)
+        rows = self._read_rows(conn, metal, since, until, sources)
+        if 0 < max_points < len(rows):
+            keep = decimate_minmax(
+                array("q", (r["ts"] for r in rows)),
+                array("d", (r["price_cny"] for r in rows)),
+                max_points,
+            )
+            rows = [rows[i] for i in keep]
+        return [self._wire_row(r) for r in rows]
+
+    @staticmethod
+    def _max_points(req: dict) -> int | None:
+        """A request's max_points (0 when absent), or None if invalid."""
+        n = req.get("max_points", 0)
+        if not isinstance(n, int) or isinstance(n, bool):
+            return None
+        if n == 0:
+            return 0
+        return min(max(n, MAX_POINTS_MIN), MAX_POINTS_LIMIT)
+
+    @staticmethod
+    def _wire_row(r: sqlite3.Row) -> dict:
+        return {
+            "timestamp": r["timestamp"],
+            "price_cny": r["price_cny"],
+            "usd_cny_rate": r["usd_cny_rate"],
+        }
+
+    async def _refresh_live_async(self) -> bool:
+        """
+        Bring the live window up to date from the change feed, returning
+        whether it changed. A quiet tick costs one indexed lookup; the
+        window is reseeded only on start or when the feed was pruned past
+        the last seen `seq`, and FX changes reload just the FX series. The
+        DB read runs on a reader thread.
+        """
+        async with self._refresh_lock:
+            read = await self.reader.run(self._read_feed)
+            return read is not None and self._apply_feed(read)
+
+    def _read_feed(self) -> FeedRead | None:
+        """Read what changed since the applied state; safe off the loop."""
+        last_seq, fx_known = self.last_seq, self.fx_head
+        seeded, live_since = self.live is not None, self.live_since
+        try:
+            conn = self.reader.connection()
+            conn.execute("BEGIN")  # one snapshot for head and rows
+            try:
+                head, tail, fx_head = conn.execute(FEED_HEAD_SQL).fetchone()
+                head = head or 0
+                since, until = self._window(0)
+                since = self._live_since(conn, since)
+
+                fx = None
+                if not seeded or fx_head != fx_known:
+                    fx = array("q"), array("d")
+                    for ts, rate in conn.execute(FX_SQL, (since,)):
+                        fx[0].append(ts)
+                        fx[1].append(rate)
+
+                seed = None
+                changes = []
+                if (
+                    not seeded
+                    or head < last_seq
+                    or (tail is not None and tail > last_seq + 1)
+                    or since < live_since  # window grew backwards
+                ):
+                    seed = {}
+                    for metal in self.metals:
+                        series = LiveSeries(since)
+                        for ts, price in conn.execute(
+                            SERIES_SQL, (metal, since, until)
+                        ):
+                            series.ts.append(ts - since)
+                            series.price.append(price)
+                        seed[metal] = series
+                else:
+                    changes = conn.execute(
+                        CHANGES_SQL, (last_seq, head)
+                    ).fetchall()
+            finally:
+                conn.rollback()
+
+        except Exception as e:
+            print(f"DB read error: {e}")
+            return None
+
+        return FeedRead(head, fx_head, since, fx, seed, changes)
+
+    @staticmethod
+    def _live_since(conn: sqlite3.Connection, fallback: int) -> int:
+        """Start of the last LIVE_SESSIONS sessions, so Mondays and
+        post-holiday windows hold exactly what the charts draw."""
+        try:
+            (since,) = conn.execute(
+                LIVE_SINCE_SQL, (LIVE_SESSIONS,)
+            ).fetchone()
+        except sqlite3.OperationalError:  # index not created yet
+            return fallback
+        return fallback if since is None else since
+
+    def _apply_feed(self, read: FeedRead) -> bool:
+        """Apply a feed read to the live window; runs on the event loop."""
+        changed = False
+        if read.fx is not None:
+            self.fx_ts, self.fx_rate = read.fx
+            # A new rate re-rates stored points: resend everything
+            self.needs_snapshot = changed = True
+            # The first rate also back-fills every earlier point
+            first = self.fx_head is None or read.fx_head is None
+            self.history.invalidate(None if first else read.fx_head)
+
+        if read.seed is not None:
+            self.live = read.seed
+            self.needs_snapshot = changed = True
+            self.history.invalidate()  # changes since last_seq are unknown
+        elif self.live is not None:
+            if read.changes:
+                self.history.invalidate(min(ts for _, ts, _ in read.changes))
+            for metal, ts, price in read.changes:
+                if metal in self.live and ts >= read.since:
+                    self.live[metal].upsert(ts, price)
+                    self.pending.setdefault(metal, set()).add(ts)
+                    changed = True
+            for series in self.live.values():
+                changed |= series.expire(read.since)
+
+        if changed or read.head != self.last_seq:
+            self._snapshot = None  # carries `_seq`
+            self._ohlc_cache = {}
+        self.last_seq, self.fx_head = read.head, read.fx_head
+        self.live_since = read.since
+        return changed
+
+    def _fx_at(self, ts: int) -> float | None:
+        """FX rate in effect at `ts`, else the earliest known rate."""
+        i = bisect_right(self.fx_ts, ts) - 1
+        if i >= 0:
+            return self.fx_rate[i]
+        return self.fx_rate[0] if self.fx_rate else None
+
+    def _wire_point(self, ts: int, price: float) -> dict:
+        return {
+            "timestamp": iso_sh(ts),
+            "price_cny": price,
+            "usd_cny_rate": self._fx_at(ts),
+        }
+
+    def _live_payload(self) -> str:
+        """
+        Serialized live window: { _seq: N, _fx: M, gold: [...], ... },
+        rebuilt only after it changes. `_seq` and `_fx` (latest FX change)
+        form the resume token clients present when reconnecting.
+        """
+        if self._snapshot is None:
+            out: Dict[str, Any] = {
+                "_seq": self.last_seq,
+                "_fx": self.fx_head,
+            }
+            for metal, series in (self.live or {}).items():
+                out[metal] = [
+                    self._wire_point(ts, price)
+                    for ts, price in series.points()
+                ]
+            self._snapshot = json.dumps(
+                out, separators=(",", ":"), ensure_ascii=False
+            )
+        return self._snapshot
+
+    def _delta_payload(self) -> str:
+        """
+        Points appended or revised since the last broadcast:
+        { _seq: N, _prev: M, _since: window start, gold: [...] }.
+        A client holding seq >= _prev applies it; otherwise it resyncs.
+        """
+        out: Dict[str, Any] = {
+            "_seq": self.last_seq,
+            "_prev": self.sent_seq,
+            "_since": iso_sh(self.live_since),
+        }
+        for metal, stamps in self.pending.items():
+            series = self.live[metal]
+            points = ((ts, series.get(ts)) for ts in sorted(stamps))
+            out[metal] = [
+                self._wire_point(ts, price)
+                for ts, price in points
+                if price is not None
             ]
+        return json.dumps(out, separators=(",", ":"), ensure_ascii=False)
+
+    def _candles(
+        self, metal: str, interval: int, lo: int | None, hi: int | None
+    ) -> list[dict]:
+        """OHLC candles of `interval` minutes from the live window points
+        with lo <= ts < hi, bucketed on Shanghai wall-clock boundaries."""
+        series = (self.live or {}).get(metal)
+        if series is None:
+            return []
+        step = interval * 60
+        out: list[dict] = []
+        bucket = last_ts = None
+        candle: dict = {}
+        for ts, price in series.points(lo, hi):
+            start = bucket_start(ts, step)
+            if start != bucket:
+                if candle:
+                    candle["fx_close"] = self._fx_at(last_ts)
+                bucket = start
+                candle = {
+                    "date": iso_sh(start),
+                    "open": price,
+                    "high": price,
+                    "low": price,
+                    "close": price,
+                }
+                out.append(candle)
+            elif price > candle["high"]:
+                candle["high"] = price
+            elif price < candle["low"]:
+                candle["low"] = price
+            candle["close"] = price
+            last_ts = ts
+        if candle:
+            candle["fx_close"] = self._fx_at(last_ts)
+        return out
+
+    def _ohlc_header(self, interval: int) -> Dict[str, Any]:
+        # Candles before `_first` slid out of the live window
+        return {
+            "_ohlc": interval,
+            "_first": iso_sh(bucket_start(self.live_since, interval * 60)),
+        }
 
-            conn.close()
+    def _ohlc_payload(self, metal: str, interval: int) -> str:
+        """
+        Every candle in the live window:
+        { _ohlc: minutes, _first: oldest bucket, metal: [...] },
+        rebuilt only after the window changes.
+        """
+        key = (metal, interval)
+        cached = self._ohlc_cache.get(key)
+        if cached is None:
+            out = self._ohlc_header(interval)
+            out[metal] = self._candles(metal, interval, None, None)
+            cached = json.dumps(out, separators=(",", ":"), ensure_ascii=False)
+            self._ohlc_cache[key] = cached
+        return cached
+
+    def _ohlc_update(self, metal: str, interval: int, stamps) -> str:
+        """
+        Candles touched by the points at `stamps`, usually just the one
+        still forming, plus the oldest candle, which expiry may trim:
+        { _ohlc: minutes, _first: oldest bucket, _update: true, metal: [...] }.
+        """
+        step = interval * 60
+        starts = {bucket_start(ts, step) for ts in stamps}
+        starts.add(bucket_start(self.live_since, step))
+        out = self._ohlc_header(interval)
+        out["_update"] = True
+        out[metal] = [
+            c
+            for start in sorted(starts)
+            for c in self._candles(metal, interval, start, start + step)
+        ]
+        return json.dumps(out, separators=(",", ":"), ensure_ascii=False)
+
+    def _fan_out_ohlc(self, pending: dict[str, set[int]], full: bool) -> None:
+        """Queue candle updates, encoded once per subscribed series."""
+        subs: dict[tuple[str, int], list[ClientQueue]] = {}
+        for client in self.clients.values():
+            for key in client.ohlc:
+                subs.setdefault(key, []).append(client)
+        limit = self.cfg.client_queue_max
+        for (metal, interval), clients in subs.items():
+            if full:
+                payload = self._ohlc_payload(metal, interval)
+            elif metal in pending:
+                payload = self._ohlc_update(metal, interval, pending[metal])
+            else:
+                continue
+            data = payload.encode()
+            for client in clients:
+                client.push(data, False, limit)
+
+    def _ohlc_request(self, ws, req: dict) -> None:
+        """
+        Handle {"type": "ohlc", "metal": ..., "interval": minutes}: queue
+        the window's candles and, unless "subscribe" is false, keep
+        pushing updates for that series.
+        """
+        client = self.clients.get(ws)
+        metal = req.get("metal")
+        interval = req.get("interval", 5)
+        if (
+            client is None
+            or metal not in self.metals
+            or not isinstance(interval, int)
+            or isinstance(interval, bool)
+            or not 1 <= interval <= OHLC_MAX_INTERVAL_MIN
+        ):
+            return
+        key = (metal, interval)
+        if not req.get("subscribe", True):
+            client.ohlc.discard(key)
+        elif len(client.ohlc) < OHLC_MAX_SUBSCRIPTIONS:
+            client.ohlc.add(key)
+        # Queued, so it reaches the client ahead of any update
+        client.push(
+            self._ohlc_payload(metal, interval).encode(),
+            False,
+            self.cfg.client_queue_max,
+        )
+
+    def _session_summaries(
+        self, conn: sqlite3.Connection, metal: str, since: int, until: int
+    ) -> list[dict]:
+        return [
+            {
+                "id": r["session_id"],
+                "kind": r["kind"],
+                "start": iso_sh(r["start_ts"]),
+                "end": iso_sh(r["end_ts"]),
+                "first": iso_sh(r["first_ts"]),
+                "last": iso_sh(r["last_ts"]),
+                "open": r["open"],
+                "high": r["high"],
+                "low": r["low"],
+                "close": r["close"],
+            }
+            for r in conn.execute(SESSION_SUMMARY_SQL, (metal, since, until))
+        ]
+
+    def _history_frame(
+        self,
+        metal: str,
+        since: int,
+        until: int,
+        max_points: int,
+        start: int,
+        part: int,
+    ) -> tuple[bytes, int | None]:
+        """
+        Encode frame `part` of the reply for since <= ts <= until, reading
+        rows from `start` on; returns it with the ts the next frame starts
+        at, or None once the reply is complete. Runs on a reader thread.
+
+        A reply that fits one frame is
+        { _range: [start, end], _sessions: [...], metal: [...] }. Longer ones
+        are streamed as { _range, _part: k, metal: [...] } frames of up to
+        HISTORY_CHUNK_ROWS rows; the last adds _done, _parts and _sessions.
+        """
+        conn = self.reader.connection()
+        out: Dict[str, Any] = {"_range": [iso_sh(since), iso_sh(until)]}
+        if max_points:
+            # Decimation needs the whole range; its output is bounded
+            rows = self._query_metal(conn, metal, since, until, max_points)
+            more = False
+        else:
+            page = self._read_rows(
+                conn,
+                metal,
+                start,
+                until,
+                self._sources(conn, metal, since, until),
+                HISTORY_CHUNK_ROWS + 1,
+            )
+            more = len(page) > HISTORY_CHUNK_ROWS
+            page = page[:HISTORY_CHUNK_ROWS]
+            rows = [self._wire_row(r) for r in page]
+
+        if more or part:
+            out["_part"] = part
+        if not more:
+            if part:
+                out["_done"] = True
+                out["_parts"] = part + 1
+            out["_sessions"] = self._session_summaries(
+                conn, metal, since, until
+            )
+        out[metal] = rows
+        payload = json.dumps(out, separators=(",", ":"), ensure_ascii=False)
+        return payload.encode(), page[-1]["ts"] + 1 if more else None
+
+    async def _history_request(self, ws, req: dict) -> None:
+        """
+        Handle {"type": "history", "metal": ..., "start": t, "end": t} or
+        {"type": "history", "metal": ..., "session": id}. Times are epoch
+        seconds or ISO strings; the range is widened to whole sessions so
+        equal requests share one cached response. "max_points" caps the
+        rows returned for long spans.
+        """
+        metal = req.get("metal")
+        max_points = self._max_points(req)
+        if metal not in self.metals or max_points is None:
+            return
+        try:
+            if "session" in req:
+                since, until = session_range(str(req["session"]))
+            else:
+                since, until = snap_to_sessions(
+                    parse_time(req["start"]), parse_time(req["end"])
+                )
+        except (KeyError, ValueError, TypeError) as e:
+            print(f"Bad history request: {e}")
+            return
+        if until - since > HISTORY_MAX_SEC:
+            return
+        await self._send_history(ws, metal, since, until, max_points)
+
+    async def _sessions_request(self, ws, req: dict) -> None:
+        """
+        Handle {"type": "sessions", "metal": ..., "last": N}: the history
+        reply for the metal's newest N sessions, found with one lookup on
+        the session index.
+        """
+        metal = req.get("metal")
+        last = req.get("last", LIVE_SESSIONS)
+        max_points = self._max_points(req)
+        if (
+            metal not in self.metals
+            or max_points is None
+            or not isinstance(last, int)
+            or isinstance(last, bool)
+            or not 1 <= last <= SESSIONS_MAX_LAST
+        ):
+            return
+        try:
+            since, until = await self.reader.run(
+                self._last_sessions_range, metal, last
+            )
+        except Exception as e:
+            print(f"DB read error: {e}")
+            return
+        if since is not None:
+            await self._send_history(ws, metal, since, until, max_points)
+
+    def _last_sessions_range(
+        self, metal: str, last: int
+    ) -> tuple[int | None, int | None]:
+        """(start, end) spanning a metal's newest `last` sessions."""
+        conn = self.reader.connection()
+        return tuple(conn.execute(LAST_SESSIONS_SQL, (metal, last)).fetchone())
+
+    async def _send_history(
+        self, ws, metal: str, since: int, until: int, max_points: int = 0
+    ):
+        """Send the history reply for a snapped range, cached by range."""
+        if until < since:
+            return
+
+        key = (metal, since, until, max_points)
+        cached = self.history.get(key)
+        if cached is not None:
+            for frame in cached:
+                await self._send_frame(ws, frame)
+            return
+
+        # Read, encode and send one bounded frame at a time; each page is
+        # its own keyset query, so no cursor is held across sends
+        generation = self.history.generation
+        frames: list[bytes] | None = []
+        nbytes, start, part = 0, since, 0
+        while start is not None:
+            # Keyed by generation so requests after a write never join a
+            # read that may predate it
+            read = (metal, since, until, max_points, start, part, generation)
+            try:
+                frame, start = await self._read_once(
+                    ("history", *read),
+                    self._history_frame,
+                    metal,
+                    since,
+                    until,
+                    max_points,
+                    start,
+                    part,
+                )
+            except Exception as e:
+                print(f"DB read error: {e}")
+                return
+            await self._send_frame(ws, frame)
+            part += 1
+            if frames is not None:
+                frames.append(frame)
+                nbytes += len(frame)
+                if nbytes > self.history.max_entry_bytes:
+                    frames = None  # too big to cache; stop holding it
+        # Skip caching a result that a concurrent write made stale
+        if frames is not None and self.history.generation == generation:
+            self.history.put(key, tuple(frames))
+
+    def _fetch_payload_for_time_range(
+        self,
+        start_offset_hours: int,
+        end_offset_hours: int,
+        metal: str,
+        max_points: int = 0,
+    ) -> str:
+        """Return JSON string for specific metal and time range: { metal: [...] }"""
+        out: Dict[str, list] = {metal: []}
+
+        try:
+            conn = self.reader.connection()
+
+            now = int(time.time())
+            since = now - int(start_offset_hours) * 3600
+            until = now - int(end_offset_hours) * 3600
+            out[metal] = self._query_metal(
+                conn, metal, since, until, max_points
+            )
 
         except Exception as e:
             print(f"DB read error: {e}")
@@ -77,55 +1225,12 @@ class DataServer:
         out: Dict[str, list] = {metal: []}
 
         try:
-            conn = sqlite3.connect(self.cfg.db_path)
-            conn.row_factory = sqlite3.Row
-
-            if offset_hours == 0:
-                # Live data - need enough history for both night and day sessions
-                sql = """
-            SELECT timestamp, price_cny, usd_cny_rate
-            FROM prices
-            WHERE metal = ?
-              AND datetime(timestamp) >= datetime('now', ?)
-            ORDER BY datetime(timestamp)
-          """
-                lookback = "-36 hours"  # Ensure we get both sessions
-                
-                rows = conn.execute(sql, (metal, lookback)).fetchall()
-                out[metal] = [
-                    {
-                        "timestamp": r["timestamp"],
-                        "price_cny": r["price_cny"],
-                        "usd_cny_rate": r["usd_cny_rate"],
-                    }
-                    for r in rows
-                ]
-            else:
-                # Historical data - 36 hour window
-                sql = """
-            SELECT timestamp, price_cny, usd_cny_rate
-            FROM prices
-            WHERE metal = ?
-              AND datetime(timestamp) >= datetime('now', ?)
-              AND datetime(timestamp) < datetime('now', ?)
-            ORDER BY datetime(timestamp)
-          """
-                start_offset = f"-{int(36 + offset_hours)} hours"
-                end_offset = f"-{offset_hours} hours"
-                
-                rows = conn.execute(sql, (metal, start_offset, end_offset)).fetchall()
-                out[metal] = [
-                    {
-                        "timestamp": r["timestamp"],
-                        "price_cny": r["price_cny"],
-                        "usd_cny_rate": r["usd_cny_rate"],
-                    }
-                    for r in rows
-                ]
-                
-                out["_offset"] = offset_hours
+            conn = self.reader.connection()
 
-            conn.close()
+            since, until = self._window(offset_hours)
+            out[metal] = self._query_metal(conn, metal, since, until)
+            if offset_hours != 0:
+                out["_offset"] = offset_hours
 
         except Exception as e:
             print(f"DB read error: {e}")
@@ -133,111 +1238,163 @@ class DataServer:
         return json.dumps(out, separators=(",", ":"), ensure_ascii=False)
 
     def _fetch_payload(self, offset_hours: int = 0) -> str:
-        """Return JSON string: { gold: [...], silver: [...] }"""
-        out: Dict[str, list] = {"gold": [], "silver": []}
+        """Return JSON string: { gold: [...], silver: [...], ... }"""
+        out: Dict[str, list] = {metal: [] for metal in self.metals}
 
         try:
-            conn = sqlite3.connect(self.cfg.db_path)
-            conn.row_factory = sqlite3.Row
-
-            if offset_hours == 0:
-                # Live data - need enough history for both night and day sessions
-                sql = """
-            SELECT timestamp, price_cny, usd_cny_rate
-            FROM prices
-            WHERE metal = ?
-              AND datetime(timestamp) >= datetime('now', ?)
-            ORDER BY datetime(timestamp)
-          """
-                lookback = "-36 hours"  # Ensure we get both sessions
-                
-                for metal in ("gold", "silver"):
-                    rows = conn.execute(sql, (metal, lookback)).fetchall()
-                    out[metal] = [
-                        {
-                            "timestamp": r["timestamp"],
-                            "price_cny": r["price_cny"],
-                            "usd_cny_rate": r["usd_cny_rate"],
-                        }
-                        for r in rows
-                    ]
-            else:
-                # Historical data - 36 hour window
-                sql = """
-            SELECT timestamp, price_cny, usd_cny_rate
-            FROM prices
-            WHERE metal = ?
-              AND datetime(timestamp) >= datetime('now', ?)
-              AND datetime(timestamp) < datetime('now', ?)
-            ORDER BY datetime(timestamp)
-          """
-                start_offset = f"-{int(36 + offset_hours)} hours"
-                end_offset = f"-{offset_hours} hours"
-                
-                for metal in ("gold", "silver"):
-                    rows = conn.execute(sql, (metal, start_offset, end_offset)).fetchall()
-                    out[metal] = [
-                        {
-                            "timestamp": r["timestamp"],
-                            "price_cny": r["price_cny"],
-                            "usd_cny_rate": r["usd_cny_rate"],
-                        }
-                        for r in rows
-                    ]
-                
-                out["_offset"] = offset_hours
+            conn = self.reader.connection()
 
-            conn.close()
+            since, until = self._window(offset_hours)
+            for metal in self.metals:
+                out[metal] = self._query_metal(conn, metal, since, until)
+            if offset_hours != 0:
+                out["_offset"] = offset_hours
 
         except Exception as e:
             print(f"DB read error: {e}")
 
         return json.dumps(out, separators=(",", ":"), ensure_ascii=False)
 
-    async def broadcast_updates(self):
-        """Continuously fetch data and broadcast updates to clients."""
-        while True:
-            payload = self._fetch_payload(0)
+    @staticmethod
+    def _window(offset_hours: int) -> tuple[int, int]:
+        """Epoch bounds of the 36 hour window ending offset_hours ago."""
+        now = int(time.time())
+        if offset_hours == 0:
+            # Live data - need enough history for both night and day sessions
+            return now - LIVE_WINDOW_SEC, now
+        end = now - int(offset_hours) * 3600
+        # Historical windows exclude their end instant
+        return end - LIVE_WINDOW_SEC, end - 1
 
-            if payload != self.last_payload:
-                self.last_payload = payload
+    def _notify_path(self) -> str:
+        return (
+            self.cfg.notify_path
+            or os.environ.get("SHANGHAI_NOTIFY_SOCK")
+            or self.cfg.db_path + ".notify"
+        )
 
-                if self.clients:
-                    dead = []
-                    for ws in self.clients:
-                        try:
-                            await ws.send(payload)
-                        except Exception:
-                            dead.append(ws)
-                    for ws in dead:
-                        self.clients.discard(ws)
+    def _open_notify_socket(self) -> socket.socket | None:
+        """Bind the datagram socket the collector pings after commits."""
+        path = self._notify_path()
+        try:
+            # Replace a stale socket from a previous run, never a real file
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            sock.setblocking(False)
+            return sock
+        except (AttributeError, OSError) as e:
+            print(f"Notify socket unavailable ({e}); polling instead")
+            return None
 
-            await asyncio.sleep(self.cfg.poll_sec)
+    @staticmethod
+    def _drain_notify(sock: socket.socket, wake: asyncio.Event) -> None:
+        """Coalesce all pending pings into one wake-up."""
+        try:
+            while sock.recv(64):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        wake.set()
+
+    async def broadcast_updates(self):
+        """Fan out updates when the collector pings, polling as a fallback."""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        sock = self._open_notify_socket()
+        if sock is not None:
+            loop.add_reader(sock.fileno(), self._drain_notify, sock, wake)
+        timeout = self.cfg.fallback_poll_sec if sock else self.cfg.poll_sec
+        try:
+            while True:
+                await self._publish()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+        finally:
+            if sock is not None:
+                loop.remove_reader(sock.fileno())
+                sock.close()
+                try:
+                    os.unlink(self._notify_path())
+                except OSError:
+                    pass
+
+    async def _publish(self):
+        """Broadcast a delta, or a snapshot after a reload, on changes."""
+        if not await self._refresh_live_async():
+            return
+        snapshot = self.needs_snapshot
+        if snapshot:
+            payload = self._live_payload()
+        else:
+            payload = self._delta_payload()
+        pending = self.pending
+        self.needs_snapshot = False
+        self.pending = {}
+        self.sent_seq = self.last_seq
+
+        if self.clients:
+            self._fan_out(payload, snapshot)
+            self._fan_out_ohlc(pending, snapshot)
 
     async def handle_client(self, ws):
         """Handle WebSocket client connection lifecycle."""
-        await self.register(ws)
+        await self.register(ws, self._resume_token(ws))
         try:
             async for message in ws:
                 try:
                     req = json.loads(message)
-                    if req.get("type") == "fetch":
+                    if req.get("type") == "resync":
+                        # Client saw a gap in the delta sequence
+                        client = self.clients.get(ws)
+                        if client is not None:
+                            client.push(RESYNC, True, 0)
+                    elif req.get("type") == "ohlc":
+                        self._ohlc_request(ws, req)
+                    elif req.get("type") == "history":
+                        await self._history_request(ws, req)
+                    elif req.get("type") == "sessions":
+                        await self._sessions_request(ws, req)
+                    elif req.get("type") == "fetch":
                         metal = req.get("metal")
+                        if metal and metal not in self.metals:
+                            continue
                         if "start_offset_hours" in req and "end_offset_hours" in req:
                             # New precise time range request
-                            payload = self._fetch_payload_for_time_range(
-                                req["start_offset_hours"], 
-                                req["end_offset_hours"], 
-                                metal
+                            fetch = (
+                                self._fetch_payload_for_time_range,
+                                req["start_offset_hours"],
+                                req["end_offset_hours"],
+                                metal,
+                                self._max_points(req) or 0,
                             )
                         elif "offset_hours" in req:
                             # Legacy offset request
                             if metal:
-                                payload = self._fetch_payload_for_metal(req["offset_hours"], metal)
+                                fetch = (
+                                    self._fetch_payload_for_metal,
+                                    req["offset_hours"],
+                                    metal,
+                                )
                             else:
-                                payload = self._fetch_payload(req["offset_hours"])
+                                fetch = (
+                                    self._fetch_payload,
+                                    req["offset_hours"],
+                                )
                         else:
                             continue
+                        # Queries run on a reader thread, off the loop;
+                        # identical ones in flight since the last change
+                        # share one read
+                        fn, *args = fetch
+                        payload = await self._read_once(
+                            ("fetch", self.last_seq, fn.__name__, *args),
+                            *fetch,
+                        )
                         await ws.send(payload)
                 except Exception as e:
                     print(f"Message error: {e}")
@@ -261,8 +1418,11 @@ async def main():
         target=start_http_server, args=(cfg.http_port,), daemon=True
     ).start()
 
-    async with websockets.serve(srv.handle_client, cfg.host, cfg.ws_port):
-        await srv.broadcast_updates()
+    try:
+        async with websockets.serve(srv.handle_client, cfg.host, cfg.ws_port):
+            await srv.broadcast_updates()
+    finally:
+        srv.reader.close()
 
 
 if __name__ == "__main__":